@@ -1,4 +1,34 @@
+import argparse
+
 import shorten_paper.client
 
 if __name__ == "__main__":
-    shorten_paper.client.main()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(prog="python -m shorten_paper", description="Shorten the papers.")
+    arg_parser.add_argument("--manifest", default=None,
+                            help="A .yaml/.yml or .jsonl manifest of the files' instructions and settings, "
+                                 "to run without asking for them. Defaults to MANIFEST_FILE.")
+    arg_parser.add_argument("--watch", action="store_true",
+                            help="Keep running, shortening every file added to or changed in the input directory.")
+    arg_parser.add_argument("--serve", action="store_true",
+                            help="Serve an HTTP API to submit documents and poll or stream their results.")
+    arg_parser.add_argument("--host", default=None, help="The address to serve on. Defaults to SERVER_HOST.")
+    arg_parser.add_argument("--port", type=int, default=None, help="The port to serve on. Defaults to SERVER_PORT.")
+    arg_parser.add_argument("--plan", action="store_true",
+                            help="Estimate the requests, tokens, cost and time of shortening the input directory, "
+                                 "without calling the API.")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="Files shortened at the same time with --watch or --serve. "
+                                 "Defaults to WATCH_WORKERS or SERVER_WORKERS.")
+    args = arg_parser.parse_args()
+    if args.plan:
+        from shorten_paper.planner import run_plan
+        run_plan(args.manifest)
+    elif args.serve:
+        from shorten_paper.server import run_server
+        run_server(**{key: value for key, value in
+                      {"host": args.host, "port": args.port, "workers": args.workers}.items() if value is not None})
+    elif args.watch:
+        from shorten_paper.watcher import watch
+        watch(workers=args.workers, manifest_path=args.manifest)
+    else:
+        shorten_paper.client.main(args.manifest)
@@ -0,0 +1,323 @@
+"""
+Benchmarks of the tokenizer, the chunker and the file parsers over synthetic corpora.
+
+Run `python -m shorten_paper.benchmark --output bench.json`, then compare two commits with
+`python -m shorten_paper.benchmark --output new.json --compare old.json`.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+from xml.sax.saxutils import escape
+
+import yaml
+
+from shorten_paper.config import Config
+from shorten_paper.file_operations_utils import extension_to_parser, read_textual_file
+from shorten_paper.lang_model.text_processing import (
+    count_string_tokens, request_token_budget, split_with_next_text, split_with_previous_text,
+    truncate_by_token_cnt
+)
+from shorten_paper.logs import logger
+
+CFG = Config()
+
+SIZE_UNITS = {"KB": 1024, "MB": 1024 * 1024, "GB": 1024 * 1024 * 1024}
+DEFAULT_SIZES = "10KB,100KB,1MB,10MB,100MB"
+SCRIPTS = ("ascii", "cjk")
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * multiplier)
+    return int(size)
+
+
+def _random_word(rng: random.Random, script: str) -> str:
+    if script == "ascii":
+        return "".join(rng.choice("etaoinshrdlcumwfgypbvkjxqz") for _ in range(rng.randint(1, 10)))
+    # Hangul syllables and CJK unified ideographs, as in Korean, Chinese and Japanese papers.
+    first, last = rng.choice(((0xAC00, 0xD7A3), (0x4E00, 0x9FFF)))
+    return "".join(chr(rng.randint(first, last)) for _ in range(rng.randint(1, 4)))
+
+
+def make_paragraphs(size_bytes: int, script: str, seed: int = 0) -> list[str]:
+    """Returns synthetic paragraphs of about `size_bytes` UTF-8 bytes in total."""
+    rng = random.Random(seed)
+    full_stop = "." if script == "ascii" else "。"
+    block = []
+    block_bytes = 0
+    # Build a varied block of up to 64 KB, then repeat it up to the size.
+    while block_bytes < min(size_bytes, 64 * 1024):
+        sentences = [" ".join(_random_word(rng, script) for _ in range(rng.randint(5, 20))) + full_stop
+                     for _ in range(rng.randint(3, 8))]
+        paragraph = " ".join(sentences)
+        block.append(paragraph)
+        block_bytes += len(paragraph.encode("utf-8")) + 1
+    paragraphs = []
+    total_bytes = 0
+    while total_bytes < size_bytes:
+        for paragraph in block:
+            paragraphs.append(paragraph)
+            total_bytes += len(paragraph.encode("utf-8")) + 1
+            if total_bytes >= size_bytes:
+                break
+    return paragraphs
+
+
+def _write_pdf(file_path: str, paragraphs: list[str]) -> None:
+    """Writes a minimal PDF of Helvetica text lines, 50 lines per page."""
+    lines = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        for i in range(0, len(words), 14):
+            lines.append(" ".join(words[i:i + 14]))
+    pages = [lines[i:i + 50] for i in range(0, len(lines), 50)] or [[]]
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for page_lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in page_lines]
+        stream = ("BT /F1 9 Tf 12 TL 36 760 Td " + " ".join(f"({line}) '" for line in escaped) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(page_refs), len(page_refs))
+
+    with open(file_path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for obj_num, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (obj_num, obj))
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+
+
+def _write_docx(file_path: str, paragraphs: list[str]) -> None:
+    import docx
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(file_path)
+
+
+def write_fixture(file_path: str, paragraphs: list[str], script: str) -> str | None:
+    """
+    Writes the paragraphs in the format of the file extension.
+
+    Returns:
+        str | None: The reason the format was skipped, or None if it was written.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".pdf":
+        if script != "ascii":
+            return "the synthetic PDF writer only embeds the standard Helvetica font"
+        _write_pdf(file_path, paragraphs)
+        return None
+    if extension in (".doc", ".docx"):
+        _write_docx(file_path, paragraphs)
+        return None
+
+    if extension in (".txt", ".csv"):
+        separator = "," if extension == ".csv" else " "
+        content = "\n".join(separator.join(paragraph.split()) for paragraph in paragraphs)
+    elif extension == ".json":
+        content = json.dumps({"title": "Benchmark", "paragraphs": paragraphs}, ensure_ascii=False)
+    elif extension == ".xml":
+        content = "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<document>\n" + \
+                  "\n".join(f"<p>{escape(paragraph)}</p>" for paragraph in paragraphs) + "\n</document>"
+    elif extension == ".yaml":
+        content = yaml.safe_dump({"title": "Benchmark", "paragraphs": paragraphs}, allow_unicode=True)
+    elif extension == ".html":
+        content = "<html><head><meta charset=\"utf-8\"><title>Benchmark</title></head><body>\n" + \
+                  "\n".join(f"<p>{escape(paragraph)}</p>" for paragraph in paragraphs) + "\n</body></html>"
+    elif extension == ".md":
+        content = "# Benchmark\n\n" + "\n\n".join(paragraphs)
+    elif extension == ".tex":
+        content = "\\documentclass{article}\n\\begin{document}\n\\section{Benchmark}\n" + \
+                  "\n\n".join(paragraphs) + "\n\\end{document}"
+    else:
+        return f"no synthetic writer for {extension} files"
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return None
+
+
+def time_call(function: Callable, repeat: int, setup: Callable = None) -> list[float]:
+    """Returns the wall time of each of `repeat` calls, running `setup` untimed before each."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def _result(name: str, script: str, size_bytes: int, timings: list[float]) -> dict:
+    median = statistics.median(timings)
+    return {
+        "name": name,
+        "script": script,
+        "size_bytes": size_bytes,
+        "repeat": len(timings),
+        "seconds_min": min(timings),
+        "seconds_median": median,
+        "mb_per_second": size_bytes / (1024 * 1024) / median if median > 0 else None,
+    }
+
+
+def text_processing_benchmarks(text: str, lang_model: str) -> dict[str, tuple[Callable, Callable | None]]:
+    """Returns the text processing benchmarks over `text`, by name, as (function, untimed setup) pairs."""
+    text_token_len = request_token_budget(lang_model)
+    return {
+        "split_with_next_text": (
+            lambda: split_with_next_text(text, lang_model, text_token_len, CFG.next_text_token_ratio), None),
+        "split_with_previous_text": (
+            lambda: split_with_previous_text(text, lang_model, text_token_len, CFG.previous_text_token_ratio),
+            None),
+        "truncate_by_token_cnt[from_back]": (
+            lambda: truncate_by_token_cnt(text, lang_model, text_token_len, True), None),
+        "truncate_by_token_cnt[from_front]": (
+            lambda: truncate_by_token_cnt(text, lang_model, text_token_len, False), None),
+        "count_string_tokens": (lambda: count_string_tokens(text, lang_model), None),
+    }
+
+
+def run_benchmarks(
+        sizes: list[int], scripts: list[str], repeat: int, name_filter: str = "", lang_model: str = CFG.lang_model_name
+) -> list[dict]:
+    results = []
+    warmed_up = set()
+    with tempfile.TemporaryDirectory(prefix="shorten_paper_benchmark_") as fixture_dir:
+        for script in scripts:
+            for size_bytes in sizes:
+                paragraphs = make_paragraphs(size_bytes, script)
+                text = "\n".join(paragraphs)
+
+                for name, (function, setup) in text_processing_benchmarks(text, lang_model).items():
+                    if name_filter not in name:
+                        continue
+                    results.append(_result(name, script, size_bytes, time_call(function, repeat, setup)))
+                    print(_format_result(results[-1]), flush=True)
+
+                for extension in extension_to_parser:
+                    name = f"parser[{extension}]"
+                    if name_filter not in name:
+                        continue
+                    file_path = os.path.join(fixture_dir, f"{script}_{size_bytes}{extension}")
+                    skipped = write_fixture(file_path, paragraphs, script)
+                    if skipped is not None:
+                        results.append({"name": name, "script": script, "size_bytes": size_bytes, "skipped": skipped})
+                        continue
+                    if extension not in warmed_up:
+                        # Parser backends are imported on first use, which should not be timed.
+                        warm_up_path = os.path.join(fixture_dir, f"warm_up{extension}")
+                        write_fixture(warm_up_path, make_paragraphs(1024, "ascii"), "ascii")
+                        read_textual_file(warm_up_path)
+                        warmed_up.add(extension)
+                    fixture_bytes = os.path.getsize(file_path)
+                    results.append(_result(name, script, fixture_bytes,
+                                           time_call(lambda: read_textual_file(file_path), repeat)))
+                    results[-1]["corpus_bytes"] = size_bytes
+                    print(_format_result(results[-1]), flush=True)
+                    os.remove(file_path)
+    return results
+
+
+def _format_result(result: dict) -> str:
+    return (f"{result['name']:<36} {result['script']:<6} {result['size_bytes']:>12,} B  "
+            f"median {result['seconds_median']:>10.4f} s  min {result['seconds_min']:>10.4f} s")
+
+
+def _result_key(result: dict) -> tuple:
+    return result["name"], result["script"], result.get("corpus_bytes", result["size_bytes"])
+
+
+def compare(results: list[dict], baseline_results: list[dict]) -> list[dict]:
+    """Returns the median time ratio of every result against the same benchmark of the baseline."""
+    baseline = {_result_key(result): result for result in baseline_results if "skipped" not in result}
+    comparisons = []
+    for result in results:
+        base = baseline.get(_result_key(result))
+        if "skipped" in result or base is None or base["seconds_median"] <= 0:
+            continue
+        comparisons.append({
+            "name": result["name"],
+            "script": result["script"],
+            "size_bytes": result["size_bytes"],
+            "baseline_seconds_median": base["seconds_median"],
+            "seconds_median": result["seconds_median"],
+            "ratio": result["seconds_median"] / base["seconds_median"],
+        })
+    return comparisons
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description="Benchmark the tokenizer, the chunker and the file parsers.")
+    arg_parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                            help=f"Comma separated corpus sizes, like 10KB or 1MB. Defaults to {DEFAULT_SIZES}.")
+    arg_parser.add_argument("--scripts", default=",".join(SCRIPTS), help="Comma separated: ascii, cjk.")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Timed calls per benchmark.")
+    arg_parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this.")
+    arg_parser.add_argument("--output", default="benchmark_results.json", help="The JSON results file.")
+    arg_parser.add_argument("--compare", default=None, help="A previous JSON results file to compare against.")
+    args = arg_parser.parse_args()
+
+    scripts = [script.strip() for script in args.scripts.split(",") if script.strip()]
+    for script in scripts:
+        if script not in SCRIPTS:
+            raise ValueError(f"Unsupported script: {script}. Supporting {list(SCRIPTS)}")
+    if args.repeat <= 0:
+        raise ValueError("repeat (int) should be over 0.")
+
+    # The parsers log at INFO with simulated typing, which would be timed too.
+    logger.set_level(logging.WARNING)
+    started_at = datetime.now(timezone.utc)
+    results = run_benchmarks([parse_size(size) for size in args.sizes.split(",")], scripts, args.repeat, args.filter)
+    report = {
+        "started_at": started_at.isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "lang_model": CFG.lang_model_name,
+        "text_token_len": request_token_budget(CFG.lang_model_name),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(results, json.load(f)["results"])
+        for comparison in report["comparison"]:
+            print(f"{comparison['name']:<36} {comparison['script']:<6} {comparison['size_bytes']:>12,} B  "
+                  f"x{comparison['ratio']:.3f} of the baseline")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
 import os
-from shorten_paper.file_operations_utils import (shorten_text, read_textual_file)
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from shorten_paper.file_operations_utils import (shorten_mode_to_function, read_tokenized_file)
+from shorten_paper.lang_model.text_processing import TokenizedText
+from shorten_paper.journal import RunJournal
+from shorten_paper.manifest import Manifest, default_file_settings
+from shorten_paper.metrics import Metrics
+from shorten_paper.lang_model.retry_policy import ChatCompletionError
 
 from colorama import Fore
 from shorten_paper.logs import Logger
@@ -9,7 +16,212 @@ logger = Logger()
 CFG = Config()
 
 
-def main() -> None:
+def _reserve_output_file(document_name: str, shortened_text_len: int, document_text_len: int) -> str:
+    """Creates a new empty file in the output directory named after the shortened ratio and returns the file name."""
+    os.makedirs(CFG.papers_output_dir, exist_ok=True)
+    document_name_pure = os.path.splitext(document_name)[0]
+    for counter in range(10000):
+        document_output_name = "".join([CFG.output_prefix,
+                                        document_name_pure,
+                                        f"_{shortened_text_len / document_text_len * 100:.2f}%",
+                                        "" if counter == 0 else f"_({counter})", ".txt"])
+        document_output_full_path = os.path.join(CFG.papers_output_dir, document_output_name)
+        try:
+            # Exclusive creation, so concurrent workers never pick the same file name.
+            with open(document_output_full_path, "x"):
+                pass
+            return document_output_name
+        except FileExistsError:
+            continue
+    raise IOError(f"{document_name} did not saved until 10,000 attempts in certain reason.")
+
+
+def save_shortened_text(shortened_text: str, document_name: str, document_text_len: int) -> str:
+    """Saves the shortened text to a new file in the output directory and returns the file name."""
+    document_output_name = _reserve_output_file(document_name, len(shortened_text), document_text_len)
+    with open(os.path.join(CFG.papers_output_dir, document_output_name), "w") as f:
+        f.write(shortened_text)
+    return document_output_name
+
+
+def save_streamed_text(partial_path: str, document_name: str, shortened_text_len: int, document_text_len: int) -> str:
+    """Moves a fully streamed partial file to a new file in the output directory and returns the file name."""
+    document_output_name = _reserve_output_file(document_name, shortened_text_len, document_text_len)
+    os.replace(partial_path, os.path.join(CFG.papers_output_dir, document_output_name))
+    return document_output_name
+
+
+def _stream_to_partial_file(
+        document_text: TokenizedText, document_name: str, instruction: str, shorten_kwargs: dict
+) -> tuple[int, str]:
+    """
+    Streams the output of the last pass into a partial file in the output directory, as it arrives.
+
+    Returns:
+        tuple: (Shortened length, partial file path)
+    """
+    os.makedirs(CFG.papers_output_dir, exist_ok=True)
+    document_name_pure = os.path.splitext(document_name)[0]
+    partial_fd, partial_path = tempfile.mkstemp(
+        suffix=".partial", prefix=f"{CFG.output_prefix}{document_name_pure}_",
+        dir=CFG.papers_output_dir, text=True
+    )
+    try:
+        with os.fdopen(partial_fd, "w") as f:
+            def write(content: str) -> None:
+                f.write(content)
+                f.flush()
+
+            shortened_text = shorten_mode_to_function[CFG.shorten_mode](
+                document_text, document_name, instruction, write_last=write, **shorten_kwargs
+            )
+    except BaseException:
+        os.remove(partial_path)
+        raise
+    return len(shortened_text.text), partial_path
+
+
+def shorten_file(
+        input_dir: str, document_name: str, instruction: str, num: int, file_cnt: int,
+        journal: RunJournal = None, shorten_ratio: float = CFG.shorten_ratio,
+        shorten_repeat: int = CFG.shorten_repeat, lang_model: str = CFG.lang_model_name
+) -> tuple:
+    """
+    Reads a single file, shortens it in passes kept in memory, and saves the last one.
+    The passes are up to `shorten_repeat` linear ones, or the levels of a tree reduction with SHORTEN_MODE=tree.
+    With a journal, a file already saved is skipped and shortened chunks are recorded as they finish.
+    With `STREAM_OUTPUT`, the last pass is written to a partial file in the output directory as it streams in.
+    With `SAVE_INTERMEDIATE_PASSES`, the other passes are saved too.
+
+    Returns:
+        tuple: (Document length, shortened length, output file name), with "ERROR!" for what was not done.
+    """
+    logger.typewriter_log(
+        "File num:",
+        Fore.CYAN,
+        f"{num+1}/{file_cnt}"
+    )
+    if journal is not None and journal.file_result(document_name) is not None:
+        logger.typewriter_log(
+            f"File num {num+1} done!",
+            Fore.CYAN,
+            "(restored from the run journal)"
+        )
+        logger.newline()
+        return journal.file_result(document_name)
+
+    shorten_kwargs = {"lang_model": lang_model, "shorten_ratio": shorten_ratio, "shorten_repeat": shorten_repeat}
+    if journal is not None:
+        shorten_kwargs |= {
+            "completed_chunks": journal.completed_chunks_by_pass(document_name),
+            "on_chunk_done": lambda repeat_num, chunk_idx, output: journal.record_chunk(
+                repeat_num, document_name, chunk_idx, output
+            )
+        }
+
+    result_info = ("ERROR!", "ERROR!", "ERROR!")
+    document_output_name = "Error: Didn't saved."
+    try:
+        with Metrics().span("read_file", document_name):
+            tokenized_text = read_tokenized_file(os.path.join(input_dir, document_name), lang_model)
+        document_text = tokenized_text.text
+        result_info = (len(document_text), "ERROR!", document_output_name)
+        if CFG.save_intermediate_passes:
+            document_name_pure, document_ext = os.path.splitext(document_name)
+
+            def save_pass(repeat_num: int, pass_text: TokenizedText) -> None:
+                pass_output_name = save_shortened_text(
+                    pass_text.text, f"{document_name_pure}_pass{repeat_num+1}{document_ext}", len(document_text)
+                )
+                logger.typewriter_log(f"| Pass {repeat_num+1} saved to: {pass_output_name}")
+            shorten_kwargs["on_pass_done"] = save_pass
+        if CFG.stream_output:
+            shortened_text_len, partial_path = _stream_to_partial_file(
+                tokenized_text, document_name, instruction, shorten_kwargs
+            )
+        else:
+            shortened_text = shorten_mode_to_function[CFG.shorten_mode](
+                tokenized_text, document_name, instruction, **shorten_kwargs
+            ).text
+            shortened_text_len = len(shortened_text)
+        result_info = (len(document_text), shortened_text_len, document_output_name)
+    except ValueError as e:
+        logger.error(f"ValueError with file {document_name}:", f"{e}")
+        logger.newline()
+        return result_info
+    except ChatCompletionError as e:
+        logger.error(f"{type(e).__name__} with file {document_name}:", f"{e}")
+        logger.newline()
+        return result_info
+    except Exception as e:
+        # Reading or parsing one file (OSError, yaml, PDF, decoding, sqlite3.Error, ...) must not stop the others.
+        logger.error(f"{type(e).__name__} with file {document_name}:", f"{e}")
+        logger.newline()
+        return result_info
+
+    try:
+        with Metrics().span("file_write", document_name):
+            if CFG.stream_output:
+                document_output_name = save_streamed_text(
+                    partial_path, document_name, shortened_text_len, len(document_text)
+                )
+            else:
+                document_output_name = save_shortened_text(shortened_text, document_name, len(document_text))
+    except Exception as e:
+        logger.error(f"File Save Error with file {document_name}:", f"{type(e).__name__}: {e}")
+        logger.newline()
+        return result_info
+    if journal is not None:
+        journal.record_file(document_name, (len(document_text), shortened_text_len, document_output_name))
+
+    logger.typewriter_log(
+        "Save shortened text to file",
+        Fore.BLUE
+    )
+    logger.typewriter_log(
+        f"| File name: {document_output_name}"
+    )
+    logger.typewriter_log(
+        f"File num {num+1} done!",
+        Fore.CYAN,
+    )
+    logger.newline()
+    return len(document_text), shortened_text_len, document_output_name
+
+
+def log_metrics_report(extra: dict = None) -> None:
+    """Logs where the run's time and tokens went, and writes the metrics reports."""
+    report = Metrics().report()
+    logger.typewriter_log(
+        "Time spent by stage:",
+        Fore.LIGHTBLUE_EX,
+        f"{report['wall_seconds']:.2f} seconds in total"
+    )
+    for stage, stats in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        logger.typewriter_log(f"| {stage}: {stats['seconds']:.2f} seconds in {stats['count']} calls")
+    usage = report["usage"]
+    logger.typewriter_log(
+        "Token usage:",
+        Fore.LIGHTBLUE_EX,
+        f"{usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens "
+        f"in {usage['requests']} requests" +
+        (f" ({usage['estimated_requests']} counted locally)" if usage["estimated_requests"] else "")
+    )
+    report_paths = Metrics().write_reports(extra=extra)
+    if report_paths is not None:
+        logger.typewriter_log(f"| Metrics report: {report_paths[0]}")
+        logger.typewriter_log(f"| Prometheus textfile: {report_paths[1]}")
+
+
+def main(manifest_path: str = None) -> None:
+    """
+    Shortens every file in the input directory.
+
+    Args:
+        manifest_path (str): A manifest of the files' instructions and settings. Defaults to None, MANIFEST_FILE.
+            Without one, the instruction of each file is asked for.
+    """
+    Metrics().reset()
     logger.typewriter_log(
         "-* Start Shorten Paper *- by. Han DongHeun",
         Fore.LIGHTRED_EX
@@ -26,103 +238,104 @@ def main() -> None:
         CFG.papers_output_dir
     )
     files = os.listdir(CFG.papers_input_dir)
+    manifest_path = manifest_path or CFG.manifest_file
+    manifest = Manifest.load(manifest_path) if manifest_path else None
+    file_settings = None
+    if manifest is not None:
+        logger.typewriter_log(
+            "Manifest:",
+            Fore.LIGHTYELLOW_EX,
+            manifest_path
+        )
+        file_settings = [manifest.settings_for(document_name) for document_name in files]
+        skipped_cnt = file_settings.count(None)
+        files = [document_name for document_name, settings in zip(files, file_settings) if settings is not None]
+        file_settings = [settings for settings in file_settings if settings is not None]
+        if skipped_cnt:
+            logger.typewriter_log(f"| {skipped_cnt} files matching no manifest rule are skipped")
 
     logger.typewriter_log(
         "Target files",
         Fore.LIGHTCYAN_EX
     )
-    instructions = []
-    for num, document_name in enumerate(files):
-        logger.typewriter_log(f"| {num+1} - {document_name}")
-        instructions.append(input("| Enter the instruction (None to just shorten): ").strip())
+    journal = RunJournal.for_run(CFG.papers_input_dir, files, file_settings) if CFG.run_journal else None
+    resume = False
+    if journal is not None and journal.resumable and journal.files == files:
+        for num, document_name in enumerate(files):
+            logger.typewriter_log(f"| {num+1} - {document_name}")
+        if manifest is not None:
+            # Unattended runs pick up where an interrupted run of the same manifest left off.
+            logger.typewriter_log("| Found an interrupted run of these files. Resuming it.")
+            resume = True
+        else:
+            logger.flush()
+            resume = input("| Found an interrupted run of these files. Resume it? (Y/n): ").strip().lower() != "n"
 
-    print()
-    shorten_result_info = []
-    for repeat_num in range(CFG.shorten_repeat):
-        if CFG.shorten_repeat > 1:
+    if manifest is not None:
+        if not resume:
+            for num, document_name in enumerate(files):
+                logger.typewriter_log(f"| {num+1} - {document_name}", content=file_settings[num]["instruction"])
+            if journal is not None:
+                journal.start(files, [settings["instruction"] for settings in file_settings])
+    else:
+        if resume:
+            instructions = journal.instructions
+        else:
+            instructions = []
+            for num, document_name in enumerate(files):
+                logger.typewriter_log(f"| {num+1} - {document_name}")
+                logger.flush()
+                instructions.append(input("| Enter the instruction (None to just shorten): ").strip())
+            if journal is not None:
+                journal.start(files, instructions)
+        file_settings = [default_file_settings(instruction) for instruction in instructions]
+
+    logger.newline()
+    # Every file goes through all of its repeat passes in memory before it is saved.
+    shorten_args = [(CFG.papers_input_dir, document_name, file_settings[num]["instruction"], num, len(files), journal,
+                     file_settings[num]["shorten_ratio"], file_settings[num]["shorten_repeat"],
+                     file_settings[num]["lang_model"])
+                    for num, document_name in enumerate(files)]
+    if CFG.file_concurrency > 1:
+        with ThreadPoolExecutor(max_workers=CFG.file_concurrency) as executor:
+            shorten_result_info = list(executor.map(lambda args: shorten_file(*args), shorten_args))
+    else:
+        shorten_result_info = [shorten_file(*args) for args in shorten_args]
+
+    logger.typewriter_log(
+        f"Shortening {len(files)} files done!",
+        Fore.CYAN
+    )
+    for num, document_name in enumerate(files):
+        current_doc_text_len = shorten_result_info[num][0]
+        current_shorten_text_len = shorten_result_info[num][1]
+        logger.typewriter_log(f"File {num+1}:",
+                              Fore.CYAN,
+                              f"{document_name}")
+        if isinstance(current_doc_text_len, int) and isinstance(current_shorten_text_len, int):
+            logger.typewriter_log(f"| Output file name: {shorten_result_info[num][2]}")
+            logger.typewriter_log(f"| Shorten characters: {current_doc_text_len} -> {current_shorten_text_len}")
             logger.typewriter_log(
-                "Shortening repeat num:",
-                Fore.RED,
-                f"{repeat_num+1}/{CFG.shorten_repeat}"
+                f"| Shortened to {current_shorten_text_len / current_doc_text_len * 100:.2f} %"
             )
-        if repeat_num > 0:
-            files = [previous_result[2] for previous_result in shorten_result_info]
-            shorten_result_info = []
-        for num, document_name in enumerate(files):
+        else:
+            logger.typewriter_log("| ERROR! Not shortened.")
+    logger.newline()
+
+    if journal is not None:
+        failed_cnt = sum(not isinstance(result_info[1], int) for result_info in shorten_result_info)
+        if failed_cnt == 0:
+            journal.finish()
+        else:
+            journal.close()
             logger.typewriter_log(
-                "File num:",
-                Fore.CYAN,
-                f"{num+1}/{len(files)}"
+                "Run journal kept:",
+                Fore.YELLOW,
+                f"{failed_cnt} files failed, run again to resume from {journal.path}"
             )
-            shorten_result_info.append(("ERROR!", "ERROR!", "ERROR!"))
-            document_output_name = "Error: Didn't saved."
-            try:
-                input_dir = CFG.papers_input_dir if repeat_num == 0 else CFG.papers_output_dir
-                document_text = read_textual_file(os.path.join(input_dir, document_name))
-                shorten_result_info[-1] = (len(document_text), "ERROR!", document_output_name)
-                shortened_text = shorten_text(document_text, document_name, instructions[num])
-                shorten_result_info[-1] = (len(document_text), len(shortened_text), document_output_name)
-            except ValueError as e:
-                logger.error(f"ValueError with file {document_name}:", f"{e}")
-                print()
-                continue
-
-            if not os.path.exists(CFG.papers_output_dir):
-                os.mkdir(CFG.papers_output_dir)
-            document_name_pure = os.path.splitext(document_name)[0]
-            attempt = 10000
-            counter = 0
-            while attempt > 0:
-                attempt -= 1
-
-                document_output_name = "".join([CFG.output_prefix if repeat_num == 0 else "",
-                                                document_name_pure,
-                                                f"_{len(shortened_text) / len(document_text) * 100:.2f}%",
-                                                "" if counter == 0 else f"_({counter})", ".txt"])
-                document_output_full_path = os.path.join(CFG.papers_output_dir, document_output_name)
-                if os.path.exists(document_output_full_path):
-                    counter += 1
-                    continue
-
-                with open(document_output_full_path, "w") as f:
-                    f.write(shortened_text)
-                shorten_result_info[-1] = (len(document_text), len(shortened_text), document_output_name)
-                logger.typewriter_log(
-                    "Save shortened text to file",
-                    Fore.BLUE
-                )
-                logger.typewriter_log(
-                    f"| File name: {document_output_name}"
-                )
-                logger.typewriter_log(
-                    f"File num {num+1} done!",
-                    Fore.CYAN,
-                )
-                print()
-                break
-            if attempt <= 0:
-                logger.error(f"File Save Error: {document_name} did not saved until 10,000 attempts in certain reason.")
-
-        logger.typewriter_log(
-            f"Shortening {len(files)} files done!",
-            Fore.CYAN
-        )
-        for num, document_name in enumerate(files):
-            current_doc_text_len = shorten_result_info[num][0]
-            current_shorten_text_len = shorten_result_info[num][1]
-            logger.typewriter_log(f"File {num+1}:",
-                                  Fore.CYAN,
-                                  f"{document_name}")
-            if isinstance(current_doc_text_len, int) and isinstance(current_shorten_text_len, int):
-                logger.typewriter_log(f"| Output file name: {shorten_result_info[num][2]}")
-                logger.typewriter_log(f"| Shorten characters: {current_doc_text_len} -> {current_shorten_text_len}")
-                logger.typewriter_log(
-                    f"| Shortened to {current_shorten_text_len / current_doc_text_len * 100:.2f} %"
-                )
-            else:
-                logger.typewriter_log("| ERROR! Not shortened.")
-        print()
+            logger.newline()
 
+    log_metrics_report()
     logger.typewriter_log(
         "Jobs all done. Anything else?",
         Fore.LIGHTBLUE_EX
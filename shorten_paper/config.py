@@ -1,5 +1,4 @@
 import os
-import openai
 from shorten_paper.singletone import Singleton
 from dotenv import load_dotenv
 
@@ -10,13 +9,18 @@ class Config(metaclass=Singleton):
         self.papers_input_dir = os.getenv("PAPERS_INPUT_DIR")
         self.papers_output_dir = os.getenv("PAPERS_OUTPUT_DIR")
         self.output_prefix = os.getenv("OUTPUT_PREFIX")
+        self.manifest_file = os.getenv("MANIFEST_FILE", "")
 
+        self.llm_backend = os.getenv("LLM_BACKEND", "openai").lower()
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_key = self.openai_api_key
+        self.openai_api_base = os.getenv("OPENAI_API_BASE")
         self.lang_model_name = os.getenv("LANG_MODEL_NAME")
-        self.text_token_len = int(os.getenv("TEXT_TOKEN_LEN")) - 150  # 150 tokens for pre-defined prompt.
-        if self.text_token_len <= 0:
-            raise ValueError("text_token_len (int) should be over 0.")
+        self.text_token_len = int(os.getenv("TEXT_TOKEN_LEN", 0))
+        if self.text_token_len < 0:
+            raise ValueError("text_token_len (int) should be 0 or over.")
+        self.context_window_margin = float(os.getenv("CONTEXT_WINDOW_MARGIN", 0.1))
+        if self.context_window_margin < 0 or self.context_window_margin >= 1:
+            raise ValueError("context_window_margin (float) should be in [0, 1).")
 
         self.model_temperature = float(os.getenv("MODEL_TEMPERATURE"))
         self.model_top_p = float(os.getenv("MODEL_TOP_P"))
@@ -27,5 +31,94 @@ class Config(metaclass=Singleton):
         if self.shorten_repeat <= 0:
             raise ValueError("shorten_repeat (int) should be over 0.")
         self.shorten_ratio = float(os.getenv("SHORTEN_RATIO"))
+        self.shorten_target_ratio = os.getenv("SHORTEN_TARGET_RATIO")
+        self.shorten_target_ratio = float(self.shorten_target_ratio) if self.shorten_target_ratio else None
+        self.save_intermediate_passes = os.getenv("SAVE_INTERMEDIATE_PASSES", "False").lower() == "true"
+        self.shorten_mode = os.getenv("SHORTEN_MODE", "linear").lower()
+        if self.shorten_mode not in ("linear", "tree"):
+            raise ValueError("shorten_mode (str) should be \"linear\" or \"tree\".")
+        self.tree_target_tokens = int(os.getenv("TREE_TARGET_TOKENS", 0))
+        self.tree_max_levels = int(os.getenv("TREE_MAX_LEVELS", 10))
+        self.tree_concurrency = int(os.getenv("TREE_CONCURRENCY", 8))
+        if self.tree_concurrency <= 0:
+            raise ValueError("tree_concurrency (int) should be over 0.")
         self.previous_text_token_ratio = float(os.getenv("PREVIOUS_TEXT_TOKEN_RATIO"))
         self.next_text_token_ratio = float(os.getenv("NEXT_TEXT_TOKEN_RATIO"))
+        self.adaptive_chunking = os.getenv("ADAPTIVE_CHUNKING", "False").lower() == "true"
+
+        self.chunk_concurrency = int(os.getenv("CHUNK_CONCURRENCY", 1))
+        if self.chunk_concurrency <= 0:
+            raise ValueError("chunk_concurrency (int) should be over 0.")
+
+        self.file_concurrency = int(os.getenv("FILE_CONCURRENCY", 1))
+        if self.file_concurrency <= 0:
+            raise ValueError("file_concurrency (int) should be over 0.")
+        self.watch_workers = int(os.getenv("WATCH_WORKERS", 1))
+        if self.watch_workers <= 0:
+            raise ValueError("watch_workers (int) should be over 0.")
+        self.watch_interval = float(os.getenv("WATCH_INTERVAL", 2))
+
+        self.server_host = os.getenv("SERVER_HOST", "127.0.0.1")
+        self.server_port = int(os.getenv("SERVER_PORT", 8080))
+        self.server_workers = int(os.getenv("SERVER_WORKERS", 2))
+        if self.server_workers <= 0:
+            raise ValueError("server_workers (int) should be over 0.")
+        self.server_max_queued = int(os.getenv("SERVER_MAX_QUEUED", 32))
+        if self.server_max_queued <= 0:
+            raise ValueError("server_max_queued (int) should be over 0.")
+        self.server_max_upload_mb = int(os.getenv("SERVER_MAX_UPLOAD_MB", 50))
+        self.server_job_ttl_hours = float(os.getenv("SERVER_JOB_TTL_HOURS", 24))
+        if self.server_job_ttl_hours < 0:
+            raise ValueError("server_job_ttl_hours (float) should be 0 or bigger.")
+        self.server_max_finished_jobs = int(os.getenv("SERVER_MAX_FINISHED_JOBS", 1000))
+        if self.server_max_finished_jobs < 0:
+            raise ValueError("server_max_finished_jobs (int) should be 0 or bigger.")
+
+        self.stream_output = os.getenv("STREAM_OUTPUT", "False").lower() == "true"
+        self.headless = os.getenv("HEADLESS", "False").lower() == "true"
+        self.log_json_file = os.getenv("LOG_JSON_FILE", "")
+
+        self.rate_limit_rpm = int(os.getenv("RATE_LIMIT_RPM", 0))
+        self.rate_limit_tpm = int(os.getenv("RATE_LIMIT_TPM", 0))
+
+        self.retry_max_retries = int(os.getenv("RETRY_MAX_RETRIES", 10))
+        if self.retry_max_retries <= 0:
+            raise ValueError("retry_max_retries (int) should be over 0.")
+        self.retry_base_delay = float(os.getenv("RETRY_BASE_DELAY", 1))
+        self.retry_max_delay = float(os.getenv("RETRY_MAX_DELAY", 60))
+        self.request_timeout = float(os.getenv("REQUEST_TIMEOUT", 120))
+        self.circuit_breaker_threshold = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 20))
+        self.circuit_breaker_cooldown = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", 60))
+
+        self.pdf_workers = int(os.getenv("PDF_WORKERS", 0))
+        if self.pdf_workers < 0:
+            raise ValueError("pdf_workers (int) should be 0 or over.")
+        self.pdf_parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+
+        self.cache_dir = os.getenv("CACHE_DIR", "./.cache")
+        self.response_cache = os.getenv("RESPONSE_CACHE", "True").lower() == "true"
+        self.response_cache_max_mb = int(os.getenv("RESPONSE_CACHE_MAX_MB", 256))
+        self.response_cache_ttl_days = float(os.getenv("RESPONSE_CACHE_TTL_DAYS", 30))
+        self.extraction_cache = os.getenv("EXTRACTION_CACHE", "True").lower() == "true"
+        self.extraction_cache_max_mb = int(os.getenv("EXTRACTION_CACHE_MAX_MB", 512))
+        self.run_journal = os.getenv("RUN_JOURNAL", "True").lower() == "true"
+        self.metrics_dir = os.getenv("METRICS_DIR", "./.cache/metrics")
+
+        self.plan_request_seconds = float(os.getenv("PLAN_REQUEST_SECONDS", 2))
+        self.plan_completion_tokens_per_second = float(os.getenv("PLAN_COMPLETION_TOKENS_PER_SECOND", 40))
+        if self.plan_completion_tokens_per_second <= 0:
+            raise ValueError("plan_completion_tokens_per_second (float) should be over 0.")
+        self.plan_prompt_price = os.getenv("PLAN_PROMPT_PRICE")
+        self.plan_prompt_price = float(self.plan_prompt_price) if self.plan_prompt_price else None
+        self.plan_completion_price = os.getenv("PLAN_COMPLETION_PRICE")
+        self.plan_completion_price = float(self.plan_completion_price) if self.plan_completion_price else None
+
+        self.mock_latency = float(os.getenv("MOCK_LATENCY", 1))
+        self.mock_tokens_per_second = float(os.getenv("MOCK_TOKENS_PER_SECOND", 50))
+        self.mock_error_rate = float(os.getenv("MOCK_ERROR_RATE", 0))
+        if not 0 <= self.mock_error_rate <= 1:
+            raise ValueError("mock_error_rate (float) should be in [0, 1].")
+        self.mock_output_ratio = float(os.getenv("MOCK_OUTPUT_RATIO", 0.4))
+        self.mock_length_compliance = float(os.getenv("MOCK_LENGTH_COMPLIANCE", 1))
+        if self.mock_length_compliance < 0:
+            raise ValueError("mock_length_compliance (float) should be 0 or bigger.")
@@ -0,0 +1,195 @@
+"""
+Local cache of the text extracted from input files and its tokens, so unchanged files are not parsed twice.
+
+Manage it with `python -m shorten_paper.extraction_cache stats|clear|invalidate <paths>`.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from shorten_paper.config import Config
+from shorten_paper.singletone import Singleton
+from shorten_paper.lang_model.text_processing import TokenizedText, get_encoding
+
+CFG = Config()
+
+# Token ids fit in 32 bits for every tiktoken encoding.
+_TOKEN_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Returns the content hash of a file, read block by block."""
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class ExtractionCache(metaclass=Singleton):
+    """
+    Local SQLite cache of extracted texts and their tokens, keyed by the content hash of the source file,
+    its extension (which selects the parser) and the token encoding.
+
+    Files are fingerprinted by path, size and modification time, so an unchanged file is not even hashed again.
+    A touched file with the same content is rehashed once and hits the same entry.
+    The least recently used entries are evicted once the stored texts and tokens exceed `max_bytes`.
+
+    Args:
+        path (str): The SQLite database file path.
+        max_bytes (int): The maximum total size of the stored texts and tokens.
+    """
+
+    def __init__(
+            self,
+            path: str = os.path.join(CFG.cache_dir, "extracted.sqlite3"),
+            max_bytes: int = CFG.extraction_cache_max_mb * 1024 * 1024
+    ):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, content_hash TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS extracted ("
+            "content_hash TEXT NOT NULL, extension TEXT NOT NULL, encoding_name TEXT NOT NULL, "
+            "text TEXT NOT NULL, tokens BLOB NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (content_hash, extension, encoding_name))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS extracted_accessed_at ON extracted (accessed_at)")
+        self._connection.commit()
+
+    def fingerprint(self, file_path: str) -> str:
+        """Returns the content hash of a file, hashing it only if its size or modification time changed."""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        content_hash = hash_file(path)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, content_hash)
+            )
+            self._connection.commit()
+        return content_hash
+
+    def get(self, file_path: str, content_hash: str, lang_model: str = CFG.lang_model_name) -> TokenizedText | None:
+        """Returns the tokenized text extracted from the file with the content hash, or None if it is not cached."""
+        extension = os.path.splitext(file_path)[1].lower()
+        encoding_name = get_encoding(lang_model).name
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text, tokens FROM extracted WHERE content_hash = ? AND extension = ? AND encoding_name = ?",
+                (content_hash, extension, encoding_name)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE extracted SET accessed_at = ? WHERE content_hash = ? AND extension = ? AND encoding_name = ?",
+                (time.time(), content_hash, extension, encoding_name)
+            )
+            self._connection.commit()
+        text, token_bytes = row
+        tokens = array(_TOKEN_TYPECODE)
+        tokens.frombytes(token_bytes)
+        return TokenizedText(text, lang_model, tokens.tolist())
+
+    def put(self, file_path: str, content_hash: str, tokenized_text: TokenizedText) -> None:
+        """Stores the tokenized text extracted from the file, under the content hash it had before the extraction."""
+        extension = os.path.splitext(file_path)[1].lower()
+        encoding_name = get_encoding(tokenized_text.lang_model).name
+        token_bytes = array(_TOKEN_TYPECODE, tokenized_text.tokens).tobytes()
+        size = len(tokenized_text.text.encode("utf-8", "surrogatepass")) + len(token_bytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO extracted "
+                "(content_hash, extension, encoding_name, text, tokens, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, extension, encoding_name, tokenized_text.text, token_bytes, size, time.time())
+            )
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM extracted").fetchone()[0]
+            if total_size > self.max_bytes:
+                # Drop the least recently used entries until the cache fits again.
+                evict_keys = []
+                for evict_hash, evict_extension, evict_encoding, evict_size in self._connection.execute(
+                        "SELECT content_hash, extension, encoding_name, size FROM extracted ORDER BY accessed_at ASC"):
+                    if total_size <= self.max_bytes:
+                        break
+                    evict_keys.append((evict_hash, evict_extension, evict_encoding))
+                    total_size -= evict_size
+                self._connection.executemany(
+                    "DELETE FROM extracted WHERE content_hash = ? AND extension = ? AND encoding_name = ?", evict_keys
+                )
+            self._connection.commit()
+
+    def invalidate(self, path: str) -> int:
+        """
+        Drops the entries of a file, or of every file under a directory.
+
+        Returns:
+            int: The number of invalidated files.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path FROM files WHERE path = ? OR substr(path, 1, ?) = ?",
+                (path, len(path) + 1, os.path.join(path, ""))
+            ).fetchall()
+            self._connection.executemany("DELETE FROM files WHERE path = ?", [(row[0],) for row in rows])
+            # Texts of contents no file has anymore, including earlier versions of changed files, go with them.
+            self._connection.execute(
+                "DELETE FROM extracted "
+                "WHERE NOT EXISTS (SELECT 1 FROM files WHERE files.content_hash = extracted.content_hash)"
+            )
+            self._connection.commit()
+        return len(rows)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM files")
+            self._connection.execute("DELETE FROM extracted")
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            file_cnt = self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            entry_cnt, total_size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extracted"
+            ).fetchone()
+        return {"files": file_cnt, "entries": entry_cnt, "mb": round(total_size / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2)}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Inspect or invalidate the extracted text cache.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Print the size of the cache.")
+    subparsers.add_parser("clear", help="Drop every entry.")
+    invalidate_parser = subparsers.add_parser("invalidate", help="Drop the entries of files or directories.")
+    invalidate_parser.add_argument("paths", nargs="+")
+    args = arg_parser.parse_args()
+
+    cache = ExtractionCache()
+    if args.command == "stats":
+        print(cache.stats())
+    elif args.command == "clear":
+        cache.clear()
+        print("Extraction cache cleared.")
+    else:
+        invalidated_cnt = sum(cache.invalidate(path) for path in args.paths)
+        print(f"Invalidated {invalidated_cnt} file(s).")
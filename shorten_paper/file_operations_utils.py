@@ -1,247 +1,115 @@
 import os
-import PyPDF2
-import docx
 import json
-import yaml
-from bs4 import BeautifulSoup
-import markdown
-from pylatexenc.latex2text import LatexNodes2Text
 
 import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TextIO
 from shorten_paper.lang_model.text_processing import \
-    (split_with_next_text, count_string_tokens, truncate_by_token_cnt)
-from shorten_paper.lang_model.api_call import create_chat_completion
+    (TokenizedText, split_with_context, count_string_tokens, string_to_tokens, truncate_by_token_cnt,
+     request_token_budget)
+from shorten_paper.lang_model.api_call import create_chat_completion, estimate_prompt_tokens
+from shorten_paper.lang_model.retry_policy import ChatCompletionError
+from shorten_paper.text_decoding import read_text_file
+from shorten_paper.extraction_cache import ExtractionCache
 
 from colorama import Fore
 from shorten_paper.spinner import Spinner
 from shorten_paper.logs import Logger
 from shorten_paper.config import Config
+from shorten_paper.metrics import Metrics
 
 logger = Logger()
 CFG = Config()
 
-ENCODINGS = ['utf_8',
-             'ascii',
-             'big5',
-             'big5hkscs',
-             'cp037',
-             'cp273',
-             'cp424',
-             'cp437',
-             'cp500',
-             'cp720',
-             'cp737',
-             'cp775',
-             'cp850',
-             'cp852',
-             'cp855',
-             'cp856',
-             'cp857',
-             'cp858',
-             'cp860',
-             'cp861',
-             'cp862',
-             'cp863',
-             'cp864',
-             'cp865',
-             'cp866',
-             'cp869',
-             'cp874',
-             'cp875',
-             'cp932',
-             'cp949',
-             'cp950',
-             'cp1006',
-             'cp1026',
-             'cp1125',
-             'cp1140',
-             'cp1250',
-             'cp1251',
-             'cp1252',
-             'cp1253',
-             'cp1254',
-             'cp1255',
-             'cp1256',
-             'cp1257',
-             'cp1258',
-             'euc_jp',
-             'euc_jis_2004',
-             'euc_jisx0213',
-             'euc_kr',
-             'gb2312',
-             'gbk',
-             'gb18030',
-             'hz',
-             'iso2022_jp',
-             'iso2022_jp_1',
-             'iso2022_jp_2',
-             'iso2022_jp_2004',
-             'iso2022_jp_3',
-             'iso2022_jp_ext',
-             'iso2022_kr',
-             'latin_1',
-             'iso8859_2',
-             'iso8859_3',
-             'iso8859_4',
-             'iso8859_5',
-             'iso8859_6',
-             'iso8859_7',
-             'iso8859_8',
-             'iso8859_9',
-             'iso8859_10',
-             'iso8859_11',
-             'iso8859_13',
-             'iso8859_14',
-             'iso8859_15',
-             'iso8859_16',
-             'johab',
-             'koi8_r',
-             'koi8_t',
-             'koi8_u',
-             'kz1048',
-             'mac_cyrillic',
-             'mac_greek',
-             'mac_iceland',
-             'mac_latin2',
-             'mac_roman',
-             'mac_turkish',
-             'ptcp154',
-             'shift_jis',
-             'shift_jis_2004',
-             'shift_jisx0213',
-             'utf_32',
-             'utf_32_be',
-             'utf_32_le',
-             'utf_16',
-             'utf_16_be',
-             'utf_16_le',
-             'utf_7',
-             'utf_8_sig']
-
 
+# Parser backends are imported on the first read of their extension, so a run only loads what its files need.
 class ParserStrategy:
     def read(self, file_path):
         raise NotImplementedError
 
 
-# Basic text file reading
-class TXTParser(ParserStrategy):
+# Text formats: the file is read and decoded once, and the text is handed to `parse`
+class TextParserStrategy(ParserStrategy):
     def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    text = f.read()
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("TXTParser Read Error.")
-
-
-# Reading text from binary file using pdf parser
+        try:
+            text, encoding = read_text_file(file_path)
+        except UnicodeDecodeError:
+            raise IOError(f"{type(self).__name__} Read Error.")
+        logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
+        return self.parse(text)
+
+    def parse(self, text):
+        raise NotImplementedError
+
+
+# Basic text file reading
+class TXTParser(TextParserStrategy):
+    def parse(self, text):
+        return text
+
+
+# Reading text from binary file using pdf parser, page by page
 class PDFParser(ParserStrategy):
     def read(self, file_path):
-        parser = PyPDF2.PdfReader(file_path)
-        text = ""
-        for page_idx in range(len(parser.pages)):
-            text += parser.pages[page_idx].extract_text()
-        return text
+        return "".join(self.iter_pages(file_path))
+
+    def iter_pages(self, file_path):
+        from shorten_paper.pdf_extraction import iter_pdf_pages
+        return iter_pdf_pages(file_path)
 
 
 # Reading text from binary file using docs parser
 class DOCXParser(ParserStrategy):
     def read(self, file_path):
+        import docx
         doc_file = docx.Document(file_path)
-        text = ""
-        for para in doc_file.paragraphs:
-            text += para.text
-        return text
+        return "".join(para.text for para in doc_file.paragraphs)
 
 
 # Reading as dictionary and returning string format
-class JSONParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    data = json.load(f)
-                    text = str(data)
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("JSONParser Read Error.")
-
-
-class XMLParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    soup = BeautifulSoup(f, "xml")
-                    text = soup.get_text()
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("XMLParser Read Error.")
+class JSONParser(TextParserStrategy):
+    def parse(self, text):
+        data = json.loads(text)
+        return str(data)
+
+
+class XMLParser(TextParserStrategy):
+    def parse(self, text):
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(text, "xml")
+        return soup.get_text()
 
 
 # Reading as dictionary and returning string format
-class YAMLParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    data = yaml.load(f, Loader=yaml.FullLoader)
-                    text = str(data)
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("YAMLParser Read Error.")
-
-
-class HTMLParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    soup = BeautifulSoup(f, "html.parser")
-                    text = soup.get_text()
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("HTMLParser Read Error.")
-
-
-class MarkdownParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    html = markdown.markdown(f.read())
-                    text = "".join(BeautifulSoup(html, "html.parser").findAll(string=True))
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("MarkdownParser Read Error.")
-
-
-class LaTeXParser(ParserStrategy):
-    def read(self, file_path):
-        for encoding in ENCODINGS:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    latex = f.read()
-                    text = LatexNodes2Text().latex_to_text(latex)
-                    logger.typewriter_log(f"Encoding:", Fore.CYAN, encoding)
-                return text
-            except UnicodeDecodeError:
-                continue
-        raise IOError("LaTeXParser Read Error.")
+class YAMLParser(TextParserStrategy):
+    def parse(self, text):
+        import yaml
+        data = yaml.load(text, Loader=yaml.FullLoader)
+        return str(data)
+
+
+class HTMLParser(TextParserStrategy):
+    def parse(self, text):
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(text, "html.parser")
+        return soup.get_text()
+
+
+class MarkdownParser(TextParserStrategy):
+    def parse(self, text):
+        import markdown
+        from bs4 import BeautifulSoup
+        html = markdown.markdown(text)
+        return "".join(BeautifulSoup(html, "html.parser").findAll(string=True))
+
+
+class LaTeXParser(TextParserStrategy):
+    def parse(self, text):
+        from pylatexenc.latex2text import LatexNodes2Text
+        return LatexNodes2Text().latex_to_text(text)
 
 
 class FileContext:
@@ -281,27 +149,598 @@ def read_textual_file(file_path):
     return file_context.read_file(file_path)
 
 
-def shorten_text(
-        text: str, filename: str, instruction: str,
+def read_tokenized_file(file_path: str, lang_model: str = CFG.lang_model_name) -> TokenizedText:
+    """
+    Reads a file like `read_textual_file` and tokenizes its text.
+    With EXTRACTION_CACHE, a file read before with the same content is restored from the extraction cache instead.
+
+    Args:
+        file_path (str): The file path.
+        lang_model (str): The name of the language model to use for encoding.
+
+    Returns:
+        TokenizedText: The text of the file with its tokens.
+    """
+    if not CFG.extraction_cache:
+        return TokenizedText(read_textual_file(file_path), lang_model)
+
+    extraction_cache = ExtractionCache()
+    # Fingerprinted before reading, so a file changing during the read is not cached under its new content.
+    content_hash = extraction_cache.fingerprint(file_path)
+    tokenized_text = extraction_cache.get(file_path, content_hash, lang_model)
+    if tokenized_text is not None:
+        Metrics().increment("extraction_cache_hits")
+        logger.typewriter_log("Restored text from the extraction cache", Fore.CYAN)
+        return tokenized_text
+
+    tokenized_text = TokenizedText(read_textual_file(file_path), lang_model)
+    extraction_cache.put(file_path, content_hash, tokenized_text)
+    return tokenized_text
+
+
+def _chunk_messages(
+        chunk_num: int, chunk_total: int, instruction: str, shorten_ratio: float,
+        current_text: str, current_token_cnt: int, previous_text: str, next_text: str
+) -> list:
+    return [
+        {
+            "role": "system",
+            "content": f"You are a text revise assistant. "
+                       f"Text chunks are serving sequently and current chunk is "
+                       f"number {chunk_num} of total {chunk_total} chunks. "
+                       f"The \"Previous Text\" will be placed before your output, do not rephrase it. "
+                       f"The \"Next Text\" will be placed after your output, do not rephrase it. "
+                       f"Consider your output to be smoothly joined with those texts."
+        },
+        {
+            "role": "user",
+            "content": f"\"Revise the \"Current Text\" to exact "
+                       f"{math.floor(current_token_cnt * shorten_ratio)} "
+                       f"words as you can" +
+                       (". " if instruction == ""
+                        else f", focusing on the following instruction: \"{instruction}\" " +
+                             f"-- if the instruction cannot be considered, revise the text as mentioned. ") +
+                       f"Meanwhile, retain important key information "
+                       f"and the form of the original text as you can.\" "
+                       f"\"Current Text\": \"\"\"{current_text}\"\"\" "
+                       f"\"Previous Text\": \"\"\"{previous_text}\"\"\" "
+                       f"\"Next Text\": \"\"\"{next_text}\"\"\""
+        }
+    ]
+
+
+def _merge_messages(
+        group_num: int, group_total: int, instruction: str, shorten_ratio: float,
+        current_text: str, current_token_cnt: int
+) -> list:
+    return [
+        {
+            "role": "system",
+            "content": f"You are a text revise assistant. "
+                       f"The \"Current Text\" is consecutive parts of a document, shortened separately "
+                       f"and separated by blank lines, and it is group number {group_num} of total {group_total} "
+                       f"groups of parts. Merge the parts into one text that reads as a whole."
+        },
+        {
+            "role": "user",
+            "content": f"\"Merge and revise the \"Current Text\" to exact "
+                       f"{math.floor(current_token_cnt * shorten_ratio)} "
+                       f"words as you can" +
+                       (". " if instruction == ""
+                        else f", focusing on the following instruction: \"{instruction}\" " +
+                             f"-- if the instruction cannot be considered, revise the text as mentioned. ") +
+                       f"Meanwhile, retain important key information, the order of the parts "
+                       f"and the form of the original text as you can.\" "
+                       f"\"Current Text\": \"\"\"{current_text}\"\"\""
+        }
+    ]
+
+
+def _request_shortening(
+        messages: list, lang_model: str, token_cost: int = None, on_delta: Callable[[str], None] = None,
+        on_usage: Callable[[dict], None] = None
+) -> str:
+    return create_chat_completion(
+        messages=messages,
+        lang_model=lang_model,
+        temperature=CFG.model_temperature,
+        top_p=CFG.model_top_p,
+        presence_penalty=CFG.model_presence_penalty,
+        frequency_penalty=CFG.model_frequency_penalty,
+        token_cost=token_cost,
+        on_delta=on_delta,
+        on_usage=on_usage
+    )
+
+
+class _OrderedChunkWriter:
+    """
+    Passes chunk outputs to `write` in chunk order, joined by newlines.
+    With `streaming`, outputs are passed piece by piece as they arrive,
+    and output of a chunk running ahead of the one being written is buffered until its turn.
+    The newline goes before each chunk's output, so the chunk count need not be known in advance.
+    """
+
+    def __init__(self, write: Callable[[str], None], streaming: bool = False):
+        self._write = write
+        self.streaming = streaming
+        self._buffers = {}
+        self._streamed = set()
+        self._finished = set()
+        self._current = 0
+        self._current_started = False
+        self._lock = threading.Lock()
+        self.char_cnt = 0
+
+    def _emit(self, content: str) -> None:
+        if not self._current_started:
+            self._current_started = True
+            if self._current > 0:
+                self._write("\n")
+                self.char_cnt += 1
+        self._write(content)
+        self.char_cnt += len(content)
+
+    def _accept(self, chunk_idx: int, content: str) -> None:
+        if chunk_idx == self._current:
+            self._emit(content)
+        else:
+            self._buffers.setdefault(chunk_idx, []).append(content)
+
+    def on_delta(self, chunk_idx: int) -> Callable[[str], None] | None:
+        """Returns the callback streaming a chunk's output, or None when not streaming."""
+        if not self.streaming:
+            return None
+
+        def delta(content: str) -> None:
+            with self._lock:
+                self._streamed.add(chunk_idx)
+                self._accept(chunk_idx, content)
+        return delta
+
+    def finish(self, chunk_idx: int, output: str) -> None:
+        """Marks a chunk done. Its output is written here unless it was already streamed."""
+        with self._lock:
+            if chunk_idx not in self._streamed:
+                self._accept(chunk_idx, output)
+            self._finished.add(chunk_idx)
+            while self._current in self._finished:
+                self._current += 1
+                self._current_started = False
+                for content in self._buffers.pop(self._current, []):
+                    self._emit(content)
+
+
+_prompt_token_cnts = {}
+
+
+def _prompt_token_cnt(lang_model: str) -> int:
+    """Returns the tokens of the chunk prompt besides its texts and instruction, measured once per model."""
+    if lang_model not in _prompt_token_cnts:
+        # The largest chunk numbers and requested length the prompt may carry, and a placeholder instruction.
+        _prompt_token_cnts[lang_model] = estimate_prompt_tokens(
+            _chunk_messages(99999, 99999, "-", 1.0, "", 99999, "", ""), lang_model
+        )
+    return _prompt_token_cnts[lang_model]
+
+
+_merge_prompt_token_cnts = {}
+
+
+def _merge_prompt_token_cnt(lang_model: str) -> int:
+    """Returns the tokens of the merge prompt besides its text and instruction, measured once per model."""
+    if lang_model not in _merge_prompt_token_cnts:
+        _merge_prompt_token_cnts[lang_model] = estimate_prompt_tokens(
+            _merge_messages(99999, 99999, "-", 1.0, "", 99999), lang_model
+        )
+    return _merge_prompt_token_cnts[lang_model]
+
+
+def _request_token_cost(
+        instruction_token_cnt: int, shorten_ratio: float,
+        current_token_cnt: int, previous_token_cnt: int, next_token_cnt: int, lang_model: str
+) -> int:
+    """Estimates a chunk request's tokens from counts already known, with the measured prompt tokens."""
+    return (_prompt_token_cnt(lang_model) + instruction_token_cnt + current_token_cnt + previous_token_cnt +
+            next_token_cnt + math.floor(current_token_cnt * shorten_ratio))
+
+
+def _chunk_token_lens(
+        text_token_budget: int, output_ratio: float, previous_text_token_ratio: float, next_text_token_ratio: float
+) -> tuple[int, int, int]:
+    """
+    Sizes a chunk to fill the tokens a request has for texts, leaving room for an output of `output_ratio`.
+
+    Returns:
+        tuple[int, int, int]: The token lengths of the current, previous and next text.
+    """
+    current_text_token_target = math.floor(
+        text_token_budget / (1 + output_ratio + previous_text_token_ratio + next_text_token_ratio)
+    )
+    if current_text_token_target <= 0:
+        raise ValueError("The request has no tokens left for the text after the prompt and instruction.")
+    chunk_token_len = math.floor(current_text_token_target * (1 + next_text_token_ratio))
+    current_token_len = math.ceil((1 - next_text_token_ratio / (1 + next_text_token_ratio)) * chunk_token_len)
+    previous_token_len = math.floor(current_text_token_target * previous_text_token_ratio)
+    return current_token_len, previous_token_len, chunk_token_len - current_token_len
+
+
+def chunk_requests(
+        text: TokenizedText, instruction: str,
         lang_model: str = CFG.lang_model_name,
         shorten_ratio: float = CFG.shorten_ratio,
         previous_text_token_ratio: float = CFG.previous_text_token_ratio,
-        next_text_token_ratio: float = CFG.next_text_token_ratio
-) -> str:
-    """Shorten document's text.
+        next_text_token_ratio: float = CFG.next_text_token_ratio,
+        chunk_concurrency: int = CFG.chunk_concurrency
+) -> list[dict]:
+    """
+    Builds the requests a pass over the text would send, without sending them, for planning.
+    Outputs are not known in advance, so chunks shortened one by one reference the original text before them,
+    cut to the length the previous chunk's output would have.
+
+    Returns:
+        list[dict]: The messages and the requested completion tokens of each request.
+    """
+    instruction = instruction.strip()
+    instruction_token_cnt = count_string_tokens(instruction, lang_model)
+    text_token_budget = request_token_budget(lang_model) - _prompt_token_cnt(lang_model) - instruction_token_cnt
+    current_token_len, previous_token_len, next_token_len = _chunk_token_lens(
+        text_token_budget, shorten_ratio, previous_text_token_ratio, next_text_token_ratio
+    )
+    if chunk_concurrency == 1:
+        previous_token_len = min(previous_token_len, math.floor(current_token_len * shorten_ratio))
+    chunks = split_with_context(text, lang_model, current_token_len, previous_token_len, next_token_len)
+    return [
+        {
+            "messages": _chunk_messages(
+                i + 1, len(chunks), instruction, shorten_ratio,
+                chunk["current_text"]["text"], chunk["current_text"]["token_cnt"],
+                chunk["previous_text"]["text"], chunk["next_text"]["text"]
+            ),
+            "completion_tokens": math.floor(chunk["current_text"]["token_cnt"] * shorten_ratio)
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+class _CompressionController:
+    """
+    Steers the chunks of a pass to the pass's shorten ratio, from the lengths the earlier chunks' outputs had.
+
+    Models over- or under-shoot the requested length fairly consistently, so the next chunk's requested length is
+    scaled by how far the outputs so far were from their requested lengths (the compliance), and also makes up for
+    the tokens the pass is ahead of or behind its target. The next chunk is sized to leave room for the output this
+    predicts. The compliance is smoothed over the chunks and bounded, so a model ignoring the requested length
+    cannot drive the requests down without end.
+
+    Args:
+        target_ratio (float): The ratio of output to input tokens the pass should reach.
+    """
+    # Weight of the latest chunk in the smoothed compliance.
+    smoothing = 0.3
+    # The compliance stays within [1 / max_compliance, max_compliance].
+    max_compliance = 2.0
+    # The requested ratio stays within [target_ratio * min_request_factor, 1].
+    min_request_factor = 0.25
+
+    def __init__(self, target_ratio: float):
+        self.target_ratio = target_ratio
+        self.input_token_cnt = 0
+        self.output_token_cnt = 0
+        self.compliance = 1.0
+
+    def request_ratio(self, current_token_cnt: int) -> float:
+        """Returns the ratio to request for the next chunk of `current_token_cnt` tokens."""
+        wanted_token_cnt = self.target_ratio * (self.input_token_cnt + current_token_cnt) - self.output_token_cnt
+        request_ratio = wanted_token_cnt / current_token_cnt / self.compliance
+        return min(1.0, max(self.target_ratio * self.min_request_factor, request_ratio))
+
+    def output_ratio(self, current_token_cnt: int) -> float:
+        """
+        Returns the ratio of output to input tokens to leave room for in the next chunk's request:
+        the output predicted for a chunk of about `current_token_cnt` tokens, and at least the target.
+        """
+        return min(1.0, max(self.target_ratio, self.compliance * self.request_ratio(current_token_cnt)))
+
+    def observe(self, current_token_cnt: int, requested_token_cnt: int, output_token_cnt: int) -> None:
+        self.input_token_cnt += current_token_cnt
+        self.output_token_cnt += output_token_cnt
+        if requested_token_cnt > 0:
+            self.compliance += self.smoothing * (output_token_cnt / requested_token_cnt - self.compliance)
+            self.compliance = min(self.max_compliance, max(1 / self.max_compliance, self.compliance))
+
+
+def _log_chunk_request(
+        chunk_num: int, chunk_total: int, shorten_ratio: float,
+        current_text: str, current_token_cnt: int, previous_text: str, previous_token_cnt: int,
+        next_text: str, next_token_cnt: int
+) -> None:
+    logger.typewriter_log(
+        f"Shortening chunk {chunk_num} / {chunk_total}",
+        Fore.LIGHTYELLOW_EX
+    )
+    logger.typewriter_log(
+        f"| {len(current_text)} -> {math.floor(len(current_text) * shorten_ratio)} characters."
+    )
+    logger.typewriter_log(
+        f"| {current_token_cnt} -> {math.floor(current_token_cnt * shorten_ratio)} tokens."
+    )
+
+    logger.typewriter_log(
+        "Referencing",
+        Fore.YELLOW
+    )
+    logger.typewriter_log(
+        f"| Previous text | Length: {len(previous_text)} characters, Tokens: {previous_token_cnt} tokens"
+    )
+    logger.typewriter_log(
+        f"| Next text | Length: {len(next_text)} characters, Tokens: {next_token_cnt} tokens"
+    )
+
+
+def _log_merge_request(
+        group_num: int, group_total: int, shorten_ratio: float, part_cnt: int, current_token_cnt: int
+) -> None:
+    logger.typewriter_log(
+        f"Merging group {group_num} / {group_total}",
+        Fore.LIGHTYELLOW_EX
+    )
+    logger.typewriter_log(
+        f"| {part_cnt} parts, {current_token_cnt} -> {math.floor(current_token_cnt * shorten_ratio)} tokens."
+    )
+
+
+def _log_chunk_result(chunk_num: int, chunk_total: int, shorten_current_text: str, tokens_for_shorten_text: int) -> None:
+    logger.typewriter_log(
+        f"Shortened chunk {chunk_num} / {chunk_total}",
+        Fore.GREEN,
+    )
+    logger.typewriter_log(
+        f"| Length: {len(shorten_current_text)} characters, Tokens: {tokens_for_shorten_text} tokens"
+    )
+    logger.newline()
+
+
+def _log_chunk_restored(chunk_num: int, chunk_total: int) -> None:
+    logger.typewriter_log(
+        f"Shortened chunk {chunk_num} / {chunk_total}",
+        Fore.GREEN,
+        "(restored from the run journal)"
+    )
+    logger.newline()
+
+
+def _shorten_chunks_serially(
+        tokenized_text: TokenizedText, filename: str, instruction: str, instruction_token_cnt: int, lang_model: str,
+        shorten_ratio: float, text_token_budget: int, previous_text_token_ratio: float, next_text_token_ratio: float,
+        adaptive_chunking: bool, completed_chunks: dict[int, str], on_chunk_done: Callable[[int, str], None],
+        writer: _OrderedChunkWriter, on_usage: Callable[[int, dict], None]
+) -> list[list[int]]:
+    """
+    Shortens chunks one by one, referencing the previous chunk's output as the previous text.
+    Chunks are carved as they come, so with `adaptive_chunking` each one is sized, and its length requested,
+    by a `_CompressionController` from the outputs of the chunks before it.
+    The time spent carving them is recorded as the "chunking" stage of `filename`.
+
+    Returns:
+        list[list[int]]: The tokens of each chunk's output.
+    """
+    controller = _CompressionController(shorten_ratio)
+    # The size of a chunk sized for `shorten_ratio`, to predict the next chunk's output from before carving it.
+    target_token_len = _chunk_token_lens(
+        text_token_budget, shorten_ratio, previous_text_token_ratio, next_text_token_ratio
+    )[0]
+    output_tokens = []
+    previous_shorten_output = ""
+    token_start_idx = 0
+    chunking_seconds = 0.0
+    i = 0
+    while token_start_idx < len(tokenized_text):
+        chunking_started_at = time.perf_counter()
+        current_token_len, previous_token_len, next_token_len = _chunk_token_lens(
+            text_token_budget, controller.output_ratio(target_token_len) if adaptive_chunking else shorten_ratio,
+            previous_text_token_ratio, next_text_token_ratio
+        )
+        chunk = tokenized_text.chunk_at(token_start_idx, current_token_len, 0, next_token_len)
+        chunking_seconds += time.perf_counter() - chunking_started_at
+        current_text = chunk["current_text"]["text"]
+        current_token_cnt = chunk["current_text"]["token_cnt"]
+        next_text = chunk["next_text"]["text"]
+        next_token_cnt = chunk["next_text"]["token_cnt"]
+        token_start_idx += current_token_cnt
+        # Later chunks may be sized differently, so the count is an estimate until the last chunk.
+        chunk_total = i + 1 + math.ceil((len(tokenized_text) - token_start_idx) / current_token_len)
+        request_ratio = controller.request_ratio(current_token_cnt) if adaptive_chunking else shorten_ratio
+
+        if i in completed_chunks:
+            shorten_current_text = completed_chunks[i]
+            writer.finish(i, shorten_current_text)
+            output_tokens.append(string_to_tokens(shorten_current_text, lang_model))
+            _log_chunk_restored(i + 1, chunk_total)
+        else:
+            previous_text, previous_token_cnt =\
+                truncate_by_token_cnt(
+                    previous_shorten_output, lang_model,
+                    previous_token_len, from_back=False
+                )
+
+            _log_chunk_request(
+                i + 1, chunk_total, request_ratio,
+                current_text, current_token_cnt, previous_text, previous_token_cnt, next_text, next_token_cnt
+            )
+            messages = _chunk_messages(
+                i + 1, chunk_total, instruction, request_ratio,
+                current_text, current_token_cnt, previous_text, next_text
+            )
+            with Spinner("Shortening...", enabled=not CFG.headless):
+                shorten_current_text = _request_shortening(
+                    messages, lang_model,
+                    _request_token_cost(
+                        instruction_token_cnt, request_ratio, current_token_cnt, previous_token_cnt, next_token_cnt,
+                        lang_model
+                    ),
+                    writer.on_delta(i),
+                    partial(on_usage, i)
+                )
+            writer.finish(i, shorten_current_text)
+            if on_chunk_done is not None:
+                on_chunk_done(i, shorten_current_text)
+
+            output_tokens.append(string_to_tokens(shorten_current_text, lang_model))
+            _log_chunk_result(i + 1, chunk_total, shorten_current_text, len(output_tokens[-1]))
+
+        controller.observe(current_token_cnt, math.floor(current_token_cnt * request_ratio), len(output_tokens[-1]))
+        previous_shorten_output = shorten_current_text
+        i += 1
+
+    Metrics().observe("chunking", chunking_seconds, filename)
+    return output_tokens
+
+
+def _request_concurrently(
+        requests: list[tuple[list, int]], log_request: Callable[[int], None], lang_model: str,
+        chunk_concurrency: int, completed_chunks: dict[int, str], on_chunk_done: Callable[[int, str], None],
+        writer: _OrderedChunkWriter, on_usage: Callable[[int, dict], None]
+) -> tuple[list[str], list[list[int]]]:
+    """
+    Sends the messages and token costs of `requests` at once, except those of completed chunks.
+    Outputs are written in order, and `log_request` is called with each request's index before waiting for it.
+
+    Returns:
+        tuple[list[str], list[list[int]]]: The output of each request and its tokens.
+    """
+    outputs, output_tokens = [], []
+    with ThreadPoolExecutor(max_workers=chunk_concurrency) as executor:
+        futures = [
+            None if i in completed_chunks else executor.submit(
+                _request_shortening, messages, lang_model, token_cost, writer.on_delta(i), partial(on_usage, i)
+            )
+            for i, (messages, token_cost) in enumerate(requests)
+        ]
+
+        try:
+            for i, future in enumerate(futures):
+                if future is None:
+                    writer.finish(i, completed_chunks[i])
+                    outputs.append(completed_chunks[i])
+                    output_tokens.append(string_to_tokens(completed_chunks[i], lang_model))
+                    _log_chunk_restored(i + 1, len(requests))
+                    continue
+                log_request(i)
+                with Spinner("Shortening...", enabled=not CFG.headless):
+                    shorten_current_text = future.result()
+                writer.finish(i, shorten_current_text)
+                if on_chunk_done is not None:
+                    on_chunk_done(i, shorten_current_text)
+
+                outputs.append(shorten_current_text)
+                output_tokens.append(string_to_tokens(shorten_current_text, lang_model))
+                _log_chunk_result(i + 1, len(requests), shorten_current_text, len(output_tokens[-1]))
+        except ChatCompletionError:
+            # The document fails anyway, so do not spend requests on the chunks still waiting.
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+            raise
+
+    return outputs, output_tokens
+
+
+def _shorten_chunks_concurrently(
+        chunks: list[dict], instruction: str, instruction_token_cnt: int, lang_model: str, shorten_ratio: float,
+        chunk_concurrency: int, completed_chunks: dict[int, str], on_chunk_done: Callable[[int, str], None],
+        writer: _OrderedChunkWriter, on_usage: Callable[[int, dict], None]
+) -> tuple[list[str], list[list[int]]]:
+    """
+    Shortens all chunks at once, referencing the original previous text. Outputs are written in order.
+
+    Returns:
+        tuple[list[str], list[list[int]]]: The output of each chunk and its tokens.
+    """
+    logger.typewriter_log(
+        f"Shortening {len(chunks)} chunks",
+        Fore.LIGHTYELLOW_EX,
+        f"with up to {chunk_concurrency} concurrent requests"
+    )
+    logger.newline()
+
+    requests = [
+        (
+            _chunk_messages(
+                i + 1, len(chunks), instruction, shorten_ratio,
+                chunk["current_text"]["text"], chunk["current_text"]["token_cnt"],
+                chunk["previous_text"]["text"], chunk["next_text"]["text"]
+            ),
+            _request_token_cost(
+                instruction_token_cnt, shorten_ratio, chunk["current_text"]["token_cnt"],
+                chunk["previous_text"]["token_cnt"], chunk["next_text"]["token_cnt"], lang_model
+            )
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+
+    def log_request(i: int) -> None:
+        _log_chunk_request(
+            i + 1, len(chunks), shorten_ratio,
+            chunks[i]["current_text"]["text"], chunks[i]["current_text"]["token_cnt"],
+            chunks[i]["previous_text"]["text"], chunks[i]["previous_text"]["token_cnt"],
+            chunks[i]["next_text"]["text"], chunks[i]["next_text"]["token_cnt"]
+        )
+
+    return _request_concurrently(
+        requests, log_request, lang_model, chunk_concurrency, completed_chunks, on_chunk_done, writer, on_usage
+    )
+
+
+def _join_output_tokens(chunk_output_tokens: list[list[int]], separator_tokens: list[int]) -> list[int]:
+    """
+    Joins the tokens of chunk outputs joined by a separator. The tokens of the outputs joined by the separator's make
+    up a tokenization of the whole output, sparing the next pass from encoding it again.
+    """
+    output_tokens = list(chunk_output_tokens[0])
+    for tokens in chunk_output_tokens[1:]:
+        output_tokens += separator_tokens
+        output_tokens += tokens
+    return output_tokens
+
+
+def _shorten_text_into(
+        write: Callable[[str], None], text: str | TokenizedText, filename: str, instruction: str,
+        lang_model: str = CFG.lang_model_name,
+        shorten_ratio: float = CFG.shorten_ratio,
+        previous_text_token_ratio: float = CFG.previous_text_token_ratio,
+        next_text_token_ratio: float = CFG.next_text_token_ratio,
+        chunk_concurrency: int = CFG.chunk_concurrency,
+        completed_chunks: dict[int, str] = None,
+        on_chunk_done: Callable[[int, str], None] = None,
+        streaming: bool = False,
+        adaptive_chunking: bool = CFG.adaptive_chunking
+) -> tuple[int, list[int]]:
+    """Shorten document's text, passing the output to `write` in order.
 
     Args:
-        text (str): The text to summarize.
+        write (Callable[[str], None]): Called with each piece of the output, in order.
+        text (str | TokenizedText): The text to summarize, or the already tokenized text.
         filename (str): The filename of given text.
         instruction (str): The instruction model will consider.
         lang_model (str): The name of the language model to use for encoding.
         shorten_ratio (float): Ratio to be shortened (0, 1].
         previous_text_token_ratio (float):  Ratio to be referenced [0, 1).
         next_text_token_ratio (float): Ratio to be referenced [0, 1).
+        chunk_concurrency (int): The maximum number of chunks shortened at once.
+            Over 1, every chunk references the original previous text instead of the previous output,
+            so all chunks can be requested concurrently.
+        completed_chunks (dict[int, str]): Outputs of chunks already shortened, by chunk index. Those are not requested.
+        on_chunk_done (Callable[[int, str], None]): Called with the chunk index and output of each shortened chunk.
+        streaming (bool): If True, completions are streamed and passed to `write` as they arrive.
+        adaptive_chunking (bool): If True, chunks shortened one by one are steered to `shorten_ratio`
+            from the lengths of the earlier chunks' outputs.
 
     Returns:
-        str: The shortened version of the text.
+        tuple[int, list[int]]: The character count and the tokens of the shortened text.
     """
+    tokenized_text = text if isinstance(text, TokenizedText) else None
+    text = tokenized_text.text if tokenized_text is not None else text
     if not text:
         raise ValueError("No text to shorten.")
     if shorten_ratio <= 0 or shorten_ratio > 1:
@@ -312,6 +751,8 @@ def shorten_text(
         raise ValueError("next_text_token_ratio must be (0, 1].")
     if previous_text_token_ratio + next_text_token_ratio >= 1:
         raise ValueError("Sum of next/previous_text_token_ratio must be under 1.0.")
+    if chunk_concurrency <= 0:
+        raise ValueError("chunk_concurrency must be over 0.")
     instruction = instruction.strip()
 
     logger.typewriter_log(
@@ -324,7 +765,9 @@ def shorten_text(
         Fore.YELLOW,
         f"{len(text)} characters"
     )
-    text_token_cnt = count_string_tokens(text, lang_model)
+    if tokenized_text is None or tokenized_text.lang_model != lang_model:
+        tokenized_text = TokenizedText(text, lang_model)
+    text_token_cnt = len(tokenized_text)
     logger.typewriter_log(
         "Token count:",
         Fore.YELLOW,
@@ -350,119 +793,394 @@ def shorten_text(
     logger.typewriter_log(
         f"| {text_token_cnt} -> {math.floor(text_token_cnt * shorten_ratio)} tokens."
     )
-    print()
+    logger.newline()
 
-    shorten_text_list = []
-    instruction_token_cnt = count_string_tokens(instruction)
-    current_text_token_target = math.floor(
-        (CFG.text_token_len - instruction_token_cnt) /
-        (1 + shorten_ratio + previous_text_token_ratio + next_text_token_ratio)
-    )
-    chunks = split_with_next_text(
-        text, lang_model=lang_model,
-        max_token_len=math.floor(current_text_token_target * (1 + next_text_token_ratio)),
-        next_text_ratio=next_text_token_ratio / (1 + next_text_token_ratio)
-    )
+    instruction_token_cnt = count_string_tokens(instruction, lang_model)
+    text_token_budget = request_token_budget(lang_model) - _prompt_token_cnt(lang_model) - instruction_token_cnt
 
-    previous_shorten_output = ""
-    for i, chunk in enumerate(chunks):
-        current_text = chunk["current_text"]["text"]
-        current_token_cnt = chunk["current_text"]["token_cnt"]
-        next_text = chunk["next_text"]["text"]
-        next_token_cnt = chunk["next_text"]["token_cnt"]
-        previous_text, previous_token_cnt =\
-            truncate_by_token_cnt(
-                previous_shorten_output, lang_model,
-                math.floor(current_text_token_target * previous_text_token_ratio), from_back=False
-            )
+    def on_usage(chunk_idx: int, usage: dict) -> None:
+        Metrics().record_usage(usage, filename, chunk_idx)
 
-        logger.typewriter_log(
-            f"Shortening chunk {i + 1} / {len(chunks)}",
-            Fore.LIGHTYELLOW_EX
+    writer = _OrderedChunkWriter(write, streaming)
+    if chunk_concurrency > 1:
+        # Every chunk is requested up front, so all of them are sized for `shorten_ratio`.
+        chunking_started_at = time.perf_counter()
+        current_token_len, previous_token_len, next_token_len = _chunk_token_lens(
+            text_token_budget, shorten_ratio, previous_text_token_ratio, next_text_token_ratio
         )
-        logger.typewriter_log(
-            f"| {len(current_text)} -> {math.floor(len(current_text) * shorten_ratio)} characters."
+        chunks = split_with_context(
+            tokenized_text, lang_model,
+            current_token_len=current_token_len,
+            previous_token_len=previous_token_len,
+            next_token_len=next_token_len
         )
-        logger.typewriter_log(
-            f"| {current_token_cnt} -> {math.floor(current_token_cnt * shorten_ratio)} tokens."
+        Metrics().observe("chunking", time.perf_counter() - chunking_started_at, filename)
+        chunk_output_tokens = _shorten_chunks_concurrently(
+            chunks, instruction, instruction_token_cnt, lang_model, shorten_ratio, chunk_concurrency,
+            completed_chunks or {}, on_chunk_done, writer, on_usage
+        )[1]
+    else:
+        chunk_output_tokens = _shorten_chunks_serially(
+            tokenized_text, filename, instruction, instruction_token_cnt, lang_model, shorten_ratio, text_token_budget,
+            previous_text_token_ratio, next_text_token_ratio, adaptive_chunking,
+            completed_chunks or {}, on_chunk_done, writer, on_usage
         )
+    output_tokens = _join_output_tokens(chunk_output_tokens, string_to_tokens("\n", lang_model))
+    tokens_for_shorten_text = len(output_tokens)
 
-        logger.typewriter_log(
-            "Referencing",
-            Fore.YELLOW
-        )
-        logger.typewriter_log(
-            f"| Previous text | Length: {len(previous_text)} characters, Tokens: {previous_token_cnt} tokens"
-        )
-        logger.typewriter_log(
-            f"| Next text | Length: {len(next_text)} characters, Tokens: {next_token_cnt} tokens"
-        )
+    logger.typewriter_log(
+        "Shortened text result",
+        Fore.LIGHTGREEN_EX
+    )
+    logger.typewriter_log(
+        f"| {len(text)} -> {writer.char_cnt} characters "
+        f"| Shortened to {writer.char_cnt / len(text) * 100:.2f} %"
+    )
+    logger.typewriter_log(
+        f"| {text_token_cnt} -> {tokens_for_shorten_text} tokens "
+        f"| Shortened to {tokens_for_shorten_text / text_token_cnt * 100:.2f} %"
+    )
 
-        messages = [
-            {
-                "role": "system",
-                "content": f"You are a text revise assistant. "
-                           f"Text chunks are serving sequently and current chunk is "
-                           f"number {i+1} of total {len(chunks)} chunks. "
-                           f"The \"Previous Text\" will be placed before your output, do not rephrase it. "
-                           f"The \"Next Text\" will be placed after your output, do not rephrase it. "
-                           f"Consider your output to be smoothly joined with those texts."
-            },
-            {
-                "role": "user",
-                "content": f"\"Revise the \"Current Text\" to exact "
-                           f"{math.floor(current_token_cnt * shorten_ratio)} "
-                           f"words as you can" +
-                           (". " if instruction == ""
-                            else f", focusing on the following instruction: \"{instruction}\" " +
-                                 f"-- if the instruction cannot be considered, revise the text as mentioned. ") +
-                           f"Meanwhile, retain important key information "
-                           f"and the form of the original text as you can.\" "
-                           f"\"Current Text\": \"\"\"{current_text}\"\"\" "
-                           f"\"Previous Text\": \"\"\"{previous_text}\"\"\" "
-                           f"\"Next Text\": \"\"\"{next_text}\"\"\""
-            }
-        ]
+    return writer.char_cnt, output_tokens
+
+
+def shorten_text(
+        text: str | TokenizedText, filename: str, instruction: str,
+        lang_model: str = CFG.lang_model_name,
+        shorten_ratio: float = CFG.shorten_ratio,
+        previous_text_token_ratio: float = CFG.previous_text_token_ratio,
+        next_text_token_ratio: float = CFG.next_text_token_ratio,
+        chunk_concurrency: int = CFG.chunk_concurrency,
+        completed_chunks: dict[int, str] = None,
+        on_chunk_done: Callable[[int, str], None] = None
+) -> str:
+    """Shorten document's text.
+
+    Args:
+        text (str | TokenizedText): The text to summarize, or the already tokenized text.
+        filename (str): The filename of given text.
+        instruction (str): The instruction model will consider.
+        lang_model (str): The name of the language model to use for encoding.
+        shorten_ratio (float): Ratio to be shortened (0, 1].
+        previous_text_token_ratio (float):  Ratio to be referenced [0, 1).
+        next_text_token_ratio (float): Ratio to be referenced [0, 1).
+        chunk_concurrency (int): The maximum number of chunks shortened at once.
+            Over 1, every chunk references the original previous text instead of the previous output,
+            so all chunks can be requested concurrently.
+        completed_chunks (dict[int, str]): Outputs of chunks already shortened, by chunk index. Those are not requested.
+        on_chunk_done (Callable[[int, str], None]): Called with the chunk index and output of each shortened chunk.
+
+    Returns:
+        str: The shortened version of the text.
+    """
+    output_pieces = []
+    _shorten_text_into(
+        output_pieces.append, text, filename, instruction, lang_model, shorten_ratio,
+        previous_text_token_ratio, next_text_token_ratio, chunk_concurrency, completed_chunks, on_chunk_done
+    )
+    return "".join(output_pieces)
+
+
+def shorten_text_to_stream(
+        output_stream: TextIO, text: str | TokenizedText, filename: str, instruction: str,
+        lang_model: str = CFG.lang_model_name,
+        shorten_ratio: float = CFG.shorten_ratio,
+        previous_text_token_ratio: float = CFG.previous_text_token_ratio,
+        next_text_token_ratio: float = CFG.next_text_token_ratio,
+        chunk_concurrency: int = CFG.chunk_concurrency,
+        completed_chunks: dict[int, str] = None,
+        on_chunk_done: Callable[[int, str], None] = None
+) -> int:
+    """Shorten document's text like `shorten_text`, streaming the output to `output_stream` as it arrives.
+    Only the chunks in flight are kept in memory.
+
+    Args:
+        output_stream (TextIO): The stream to write the shortened text to. It is flushed after every piece.
+
+    Returns:
+        int: The character count of the shortened text.
+    """
+    def write(content: str) -> None:
+        output_stream.write(content)
+        output_stream.flush()
+
+    return _shorten_text_into(
+        write, text, filename, instruction, lang_model, shorten_ratio,
+        previous_text_token_ratio, next_text_token_ratio, chunk_concurrency, completed_chunks, on_chunk_done,
+        streaming=True
+    )[0]
+
+
+def shorten_text_repeatedly(
+        text: str | TokenizedText, filename: str, instruction: str,
+        lang_model: str = CFG.lang_model_name,
+        shorten_ratio: float = CFG.shorten_ratio,
+        shorten_repeat: int = CFG.shorten_repeat,
+        target_ratio: float = CFG.shorten_target_ratio,
+        previous_text_token_ratio: float = CFG.previous_text_token_ratio,
+        next_text_token_ratio: float = CFG.next_text_token_ratio,
+        chunk_concurrency: int = CFG.chunk_concurrency,
+        completed_chunks: dict[int, dict[int, str]] = None,
+        on_chunk_done: Callable[[int, int, str], None] = None,
+        on_pass_done: Callable[[int, TokenizedText], None] = None,
+        write_last: Callable[[str], None] = None
+) -> TokenizedText:
+    """Shorten document's text in up to `shorten_repeat` passes, kept in memory.
+    Each pass shortens the output of the previous one, handed over with its tokens so it is not encoded again,
+    and passes stop early once the text reached `target_ratio` of the original token count.
 
-        with Spinner("Shortening..."):
-            shorten_current_text = create_chat_completion(
-                messages=messages,
-                lang_model=lang_model,
-                temperature=CFG.model_temperature,
-                top_p=CFG.model_top_p,
-                presence_penalty=CFG.model_presence_penalty,
-                frequency_penalty=CFG.model_frequency_penalty
+    Args:
+        shorten_repeat (int): The maximum number of passes.
+        target_ratio (float): The overall token ratio to stop at.
+            Defaults to None, `shorten_ratio` ** `shorten_repeat`. 0 to always run every pass.
+        completed_chunks (dict[int, dict[int, str]]): Outputs of chunks already shortened, by pass and chunk index.
+        on_chunk_done (Callable[[int, int, str], None]): Called with the pass, chunk index and output of each
+            shortened chunk.
+        on_pass_done (Callable[[int, TokenizedText], None]): Called with the pass and output of each pass
+            followed by another one.
+        write_last (Callable[[str], None]): If given, called with the output of the last pass: piece by piece as it
+            arrives in the `shorten_repeat`-th pass, or at once when the passes stopped early.
+
+    Returns:
+        TokenizedText: The shortened text with its tokens.
+    """
+    if not isinstance(text, TokenizedText) or text.lang_model != lang_model:
+        text = TokenizedText(text.text if isinstance(text, TokenizedText) else text, lang_model)
+    if target_ratio is None:
+        target_ratio = shorten_ratio ** shorten_repeat
+    original_token_cnt = len(text)
+    completed_chunks = completed_chunks or {}
+
+    for repeat_num in range(shorten_repeat):
+        if shorten_repeat > 1:
+            logger.typewriter_log(
+                "Shortening repeat num:",
+                Fore.RED,
+                f"{repeat_num+1}/{shorten_repeat}"
             )
-        shorten_text_list.append(shorten_current_text)
-        tokens_for_shorten_text = count_string_tokens(shorten_current_text, lang_model)
-        previous_shorten_output = shorten_current_text
+        streaming = write_last is not None and repeat_num == shorten_repeat - 1
+        output_pieces = []
 
-        logger.typewriter_log(
-            f"Shortened chunk {i + 1} / {len(chunks)}",
-            Fore.GREEN,
-        )
-        logger.typewriter_log(
-            f"| Length: {len(shorten_current_text)} characters, Tokens: {tokens_for_shorten_text} tokens"
+        def write(content: str) -> None:
+            output_pieces.append(content)
+            if streaming:
+                write_last(content)
+
+        _, output_tokens = _shorten_text_into(
+            write, text, filename, instruction, lang_model, shorten_ratio,
+            previous_text_token_ratio, next_text_token_ratio, chunk_concurrency,
+            completed_chunks.get(repeat_num), partial(on_chunk_done, repeat_num) if on_chunk_done else None,
+            streaming=streaming
         )
-        print()
+        text = TokenizedText("".join(output_pieces), lang_model, output_tokens)
+        logger.newline()
+        if repeat_num == shorten_repeat - 1:
+            break
+        if len(text) <= original_token_cnt * target_ratio:
+            logger.typewriter_log(
+                "Reached the target ratio",
+                Fore.LIGHTGREEN_EX,
+                f"{len(text) / original_token_cnt * 100:.2f} % of {original_token_cnt} tokens "
+                f"after {repeat_num+1} passes, skipping the other {shorten_repeat - repeat_num - 1}"
+            )
+            logger.newline()
+            if write_last is not None:
+                write_last(text.text)
+            break
+        if on_pass_done is not None:
+            on_pass_done(repeat_num, text)
+    return text
 
-    combined_shorten_text = "\n".join(shorten_text_list)
-    tokens_for_shorten_text = count_string_tokens(combined_shorten_text, lang_model)
 
-    logger.typewriter_log(
-        "Shortened text result",
-        Fore.LIGHTGREEN_EX
+def _group_parts(part_token_cnts: list[int], group_token_len: int, separator_token_cnt: int) -> list[range]:
+    """Packs adjacent parts greedily into groups of up to `group_token_len` tokens, joined by separators."""
+    groups = []
+    group_start_idx = 0
+    group_token_cnt = 0
+    for i, part_token_cnt in enumerate(part_token_cnts):
+        if i > group_start_idx and group_token_cnt + separator_token_cnt + part_token_cnt > group_token_len:
+            groups.append(range(group_start_idx, i))
+            group_start_idx = i
+        group_token_cnt = part_token_cnt if i == group_start_idx \
+            else group_token_cnt + separator_token_cnt + part_token_cnt
+    groups.append(range(group_start_idx, len(part_token_cnts)))
+    return groups
+
+
+def _map_level(
+        text: TokenizedText, filename: str, instruction: str, instruction_token_cnt: int, lang_model: str,
+        shorten_ratio: float, chunk_concurrency: int, completed_chunks: dict[int, str],
+        on_chunk_done: Callable[[int, str], None], writer: _OrderedChunkWriter, on_usage: Callable[[int, dict], None]
+) -> tuple[list[str], list[list[int]]]:
+    """
+    Shortens every chunk of the text on its own, without previous or next text, at once.
+
+    Returns:
+        tuple[list[str], list[list[int]]]: The output of each chunk and its tokens.
+    """
+    chunking_started_at = time.perf_counter()
+    text_token_budget = request_token_budget(lang_model) - _prompt_token_cnt(lang_model) - instruction_token_cnt
+    current_token_len = _chunk_token_lens(text_token_budget, shorten_ratio, 0, 0)[0]
+    chunks = split_with_context(text, lang_model, current_token_len, 0, 0)
+    Metrics().observe("chunking", time.perf_counter() - chunking_started_at, filename)
+    return _shorten_chunks_concurrently(
+        chunks, instruction, instruction_token_cnt, lang_model, shorten_ratio, chunk_concurrency,
+        completed_chunks, on_chunk_done, writer, on_usage
     )
+
+
+def _reduce_level(
+        parts: list[str], part_tokens: list[list[int]], instruction: str, instruction_token_cnt: int, lang_model: str,
+        shorten_ratio: float, chunk_concurrency: int, completed_chunks: dict[int, str],
+        on_chunk_done: Callable[[int, str], None], writer: _OrderedChunkWriter, on_usage: Callable[[int, dict], None]
+) -> tuple[list[str], list[list[int]]]:
+    """
+    Packs adjacent outputs of the level before into groups fitting a request, and merges every group at once.
+
+    Returns:
+        tuple[list[str], list[list[int]]]: The output of each group and its tokens.
+    """
+    text_token_budget = request_token_budget(lang_model) - _merge_prompt_token_cnt(lang_model) - instruction_token_cnt
+    group_token_len = _chunk_token_lens(text_token_budget, shorten_ratio, 0, 0)[0]
+    separator_tokens = string_to_tokens("\n\n", lang_model)
+    groups = _group_parts([len(tokens) for tokens in part_tokens], group_token_len, len(separator_tokens))
+    group_token_cnts = [len(_join_output_tokens([part_tokens[i] for i in group], separator_tokens))
+                        for group in groups]
     logger.typewriter_log(
-        f"| {len(text)} -> {len(combined_shorten_text)} characters "
-        f"| Shortened to {len(combined_shorten_text) / len(text) * 100:.2f} %"
+        f"Merging {len(parts)} parts in {len(groups)} groups",
+        Fore.LIGHTYELLOW_EX,
+        f"with up to {chunk_concurrency} concurrent requests"
+    )
+    logger.newline()
+
+    requests = [
+        (
+            _merge_messages(
+                group_idx + 1, len(groups), instruction, shorten_ratio,
+                "\n\n".join(parts[i] for i in group), group_token_cnt
+            ),
+            _merge_prompt_token_cnt(lang_model) + instruction_token_cnt + group_token_cnt +
+            math.floor(group_token_cnt * shorten_ratio)
+        )
+        for group_idx, (group, group_token_cnt) in enumerate(zip(groups, group_token_cnts))
+    ]
+
+    def log_request(group_idx: int) -> None:
+        _log_merge_request(
+            group_idx + 1, len(groups), shorten_ratio, len(groups[group_idx]), group_token_cnts[group_idx]
+        )
+
+    return _request_concurrently(
+        requests, log_request, lang_model, chunk_concurrency, completed_chunks, on_chunk_done, writer, on_usage
     )
+
+
+def shorten_text_hierarchically(
+        text: str | TokenizedText, filename: str, instruction: str,
+        lang_model: str = CFG.lang_model_name,
+        shorten_ratio: float = CFG.shorten_ratio,
+        shorten_repeat: int = CFG.shorten_repeat,
+        target_ratio: float = CFG.shorten_target_ratio,
+        target_token_cnt: int = CFG.tree_target_tokens,
+        max_levels: int = CFG.tree_max_levels,
+        chunk_concurrency: int = CFG.tree_concurrency,
+        completed_chunks: dict[int, dict[int, str]] = None,
+        on_chunk_done: Callable[[int, int, str], None] = None,
+        on_pass_done: Callable[[int, TokenizedText], None] = None,
+        write_last: Callable[[str], None] = None
+) -> TokenizedText:
+    """Shorten document's text by map-reduce, for very long documents.
+    The first level shortens every chunk of the text on its own, without previous or next text, all at once.
+    Each later level packs adjacent outputs of the level before into groups fitting a request,
+    and merges every group into one shorter text at once, until the text is within the target token count.
+    Levels shrink by `shorten_ratio`, so the latency grows with the logarithm of the document's length
+    instead of with its length. Takes the arguments of `shorten_text_repeatedly`, with levels as passes
+    and the chunks of a level being its chunks or groups.
+
+    Args:
+        target_ratio (float): The overall token ratio to reach, if `target_token_cnt` is 0.
+            Defaults to None, `shorten_ratio` ** `shorten_repeat`.
+        target_token_cnt (int): The token count to reach. 0 to use `target_ratio`.
+        max_levels (int): The maximum number of levels.
+        chunk_concurrency (int): The maximum number of chunks or groups of a level shortened at once.
+        write_last (Callable[[str], None]): If given, called with the output of the last level once it is done.
+
+    Returns:
+        TokenizedText: The shortened text with its tokens.
+    """
+    if not isinstance(text, TokenizedText) or text.lang_model != lang_model:
+        text = TokenizedText(text.text if isinstance(text, TokenizedText) else text, lang_model)
+    if len(text) == 0:
+        raise ValueError("No text to shorten.")
+    if shorten_ratio <= 0 or shorten_ratio > 1:
+        raise ValueError("shorten_ratio must be (0, 1].")
+    if chunk_concurrency <= 0:
+        raise ValueError("chunk_concurrency must be over 0.")
+    if target_token_cnt <= 0:
+        if target_ratio is None:
+            target_ratio = shorten_ratio ** shorten_repeat
+        target_token_cnt = math.ceil(len(text) * target_ratio)
+    instruction = instruction.strip()
+    instruction_token_cnt = count_string_tokens(instruction, lang_model)
+    completed_chunks = completed_chunks or {}
+
+    def on_usage(chunk_idx: int, usage: dict) -> None:
+        Metrics().record_usage(usage, filename, chunk_idx)
+
     logger.typewriter_log(
-        f"| {text_token_cnt} -> {tokens_for_shorten_text} tokens "
-        f"| Shortened to {tokens_for_shorten_text / text_token_cnt * 100:.2f} %"
+        "File name:",
+        Fore.CYAN,
+        filename
     )
+    parts, part_tokens = None, None
+    for level in range(max_levels):
+        logger.typewriter_log(
+            "Reduction level:",
+            Fore.RED,
+            f"{level+1} ({len(text)} tokens, down to {target_token_cnt} tokens)"
+        )
+        output_pieces = []
+        level_args = (
+            instruction, instruction_token_cnt, lang_model, shorten_ratio, chunk_concurrency,
+            completed_chunks.get(level, {}), partial(on_chunk_done, level) if on_chunk_done else None,
+            _OrderedChunkWriter(output_pieces.append), on_usage
+        )
+        if parts is None:
+            parts, part_tokens = _map_level(text, filename, *level_args)
+        else:
+            parts, part_tokens = _reduce_level(parts, part_tokens, *level_args)
+        shortened_text = TokenizedText(
+            "".join(output_pieces), lang_model, _join_output_tokens(part_tokens, string_to_tokens("\n", lang_model))
+        )
+        logger.typewriter_log(
+            f"Level {level+1} result",
+            Fore.LIGHTGREEN_EX,
+            f"{len(text)} -> {len(shortened_text)} tokens in {len(parts)} parts"
+        )
+        logger.newline()
+        if len(shortened_text) <= target_token_cnt:
+            text = shortened_text
+            break
+        if len(shortened_text) >= len(text):
+            logger.warn(f"Level {level+1} did not shorten {filename}, stopping at {len(shortened_text)} tokens.")
+            text = shortened_text
+            break
+        text = shortened_text
+        if on_pass_done is not None and level < max_levels - 1:
+            on_pass_done(level, text)
+    else:
+        logger.warn(f"{filename} is still {len(text)} tokens after {max_levels} levels.")
+
+    if write_last is not None:
+        write_last(text.text)
+    return text
 
-    return combined_shorten_text
+
+# Multi-pass shortening of a whole document, selected with SHORTEN_MODE
+shorten_mode_to_function = {
+    "linear": shorten_text_repeatedly,
+    "tree": shorten_text_hierarchically,
+}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""A durable local job queue, for the long-running modes"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class JobQueue:
+    """
+    First in, first out queue of jobs in a local SQLite database, safe to use from any thread.
+
+    Jobs are "queued", "running", "done" or "failed", and survive restarts: jobs left running by a process that
+    stopped are queued again when the queue is opened. A job's key is unique, so the same work is enqueued once.
+
+    Args:
+        path (str): The SQLite database file path.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._job_queued = threading.Condition(self._lock)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self._connection.execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),)
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _to_job(row: tuple) -> dict:
+        job_id, key, payload, status, attempts, result, error, created_at, updated_at = row
+        return {"id": job_id, "key": key, "payload": json.loads(payload), "status": status, "attempts": attempts,
+                "result": json.loads(result) if result is not None else None, "error": error,
+                "created_at": created_at, "updated_at": updated_at}
+
+    def enqueue(self, key: str, payload: dict) -> int | None:
+        """Queues a job, unless a job with the same key exists. Returns the new job id, or None."""
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO jobs (key, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?)", (key, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._connection.commit()
+            if cursor.rowcount == 0:
+                return None
+            self._job_queued.notify()
+            return cursor.lastrowid
+
+    def claim(self, timeout: float = None) -> dict | None:
+        """Marks the oldest queued job running and returns it, waiting up to `timeout` seconds for one."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while True:
+                row = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (time.time(), row[0])
+                    )
+                    self._connection.commit()
+                    job = self._to_job(row)
+                    job["status"] = "running"
+                    job["attempts"] += 1
+                    return job
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._job_queued.wait(remaining)
+
+    def _settle(self, job_id: int, status: str, result: dict = None, error: str = None) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 time.time(), job_id)
+            )
+            self._connection.commit()
+
+    def finish(self, job_id: int, result: dict = None) -> None:
+        self._settle(job_id, "done", result=result)
+
+    def fail(self, job_id: int, error: str) -> None:
+        self._settle(job_id, "failed", error=error)
+
+    def prune(self, max_age: float = 0, max_settled: int = 0) -> int:
+        """
+        Deletes done and failed jobs settled over `max_age` seconds ago, and all but the `max_settled` latest ones.
+        Their keys can be enqueued again. 0 to keep jobs regardless of their age or number.
+
+        Returns:
+            int: The number of deleted jobs.
+        """
+        deleted_cnt = 0
+        with self._lock:
+            if max_age > 0:
+                deleted_cnt += self._connection.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (time.time() - max_age,)
+                ).rowcount
+            if max_settled > 0:
+                deleted_cnt += self._connection.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id NOT IN ("
+                    "SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY updated_at DESC, id DESC LIMIT ?)",
+                    (max_settled,)
+                ).rowcount
+            self._connection.commit()
+        return deleted_cnt
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def pending(self) -> list[dict]:
+        """Returns the queued and running jobs."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def counts(self) -> dict:
+        """Returns the number of jobs by status."""
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"queued": 0, "running": 0, "done": 0, "failed": 0} | dict(rows)
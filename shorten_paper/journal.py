@@ -0,0 +1,139 @@
+"""A run journal for resuming interrupted shortening runs"""
+import hashlib
+import json
+import os
+import threading
+
+from shorten_paper.config import Config
+
+CFG = Config()
+
+
+class RunJournal:
+    """
+    Append-only JSON lines journal of a shortening run.
+
+    It records the run's instructions, every shortened chunk of every repeat pass and every finished file,
+    so a restarted run can skip what is already done.
+    A run is identified by its input files and the settings that decide how they are chunked.
+
+    Args:
+        path (str): The journal file path.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = None
+        self.instructions = None
+        self.chunk_outputs = {}
+        self.file_results = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def for_run(cls, input_dir: str, files: list[str], file_settings: list[dict] = None) -> "RunJournal":
+        """
+        Opens the journal of the run over the given input files with the current settings.
+
+        Args:
+            file_settings (list[dict]): The per-file settings of a manifest run, if any.
+        """
+        file_stats = []
+        for document_name in files:
+            try:
+                stat = os.stat(os.path.join(input_dir, document_name))
+                file_stats.append([document_name, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                file_stats.append([document_name, None, None])
+        run_key = json.dumps({
+            "version": 4,
+            "input_dir": os.path.abspath(input_dir),
+            "output_dir": os.path.abspath(CFG.papers_output_dir),
+            "files": file_stats,
+            "lang_model": CFG.lang_model_name,
+            "text_token_len": CFG.text_token_len,
+            "context_window_margin": CFG.context_window_margin,
+            "adaptive_chunking": CFG.adaptive_chunking,
+            "shorten_repeat": CFG.shorten_repeat,
+            "shorten_ratio": CFG.shorten_ratio,
+            "shorten_target_ratio": CFG.shorten_target_ratio,
+            "shorten_mode": CFG.shorten_mode,
+            "tree_target_tokens": CFG.tree_target_tokens if CFG.shorten_mode == "tree" else None,
+            "previous_text_token_ratio": CFG.previous_text_token_ratio,
+            "next_text_token_ratio": CFG.next_text_token_ratio,
+            "chunk_concurrency": CFG.chunk_concurrency > 1,
+            "file_settings": file_settings,
+        }, sort_keys=True)
+        run_id = hashlib.sha256(run_key.encode("utf-8")).hexdigest()[:16]
+        return cls(os.path.join(CFG.cache_dir, "journals", f"run_{run_id}.jsonl"))
+
+    @property
+    def resumable(self) -> bool:
+        return self.instructions is not None
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A record cut off by the interruption.
+                    continue
+                if record["type"] == "run":
+                    self.files = record["files"]
+                    self.instructions = record["instructions"]
+                elif record["type"] == "chunk":
+                    key = (record["repeat_num"], record["document_name"])
+                    self.chunk_outputs.setdefault(key, {})[record["chunk_idx"]] = record["output"]
+                elif record["type"] == "file":
+                    self.file_results[record["document_name"]] = tuple(record["result"])
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def start(self, files: list[str], instructions: list[str]) -> None:
+        """Discards any previous progress and records the run's instructions."""
+        with self._lock:
+            self._file.truncate(0)
+        self.chunk_outputs = {}
+        self.file_results = {}
+        self.files = files
+        self.instructions = instructions
+        self._append({"type": "run", "files": files, "instructions": instructions})
+
+    def completed_chunks(self, repeat_num: int, document_name: str) -> dict[int, str]:
+        return dict(self.chunk_outputs.get((repeat_num, document_name), {}))
+
+    def completed_chunks_by_pass(self, document_name: str) -> dict[int, dict[int, str]]:
+        """Returns the outputs of the chunks already shortened for a file, by pass (or level) and chunk index."""
+        return {repeat_num: dict(outputs) for (repeat_num, name), outputs in self.chunk_outputs.items()
+                if name == document_name}
+
+    def record_chunk(self, repeat_num: int, document_name: str, chunk_idx: int, output: str) -> None:
+        self.chunk_outputs.setdefault((repeat_num, document_name), {})[chunk_idx] = output
+        self._append({"type": "chunk", "repeat_num": repeat_num, "document_name": document_name,
+                      "chunk_idx": chunk_idx, "output": output})
+
+    def file_result(self, document_name: str) -> tuple | None:
+        return self.file_results.get(document_name)
+
+    def record_file(self, document_name: str, result: tuple) -> None:
+        self.file_results[document_name] = tuple(result)
+        self._append({"type": "file", "document_name": document_name, "result": list(result)})
+
+    def close(self) -> None:
+        """Closes the journal of a run that did not complete, keeping it to resume from."""
+        with self._lock:
+            self._file.close()
+
+    def finish(self) -> None:
+        """Removes the journal of a run that completed."""
+        with self._lock:
+            self._file.close()
+            os.remove(self.path)
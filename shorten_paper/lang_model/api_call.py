@@ -1,94 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
 import time
-
-import openai
+from typing import Callable
 
 from colorama import Fore, Style
 from shorten_paper.logs import logger
 from shorten_paper.config import Config
+from shorten_paper.metrics import Metrics
+from shorten_paper.singletone import Singleton
+from shorten_paper.lang_model.backends import get_backend
+from shorten_paper.lang_model.rate_limiter import RateLimiter
+from shorten_paper.lang_model.retry_policy import ChatCompletionError, CircuitBreaker, RetryPolicy
+from shorten_paper.lang_model.text_processing import count_string_tokens
 
 CFG = Config()
 
 
+class ResponseCache(metaclass=Singleton):
+    """
+    Local SQLite cache of chat completion responses, keyed by a hash of the model, sampling parameters and messages.
+
+    Entries expire after `ttl` seconds, and the least recently used entries are evicted
+    once the stored responses exceed `max_bytes`.
+
+    Args:
+        path (str): The SQLite database file path.
+        max_bytes (int): The maximum total size of the stored responses.
+        ttl (float): Seconds an entry stays valid. 0 to never expire.
+    """
+
+    def __init__(
+            self,
+            path: str = os.path.join(CFG.cache_dir, "responses.sqlite3"),
+            max_bytes: int = CFG.response_cache_max_mb * 1024 * 1024,
+            ttl: float = CFG.response_cache_ttl_days * 24 * 60 * 60
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(messages: list, lang_model: str, **sampling_params) -> str:
+        payload = json.dumps(
+            {"model": lang_model, "messages": messages, **sampling_params}, sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl > 0 and now - created_at > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, response, size, now, now)
+            )
+            if self.ttl > 0:
+                self._connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_bytes:
+                # Drop the least recently used entries until the cache fits again.
+                evict_keys = []
+                for evict_key, evict_size in self._connection.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+                    if total_size <= self.max_bytes:
+                        break
+                    evict_keys.append((evict_key,))
+                    total_size -= evict_size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+
+def estimate_prompt_tokens(messages: list, lang_model: str = CFG.lang_model_name) -> int:
+    """Estimates the prompt tokens of chat messages, including the per-message formatting overhead."""
+    return sum(count_string_tokens(message["content"], lang_model) + 4 for message in messages) + 3
+
+
 def create_chat_completion(
         messages: list,
         lang_model: str = CFG.lang_model_name,
         temperature: float = CFG.model_temperature,
         top_p: float = CFG.model_top_p,
         presence_penalty: float = CFG.model_presence_penalty,
-        frequency_penalty: float = CFG.model_frequency_penalty
+        frequency_penalty: float = CFG.model_frequency_penalty,
+        use_cache: bool = CFG.response_cache,
+        token_cost: int = None,
+        retry_policy: RetryPolicy = None,
+        on_delta: Callable[[str], None] = None,
+        on_usage: Callable[[dict], None] = None
 ):
-    response = None
-    num_retries = 10
+    """
+    Requests a chat completion from the configured backend, admitted through the shared rate limiter.
+
+    Args:
+        token_cost (int): Estimated prompt and completion tokens of the request.
+            Defaults to None, to count the prompt tokens of the messages.
+        retry_policy (RetryPolicy): The policy for retrying failed attempts. Defaults to None, the configured one.
+        on_delta (Callable[[str], None]): If given, the completion is streamed and called with each piece of content
+            as it arrives. A stream interrupted after its first piece is not retried.
+        on_usage (Callable[[dict], None]): If given, called with the "prompt_tokens" and "completion_tokens"
+            of the response. They are counted locally and marked "estimated" when the backend does not report them,
+            and marked "cached" when the response came from the response cache.
+
+    Returns:
+        str: The content of the response message.
+
+    Raises:
+        ChatCompletionError: If no response could be obtained.
+        CircuitOpenError: If the circuit breaker is open after sustained failures.
+    """
+    if use_cache:
+        cache_key = ResponseCache.make_key(
+            messages, lang_model,
+            temperature=temperature, top_p=top_p,
+            presence_penalty=presence_penalty, frequency_penalty=frequency_penalty,
+            # Responses of a mock backend or server must never be served for the real API.
+            backend=CFG.llm_backend, api_base=CFG.openai_api_base
+        )
+        cached_response = ResponseCache().get(cache_key)
+        if cached_response is not None:
+            Metrics().increment("response_cache_hits")
+            if on_delta is not None:
+                on_delta(cached_response)
+            if on_usage is not None:
+                on_usage({"prompt_tokens": 0, "completion_tokens": 0, "cached": True})
+            return cached_response
+
+    # The SDK is slow to import, so it is only loaded once a request is actually made.
+    import openai
+
+    if token_cost is None:
+        token_cost = estimate_prompt_tokens(messages, lang_model)
+
+    retry_policy = retry_policy or RetryPolicy()
+    circuit_breaker = CircuitBreaker()
     warned_user = False
 
-    for try_num in range(num_retries):
-        delay = 5 * (try_num + 1)
+    for try_num in range(retry_policy.max_retries):
+        circuit_breaker.before_attempt()
+        content_parts = []
+        usage = None
+        network_started_at = time.perf_counter()
         try:
-            response = openai.ChatCompletion.create(
+            Metrics().observe("api_queue", RateLimiter().acquire(token_cost))
+            network_started_at = time.perf_counter()
+            response = get_backend().create(
                 model=lang_model,
                 messages=messages,
                 temperature=temperature,
                 top_p=top_p,
                 presence_penalty=presence_penalty,
-                frequency_penalty=frequency_penalty
+                frequency_penalty=frequency_penalty,
+                request_timeout=retry_policy.request_timeout,
+                stream=on_delta is not None
             )
-            break
-        except openai.error.RateLimitError:
-            if warned_user:
-                logger.double_check(
-                    f"You've got {Fore.YELLOW + Style.BRIGHT}RateLimitError{Style.RESET_ALL} "
-                    f"in try number {try_num+1}/{num_retries}."
-                )
+            if on_delta is None:
+                content, usage = response
             else:
-                logger.double_check(
-                    f"You've got {Fore.YELLOW + Style.BRIGHT}RateLimitError{Style.RESET_ALL} "
-                    f"in try number {try_num+1}/{num_retries}."
-                    f"Please double check that you have setup a "
-                    f"{Fore.CYAN + Style.BRIGHT}PAID{Style.RESET_ALL} OpenAI API Account. "
-                    f"You can read more here: "
-                    f"{Fore.CYAN}https://github.com/Significant-Gravitas/Auto-GPT#openai-api-keys-configuration"
-                    f"{Fore.RESET}"
-                )
-            warned_user = True
-
-        except openai.error.APIError as e:
-            if e.http_status == 502:
-                pass
+                for delta in response:
+                    if delta:
+                        content_parts.append(delta)
+                        on_delta(delta)
+                content = "".join(content_parts)
+        except openai.error.OpenAIError as e:
+            Metrics().observe("api_network", time.perf_counter() - network_started_at)
+            Metrics().increment("api_errors", error=type(e).__name__)
+            if content_parts:
+                # What was streamed has already been consumed, so the request cannot be replayed.
+                circuit_breaker.record_failure()
+                raise ChatCompletionError(f"The stream was interrupted by {type(e).__name__}: {e}") from e
+            if not retry_policy.is_retryable(e):
+                # The service answered, so this does not count against the circuit breaker.
+                circuit_breaker.record_success()
+                raise ChatCompletionError(f"{type(e).__name__}: {e}") from e
+            if retry_policy.is_outage(e):
+                circuit_breaker.record_failure()
             else:
-                logger.error(
-                    "FAILED TO GET RESPONSE FROM OPENAI",
-                    Fore.RED,
-                    f"Shorten Paper has failed to get a response from OpenAI's services. "
-                    f"Try running Shorten Paper again, "
-                    f"and if the problem the persists check your "
-                    f"{Fore.CYAN}environment settings{Fore.RESET} and "
-                    f"{Fore.CYAN}OpenAI API Account{Fore.RESET}.",
-                )
-                quit(1)
-            if try_num == num_retries - 1:
-                logger.error(
-                    "FAILED TO GET RESPONSE FROM OPENAI",
-                    Fore.RED,
-                    f"Shorten Paper has failed to get a response from OpenAI's services. "
-                    f"Try running Shorten Paper again, "
-                    f"and if the problem the persists check your "
-                    f"{Fore.CYAN}environment settings{Fore.RESET} and "
-                    f"{Fore.CYAN}OpenAI API Account{Fore.RESET}.",
-                )
-                quit(1)
-
-        time.sleep(delay)
-
-    if response is None:
-        logger.error(
-            "FAILED TO GET RESPONSE FROM OPENAI",
-            Fore.RED,
-            f"Shorten Paper has failed to get a response from OpenAI's services. "
-            f"Try running Shorten Paper again, "
-            f"and if the problem the persists check your "
-            f"{Fore.CYAN}environment settings{Fore.RESET} and "
-            f"{Fore.CYAN}OpenAI API Account{Fore.RESET}.",
-        )
-        quit(1)
+                # Rate limits are handled by the rate limiter and Retry-After, not by failing every request fast.
+                circuit_breaker.record_throttle()
+
+            if isinstance(e, openai.error.RateLimitError):
+                RateLimiter().penalize()
+                if warned_user:
+                    logger.double_check(
+                        f"You've got {Fore.YELLOW + Style.BRIGHT}RateLimitError{Style.RESET_ALL} "
+                        f"in try number {try_num+1}/{retry_policy.max_retries}."
+                    )
+                else:
+                    logger.double_check(
+                        f"You've got {Fore.YELLOW + Style.BRIGHT}RateLimitError{Style.RESET_ALL} "
+                        f"in try number {try_num+1}/{retry_policy.max_retries}."
+                        f"Please double check that you have setup a "
+                        f"{Fore.CYAN + Style.BRIGHT}PAID{Style.RESET_ALL} OpenAI API Account. "
+                        f"You can read more here: "
+                        f"{Fore.CYAN}https://github.com/Significant-Gravitas/Auto-GPT#openai-api-keys-configuration"
+                        f"{Fore.RESET}"
+                    )
+                warned_user = True
+            else:
+                logger.warn(f"{type(e).__name__}: {e}", f"Try number {try_num+1}/{retry_policy.max_retries}:")
+
+            if try_num < retry_policy.max_retries - 1:
+                retry_delay = retry_policy.delay(try_num, e)
+                Metrics().increment("api_retries")
+                Metrics().observe("retry_backoff", retry_delay)
+                time.sleep(retry_delay)
+            continue
+        except BaseException:
+            # Anything else, like a failing `on_delta` writer, ends the attempt too.
+            # Recording it releases a half-open trial, which would otherwise keep the circuit open for good.
+            circuit_breaker.record_failure()
+            raise
+
+        Metrics().observe("api_network", time.perf_counter() - network_started_at)
+        circuit_breaker.record_success()
+        if use_cache:
+            ResponseCache().put(cache_key, content)
+        if on_usage is not None:
+            if usage is None:
+                usage = {"prompt_tokens": estimate_prompt_tokens(messages, lang_model),
+                         "completion_tokens": count_string_tokens(content, lang_model), "estimated": True}
+            on_usage(usage)
+        return content
 
-    return response.choices[0].message["content"]
+    raise ChatCompletionError(
+        f"Shorten Paper has failed to get a response from OpenAI's services "
+        f"after {retry_policy.max_retries} tries. "
+        f"Try running Shorten Paper again, "
+        f"and if the problem the persists check your "
+        f"{Fore.CYAN}environment settings{Fore.RESET} and "
+        f"{Fore.CYAN}OpenAI API Account{Fore.RESET}."
+    )
@@ -0,0 +1,170 @@
+"""Chat completion backends, selected with LLM_BACKEND"""
+import random
+import re
+import threading
+import time
+from typing import Iterator
+
+from shorten_paper.config import Config
+from shorten_paper.lang_model.text_processing import TokenizedText
+
+CFG = Config()
+
+_CURRENT_TEXT_PATTERN = re.compile(r'"Current Text": """(.*?)"""(?: "Previous Text"|$)', re.S)
+_REQUESTED_LENGTH_PATTERN = re.compile(r"to exact (\d+) words")
+
+
+class ChatBackend:
+    """
+    A backend answering chat completion requests.
+
+    It returns the content of the response message with its token usage, or None if the backend does not report it.
+    When `stream` is True, it returns an iterator over the pieces of the content instead.
+    Failures are raised as `openai.error.OpenAIError`, so every backend goes through the same retry policy.
+    """
+
+    def create(
+            self, model: str, messages: list, temperature: float, top_p: float,
+            presence_penalty: float, frequency_penalty: float, request_timeout: float, stream: bool = False
+    ) -> tuple[str, dict | None] | Iterator[str]:
+        raise NotImplementedError
+
+
+# The OpenAI chat completions API, or any server speaking its schema at OPENAI_API_BASE
+class OpenAIBackend(ChatBackend):
+    def __init__(self):
+        # The SDK is slow to import, so it is only loaded once a request is actually made.
+        import openai
+
+        openai.api_key = CFG.openai_api_key
+        if CFG.openai_api_base:
+            openai.api_base = CFG.openai_api_base
+
+    def create(
+            self, model: str, messages: list, temperature: float, top_p: float,
+            presence_penalty: float, frequency_penalty: float, request_timeout: float, stream: bool = False
+    ) -> tuple[str, dict | None] | Iterator[str]:
+        import openai
+
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            presence_penalty=presence_penalty,
+            frequency_penalty=frequency_penalty,
+            request_timeout=request_timeout,
+            stream=stream
+        )
+        if not stream:
+            usage = response.get("usage")
+            return response.choices[0].message["content"], dict(usage) if usage is not None else None
+        return (response_chunk.choices[0].delta.get("content", "") for response_chunk in response)
+
+
+# An offline stand-in for load testing, answering with a prefix of the text it was asked to shorten
+class MockBackend(ChatBackend):
+    """
+    Args:
+        latency (float): Seconds before the first piece of the response.
+        tokens_per_second (float): Generation speed of the response. 0 for instant.
+        error_rate (float): Probability of an attempt failing with a retryable error.
+        output_ratio (float): Response tokens per token of the "Current Text", or of the last message without it,
+            when the length is not followed.
+        length_compliance (float): Response tokens per word the prompt asks for, like a model overshooting
+            or undershooting the requested length. 0 to ignore the requested length and use `output_ratio`.
+        seed (int): Seed of the simulated errors. None for a random one.
+    """
+
+    def __init__(
+            self,
+            latency: float = CFG.mock_latency,
+            tokens_per_second: float = CFG.mock_tokens_per_second,
+            error_rate: float = CFG.mock_error_rate,
+            output_ratio: float = CFG.mock_output_ratio,
+            length_compliance: float = CFG.mock_length_compliance,
+            seed: int = None
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.output_ratio = output_ratio
+        self.length_compliance = length_compliance
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _fail(self) -> None:
+        import openai
+
+        with self._random_lock:
+            roll = self._random.random()
+        if roll >= self.error_rate:
+            return
+        # Split the simulated failures between the errors the API actually returns under load.
+        error_cls = (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                     openai.error.APIError)[int(roll / self.error_rate * 3)]
+        http_status = {openai.error.RateLimitError: 429, openai.error.ServiceUnavailableError: 503}.get(error_cls, 500)
+        raise error_cls(f"Simulated {error_cls.__name__} of the mock backend.", http_status=http_status)
+
+    def response_pieces(self, model: str, messages: list) -> list[dict]:
+        """Returns the pieces of the response, one per streamed delta, with their token counts."""
+        content = messages[-1]["content"] if messages else ""
+        current_text = _CURRENT_TEXT_PATTERN.search(content)
+        tokenized_text = TokenizedText(current_text.group(1) if current_text else content, model)
+        requested_length = _REQUESTED_LENGTH_PATTERN.search(content)
+        if requested_length is not None and self.length_compliance > 0:
+            response_token_cnt = max(1, round(int(requested_length.group(1)) * self.length_compliance))
+        else:
+            response_token_cnt = max(1, round(len(tokenized_text) * self.output_ratio))
+        pieces = []
+        for split in tokenized_text.split_with_next_text(8, 0):
+            if response_token_cnt <= 0:
+                break
+            pieces.append(split["current_text"])
+            response_token_cnt -= split["current_text"]["token_cnt"]
+        return pieces
+
+    def _generate(self, model: str, messages: list, request_timeout: float) -> Iterator[str]:
+        import openai
+
+        started_at = time.monotonic()
+        pieces = self.response_pieces(model, messages)
+        time.sleep(min(self.latency, request_timeout))
+        if self.latency > request_timeout:
+            raise openai.error.Timeout("Simulated timeout of the mock backend.")
+        self._fail()
+        for piece in pieces:
+            if self.tokens_per_second > 0:
+                time.sleep(piece["token_cnt"] / self.tokens_per_second)
+            if time.monotonic() - started_at > request_timeout:
+                raise openai.error.Timeout("Simulated timeout of the mock backend.")
+            yield piece["text"]
+
+    def create(
+            self, model: str, messages: list, temperature: float, top_p: float,
+            presence_penalty: float, frequency_penalty: float, request_timeout: float, stream: bool = False
+    ) -> tuple[str, dict | None] | Iterator[str]:
+        if stream:
+            return self._generate(model, messages, request_timeout)
+        return "".join(self._generate(model, messages, request_timeout)), None
+
+
+name_to_backend = {
+    "openai": OpenAIBackend,
+    "mock": MockBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> ChatBackend:
+    """Returns the process-wide backend selected with LLM_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend_cls = name_to_backend.get(CFG.llm_backend)
+            if backend_cls is None:
+                raise ValueError(f"Unsupported LLM backend: {CFG.llm_backend}. Supporting {list(name_to_backend.keys())}")
+            _backend = backend_cls()
+        return _backend
@@ -0,0 +1,161 @@
+"""
+A localhost server speaking the chat completions schema, answering with the mock backend.
+
+Run it with `python -m shorten_paper.lang_model.mock_server --port 8000`,
+and point the openai backend at it with OPENAI_API_BASE=http://127.0.0.1:8000/v1,
+to load test the whole pipeline, HTTP client included, without an API key.
+"""
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+
+from shorten_paper.config import Config
+from shorten_paper.lang_model.backends import MockBackend
+
+CFG = Config()
+
+
+class MockChatCompletionHandler(BaseHTTPRequestHandler):
+    backend: MockBackend = None
+    max_request_bytes: int = 16 * 1024 * 1024
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, error: openai.error.OpenAIError) -> None:
+        headers = {"Retry-After": "1"} if isinstance(error, openai.error.RateLimitError) else None
+        self._send_json(error.http_status or 500,
+                        {"error": {"message": str(error), "type": type(error).__name__, "code": None}}, headers)
+
+    def _send_event(self, body: dict | str) -> None:
+        data = body if isinstance(body, str) else json.dumps(body)
+        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            content_len = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            content_len = -1
+        if not 0 <= content_len <= self.max_request_bytes:
+            self._send_json(413 if content_len > self.max_request_bytes else 400, {"error": {
+                "message": f"Content-Length should be an integer in [0, {self.max_request_bytes}].",
+                "type": "invalid_request_error"
+            }})
+            self.close_connection = True
+            return
+        try:
+            request = json.loads(self.rfile.read(content_len) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "The request body is not JSON.",
+                                            "type": "invalid_request_error"}})
+            return
+        model = request.get("model", CFG.lang_model_name)
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex}"
+        created = int(time.time())
+        pieces = self.backend.create(
+            model=model,
+            messages=request.get("messages", []),
+            temperature=request.get("temperature", 1),
+            top_p=request.get("top_p", 1),
+            presence_penalty=request.get("presence_penalty", 0),
+            frequency_penalty=request.get("frequency_penalty", 0),
+            request_timeout=CFG.request_timeout,
+            stream=True
+        )
+
+        if not request.get("stream"):
+            try:
+                content = "".join(pieces)
+            except openai.error.OpenAIError as e:
+                self._send_error(e)
+                return
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}]
+            })
+            return
+
+        try:
+            first_piece = next(pieces, None)
+        except openai.error.OpenAIError as e:
+            self._send_error(e)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta: dict, finish_reason: str = None) -> dict:
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        self._send_event(chunk({"role": "assistant"}))
+        if first_piece is not None:
+            self._send_event(chunk({"content": first_piece}))
+            try:
+                for piece in pieces:
+                    self._send_event(chunk({"content": piece}))
+            except openai.error.OpenAIError:
+                # Cut the stream off, as a dropped connection would.
+                return
+        self._send_event(chunk({}, "stop"))
+        self._send_event("[DONE]")
+
+
+def serve(
+        host: str = "127.0.0.1", port: int = 8000, backend: MockBackend = None,
+        max_request_bytes: int = MockChatCompletionHandler.max_request_bytes
+) -> ThreadingHTTPServer:
+    """Returns a mock server bound to host:port. Call serve_forever() on it to start answering."""
+    handler = type("BoundMockChatCompletionHandler", (MockChatCompletionHandler,),
+                   {"backend": backend or MockBackend(), "max_request_bytes": max_request_bytes})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Serve the mock chat completions backend over HTTP.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--latency", type=float, default=CFG.mock_latency)
+    arg_parser.add_argument("--tokens-per-second", type=float, default=CFG.mock_tokens_per_second)
+    arg_parser.add_argument("--error-rate", type=float, default=CFG.mock_error_rate)
+    arg_parser.add_argument("--output-ratio", type=float, default=CFG.mock_output_ratio)
+    arg_parser.add_argument("--length-compliance", type=float, default=CFG.mock_length_compliance)
+    arg_parser.add_argument("--max-request-mb", type=int, default=16)
+    args = arg_parser.parse_args()
+
+    mock_server = serve(args.host, args.port, MockBackend(
+        latency=args.latency, tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate, output_ratio=args.output_ratio, length_compliance=args.length_compliance
+    ), args.max_request_mb * 1024 * 1024)
+    print(f"Mock chat completions server on http://{args.host}:{args.port}/v1")
+    try:
+        mock_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock_server.server_close()
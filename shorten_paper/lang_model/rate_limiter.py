@@ -0,0 +1,98 @@
+import threading
+import time
+
+from shorten_paper.config import Config
+from shorten_paper.singletone import Singleton
+
+CFG = Config()
+
+
+class TokenBucket:
+    """
+    A bucket refilled continuously up to `capacity` over every 60 seconds.
+
+    Args:
+        capacity (float): The amount available per minute. 0 or less means unlimited.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float) -> None:
+        if self.unlimited:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Returns the seconds until `amount` is available, after a refill."""
+        if self.unlimited or self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self.level -= amount
+
+
+class RateLimiter(metaclass=Singleton):
+    """
+    Process-wide limiter admitting API requests through requests-per-minute and tokens-per-minute buckets.
+
+    Every caller, from any thread, shares the same buckets, so concurrent requests stay under the account limits
+    instead of being rejected with RateLimitError.
+
+    Args:
+        requests_per_minute (int): The request limit per minute. 0 for unlimited.
+        tokens_per_minute (int): The token limit per minute. 0 for unlimited.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: int = CFG.rate_limit_rpm,
+            tokens_per_minute: int = CFG.rate_limit_tpm
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self.waited_seconds = 0.0
+
+    def acquire(self, token_cost: int) -> float:
+        """
+        Blocks until a request of `token_cost` tokens is admitted.
+
+        Returns:
+            float: The seconds spent waiting.
+        """
+        if not self.token_bucket.unlimited:
+            # A request bigger than the whole bucket would never be admitted otherwise.
+            token_cost = min(token_cost, self.token_bucket.capacity)
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self.request_bucket.refill(now)
+                self.token_bucket.refill(now)
+                wait_time = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(token_cost))
+                if wait_time <= 0:
+                    self.request_bucket.take(1)
+                    self.token_bucket.take(token_cost)
+                    waited = time.monotonic() - start
+                    self.waited_seconds += waited
+                    return waited
+                self._condition.wait(wait_time)
+
+    def penalize(self) -> None:
+        """Empties the buckets after the server reported a rate limit, so no one hammers it meanwhile."""
+        with self._condition:
+            now = time.monotonic()
+            for bucket in (self.request_bucket, self.token_bucket):
+                bucket.refill(now)
+                if not bucket.unlimited:
+                    bucket.level = min(bucket.level, 0)
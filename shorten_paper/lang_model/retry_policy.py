@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+
+from shorten_paper.config import Config
+from shorten_paper.singletone import Singleton
+
+CFG = Config()
+
+RETRYABLE_HTTP_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ChatCompletionError(Exception):
+    """Raised when a chat completion could not be obtained."""
+
+
+class CircuitOpenError(ChatCompletionError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+
+class RetryPolicy:
+    """
+    Decides which API errors are retried and how long to wait before each retry.
+
+    Delays grow exponentially with full jitter and are capped at `max_delay`,
+    unless the server asked for a longer wait with a Retry-After header.
+    Subclass it to plug in another policy.
+
+    Args:
+        max_retries (int): The maximum number of attempts per request.
+        base_delay (float): The delay cap of the first retry, in seconds.
+        max_delay (float): The delay cap of any retry, in seconds.
+        request_timeout (float): The timeout of each attempt, in seconds.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = CFG.retry_max_retries,
+            base_delay: float = CFG.retry_base_delay,
+            max_delay: float = CFG.retry_max_delay,
+            request_timeout: float = CFG.request_timeout
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+
+    def is_retryable(self, error: Exception) -> bool:
+        import openai
+
+        if isinstance(error, (openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+                              openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+            return True
+        return isinstance(error, openai.error.APIError) and error.http_status in RETRYABLE_HTTP_STATUSES
+
+    def is_outage(self, error: Exception) -> bool:
+        """
+        Tells whether an error means the service is unreachable or failing, which counts against the circuit breaker.
+        Rate limits are not: the service is up and throttling, and backing off handles them.
+        """
+        import openai
+
+        if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError,
+                              openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+            return True
+        return isinstance(error, openai.error.APIError) and not isinstance(error, openai.error.RateLimitError) \
+            and error.http_status is not None and error.http_status >= 500
+
+    @staticmethod
+    def retry_after(error: Exception) -> float | None:
+        """Returns the wait the server asked for in the Retry-After header, if any."""
+        headers = getattr(error, "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def delay(self, try_num: int, error: Exception = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** try_num))
+        retry_after = self.retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+
+class CircuitBreaker(metaclass=Singleton):
+    """
+    Process-wide circuit breaker over API attempts.
+
+    After `failure_threshold` consecutive failed attempts, every request fails fast with CircuitOpenError
+    for `cooldown` seconds. Then a single trial attempt is let through, and its success closes the circuit again.
+    Only outages count as failures: rate limits are throttling by a service that is up.
+
+    Args:
+        failure_threshold (int): Consecutive failed attempts that open the circuit. 0 to never open.
+        cooldown (float): Seconds the circuit stays open.
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = CFG.circuit_breaker_threshold,
+            cooldown: float = CFG.circuit_breaker_cooldown
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_attempt(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_running:
+                raise CircuitOpenError(
+                    f"The circuit breaker is open after {self.consecutive_failures} consecutive failed requests."
+                )
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_throttle(self) -> None:
+        """
+        Records an attempt the service answered but throttled. The service is up, so a trial closes the circuit,
+        while other attempts leave the failure count as it is.
+        """
+        with self._lock:
+            if self._trial_running:
+                self.consecutive_failures = 0
+                self.opened_at = None
+                self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._trial_running or \
+                    0 < self.failure_threshold <= self.consecutive_failures and self.opened_at is None:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
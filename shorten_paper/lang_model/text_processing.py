@@ -1,18 +1,83 @@
 import math
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
 import tiktoken
 from shorten_paper.logs import Logger
+from shorten_paper.config import Config
 
 logger = Logger()
+CFG = Config()
+
+# UTF-8 continuation bytes (0b10xxxxxx) never start a codepoint.
+_UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(lang_model: str = "gpt-3.5-turbo") -> tiktoken.Encoding:
+    """Returns the process-wide encoding for a language model, loading it on first use."""
+    encoding = _encodings.get(lang_model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        if lang_model not in _encodings:
+            try:
+                _encodings[lang_model] = tiktoken.encoding_for_model(lang_model)
+            except (KeyError, ValueError):
+                logger.warn("Warning: model not found. Using cl100k_base encoding.")
+                _encodings[lang_model] = tiktoken.get_encoding("cl100k_base")
+        return _encodings[lang_model]
+
+
+# Context windows of the chat models, in tokens, shared by the prompt and the completion.
+# Models are matched by the longest listed prefix, so dated snapshots fall back to their family.
+model_context_windows = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-0125-preview": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+}
+_default_context_window = 4096
+
+
+def match_model(lang_model: str, models) -> str | None:
+    """Returns the longest of `models` that `lang_model` starts with, or None."""
+    matched_models = [model for model in models if lang_model.startswith(model)]
+    return max(matched_models, key=len) if matched_models else None
+
+
+def get_context_window(lang_model: str = "gpt-3.5-turbo") -> int:
+    """Returns the context window of a language model from `model_context_windows`."""
+    matched_model = match_model(lang_model, model_context_windows)
+    if matched_model is None:
+        logger.warn(f"Warning: context window of {lang_model} not known. Using {_default_context_window} tokens.")
+        return _default_context_window
+    return model_context_windows[matched_model]
+
+
+def request_token_budget(lang_model: str = "gpt-3.5-turbo") -> int:
+    """
+    Returns the tokens a single request may use, prompt and completion together:
+    TEXT_TOKEN_LEN if set, or else the model's context window less CONTEXT_WINDOW_MARGIN.
+    """
+    if CFG.text_token_len > 0:
+        return CFG.text_token_len
+    return math.floor(get_context_window(lang_model) * (1 - CFG.context_window_margin))
 
 
 def string_to_tokens(
         string: str, lang_model: str = "gpt-3.5-turbo"
 ) -> list[int]:
-    try:
-        encoding = tiktoken.encoding_for_model(lang_model)
-    except ValueError:
-        logger.warn("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_encoding(lang_model)
 
     string = string.replace("\n", " ")
     return encoding.encode(string)
@@ -42,34 +107,59 @@ def tokens_to_string(
         str: The decoded string.
         int: The token count of decoded string.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(lang_model)
-    except ValueError:
-        logger.warn("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_encoding(lang_model)
+    token_start_idx = 0 if token_start_idx is None else max(0, token_start_idx)
+    token_end_idx = len(tokens) if token_end_idx is None else min(token_end_idx, len(tokens))
+    if token_start_idx >= token_end_idx:
+        return "", 0
 
+    # The token right after the window tells whether the window ends on a codepoint boundary.
+    boundaries = token_boundaries(encoding.decode_tokens_bytes(tokens[token_start_idx:token_end_idx + 1]))
+    window_len = token_end_idx - token_start_idx
     if from_back:
-        tmp_token_end_idx = token_end_idx if token_end_idx else len(tokens)
-        while True:
-            if tmp_token_end_idx < 1:
-                result_tokens = tokens[token_start_idx:token_end_idx]
-                return encoding.decode(result_tokens), len(result_tokens)
-            try:
-                result_tokens = tokens[token_start_idx:tmp_token_end_idx]
-                return encoding.decode_bytes(result_tokens).decode(), len(result_tokens)
-            except UnicodeDecodeError:
-                tmp_token_end_idx -= 1
+        safe_end = snap_back(boundaries, window_len)
+        safe_start = snap_forward(boundaries, 0, safe_end)
     else:
-        tmp_token_start_idx = token_start_idx if token_start_idx else 0
-        while True:
-            if tmp_token_start_idx >= len(tokens):
-                result_tokens = tokens[token_start_idx:token_end_idx]
-                return encoding.decode(result_tokens), len(result_tokens)
-            try:
-                result_tokens = tokens[tmp_token_start_idx:token_end_idx]
-                return encoding.decode(result_tokens), len(result_tokens)
-            except UnicodeDecodeError:
-                tmp_token_start_idx += 1
+        safe_start = snap_forward(boundaries, 0, window_len)
+        safe_end = snap_back(boundaries, window_len, safe_start)
+    if safe_start == safe_end:
+        # No codepoint fits in the window, so fall back to a lossy decode of it.
+        result_tokens = tokens[token_start_idx:token_end_idx]
+        return encoding.decode(result_tokens), len(result_tokens)
+
+    result_tokens = tokens[token_start_idx + safe_start:token_start_idx + safe_end]
+    return encoding.decode_bytes(result_tokens).decode(), len(result_tokens)
+
+
+def token_boundaries(token_bytes: list[bytes]) -> list[int]:
+    """
+    Finds the token indices at which a new codepoint starts.
+
+    Args:
+        token_bytes (list[bytes]): The bytes of each token, as returned by `Encoding.decode_tokens_bytes`.
+
+    Returns:
+        list[int]: Sorted token indices that are safe to cut at, always including len(token_bytes).
+    """
+    boundaries = [idx for idx, chunk in enumerate(token_bytes) if chunk[0] not in _UTF8_CONTINUATION_BYTES]
+    boundaries.append(len(token_bytes))
+    return boundaries
+
+
+def snap_back(boundaries: list[int], token_idx: int, lower: int = 0) -> int:
+    """Returns the closest boundary in [lower, token_idx], or lower if there is none."""
+    pos = bisect_right(boundaries, token_idx) - 1
+    if pos < 0 or boundaries[pos] < lower:
+        return lower
+    return boundaries[pos]
+
+
+def snap_forward(boundaries: list[int], token_idx: int, upper: int) -> int:
+    """Returns the closest boundary in [token_idx, upper], or upper if there is none."""
+    pos = bisect_left(boundaries, token_idx)
+    if pos == len(boundaries) or boundaries[pos] > upper:
+        return upper
+    return boundaries[pos]
 
 
 def truncate_by_token_cnt(
@@ -81,8 +171,111 @@ def truncate_by_token_cnt(
     return tokens_to_string(tokens, lang_model, max(0, len(tokens) - token_cnt), None, False)
 
 
+class TokenizedText:
+    """
+    A text tokenized exactly once, with every token boundary mapped back to a character offset.
+
+    Chunk windows are carved as slices over the token array and returned as slices of the original text,
+    so splitting a document costs one encode regardless of how many chunks it produces.
+
+    Args:
+        text (str): Text to be tokenized.
+        lang_model (str): OpenAI language model name for the token calculation.
+        tokens (list[int]): The tokens of the text, if they are already known. Defaults to None, to encode the text.
+    """
+
+    def __init__(self, text: str, lang_model: str = "gpt-3.5-turbo", tokens: list[int] = None):
+        self.text = text
+        self.lang_model = lang_model
+        self.tokens = string_to_tokens(text, lang_model) if tokens is None else tokens
+
+        token_bytes = get_encoding(lang_model).decode_tokens_bytes(self.tokens)
+        self._boundaries = token_boundaries(token_bytes)
+        # Counting codepoint-leading bytes gives the character offset of every codepoint boundary.
+        self._char_offsets = list(accumulate(
+            (len(chunk.translate(None, _UTF8_CONTINUATION_BYTES)) for chunk in token_bytes), initial=0
+        ))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def snap_back(self, token_idx: int, lower: int = 0) -> int:
+        """Returns the closest codepoint-safe token index in [lower, token_idx], or lower if there is none."""
+        return snap_back(self._boundaries, min(token_idx, len(self.tokens)), lower)
+
+    def snap_forward(self, token_idx: int, upper: int = None) -> int:
+        """Returns the closest codepoint-safe token index in [token_idx, upper], or upper if there is none."""
+        upper = len(self.tokens) if upper is None else min(upper, len(self.tokens))
+        return snap_forward(self._boundaries, max(0, token_idx), upper)
+
+    def prefix(self, token_cnt: int) -> "TokenizedText":
+        """Returns the beginning of the text, up to `token_cnt` tokens, reusing this text's token mapping."""
+        token_end_idx = self.snap_back(token_cnt)
+        prefix = TokenizedText.__new__(TokenizedText)
+        prefix.text = self.text[:self._char_offsets[token_end_idx]]
+        prefix.lang_model = self.lang_model
+        prefix.tokens = self.tokens[:token_end_idx]
+        prefix._boundaries = self._boundaries[:bisect_right(self._boundaries, token_end_idx)]
+        prefix._char_offsets = self._char_offsets[:token_end_idx + 1]
+        return prefix
+
+    def window(self, token_start_idx: int, token_end_idx: int) -> dict:
+        """Returns the original text between two codepoint-safe token indices and its token count."""
+        return {"text": self.text[self._char_offsets[token_start_idx]:self._char_offsets[token_end_idx]],
+                "token_cnt": token_end_idx - token_start_idx}
+
+    def _current_end(self, token_start_idx: int, token_cnt: int) -> int:
+        token_end_idx = self.snap_back(token_start_idx + token_cnt, token_start_idx)
+        if token_end_idx == token_start_idx:
+            # No boundary inside the window: grow it to the end of the split codepoint to keep making progress.
+            token_end_idx = self.snap_forward(token_start_idx + 1)
+        return token_end_idx
+
+    def chunk_at(
+            self, token_start_idx: int, current_token_len: int, previous_token_len: int, next_token_len: int
+    ) -> dict:
+        """Returns the chunk starting at a codepoint-safe token index, with its previous and next text."""
+        token_end_idx = self._current_end(token_start_idx, current_token_len)
+        previous_start_idx = self.snap_forward(token_start_idx - previous_token_len, token_start_idx)
+        next_end_idx = self.snap_back(token_end_idx + next_token_len, token_end_idx)
+        return {"previous_text": self.window(previous_start_idx, token_start_idx),
+                "current_text": self.window(token_start_idx, token_end_idx),
+                "next_text": self.window(token_end_idx, next_end_idx)}
+
+    def split_with_next_text(self, current_token_len: int, next_token_len: int) -> list[dict]:
+        result_split_list = []
+        token_start_idx = 0
+        while token_start_idx < len(self.tokens):
+            token_end_idx = self._current_end(token_start_idx, current_token_len)
+            next_end_idx = self.snap_back(token_end_idx + next_token_len, token_end_idx)
+            result_split_list.append({"current_text": self.window(token_start_idx, token_end_idx),
+                                      "next_text": self.window(token_end_idx, next_end_idx)})
+            token_start_idx = token_end_idx
+        return result_split_list
+
+    def split_with_previous_text(self, current_token_len: int, previous_token_len: int) -> list[dict]:
+        result_split_list = []
+        token_start_idx = 0
+        while token_start_idx < len(self.tokens):
+            token_end_idx = self._current_end(token_start_idx, current_token_len)
+            previous_start_idx = self.snap_forward(token_start_idx - previous_token_len, token_start_idx)
+            result_split_list.append({"previous_text": self.window(previous_start_idx, token_start_idx),
+                                      "current_text": self.window(token_start_idx, token_end_idx)})
+            token_start_idx = token_end_idx
+        return result_split_list
+
+    def split_with_context(self, current_token_len: int, previous_token_len: int, next_token_len: int) -> list[dict]:
+        result_split_list = []
+        token_start_idx = 0
+        while token_start_idx < len(self.tokens):
+            chunk = self.chunk_at(token_start_idx, current_token_len, previous_token_len, next_token_len)
+            result_split_list.append(chunk)
+            token_start_idx += chunk["current_text"]["token_cnt"]
+        return result_split_list
+
+
 def split_with_next_text(
-        text: str, lang_model: str, max_token_len: int, next_text_ratio: float
+        text: str | TokenizedText, lang_model: str, max_token_len: int, next_text_ratio: float
 ) -> list[dict]:
     """
     Splits a given input text into smaller chunks
@@ -90,7 +283,7 @@ def split_with_next_text(
     based on max_token_len and next_text_ratio.
 
     Args:
-        text (str): Text to be split.
+        text (str | TokenizedText): Text to be split, or an already tokenized text.
         lang_model (str): OpenAI language model name for the token calculation.
         max_token_len (int): The maximum number of tokens allowed per chunk.
         next_text_ratio (float): The ratio of the length of the next text to the max_token_len.
@@ -108,20 +301,12 @@ def split_with_next_text(
     current_text_max_token_len = math.ceil((1 - next_text_ratio) * max_token_len)
     next_text_max_token_len = max_token_len - current_text_max_token_len
 
-    result_split_list = []
-
-    while len(text) > 0:
-        current_text, current_token_cnt = truncate_by_token_cnt(text, lang_model, current_text_max_token_len)
-        text = text[len(current_text):]
-        next_text, next_token_cnt = truncate_by_token_cnt(text, lang_model, next_text_max_token_len)
-        result_split_list.append({"current_text": {"text": current_text, "token_cnt": current_token_cnt},
-                                  "next_text": {"text": next_text, "token_cnt": next_token_cnt}})
-
-    return result_split_list
+    tokenized = text if isinstance(text, TokenizedText) else TokenizedText(text, lang_model)
+    return tokenized.split_with_next_text(current_text_max_token_len, next_text_max_token_len)
 
 
 def split_with_previous_text(
-        text: str, lang_model: str, max_token_len: int, previous_text_ratio: float
+        text: str | TokenizedText, lang_model: str, max_token_len: int, previous_text_ratio: float
 ) -> list[dict]:
     """
     Splits a given input text into smaller chunks
@@ -129,7 +314,7 @@ def split_with_previous_text(
     based on max_token_len and previous_text_ratio.
 
     Args:
-        text (str): Text to be split.
+        text (str | TokenizedText): Text to be split, or an already tokenized text.
         lang_model (str): OpenAI language model name for the token calculation.
         max_token_len (int): The maximum number of tokens allowed per chunk.
         previous_text_ratio (float): The ratio of the length of the previous text to the max_token_len.
@@ -147,21 +332,35 @@ def split_with_previous_text(
     current_text_max_token_len = math.ceil((1 - previous_text_ratio) * max_token_len)
     previous_text_max_token_len = max_token_len - current_text_max_token_len
 
-    result_split_list = []
+    tokenized = text if isinstance(text, TokenizedText) else TokenizedText(text, lang_model)
+    return tokenized.split_with_previous_text(current_text_max_token_len, previous_text_max_token_len)
 
-    previous_text = ""
-    while len(text) > 0:
-        current_text, current_token_cnt = truncate_by_token_cnt(text, lang_model, current_text_max_token_len)
-        previous_text, previous_token_cnt = \
-            truncate_by_token_cnt(previous_text, lang_model, previous_text_max_token_len, from_back=True)
 
-        result_split_list.append({"previous_text": {"text": previous_text, "token_cnt": previous_token_cnt},
-                                  "current_text": {"text": current_text, "token_cnt": current_token_cnt}})
+def split_with_context(
+        text: str | TokenizedText, lang_model: str,
+        current_token_len: int, previous_token_len: int, next_token_len: int
+) -> list[dict]:
+    """
+    Splits a given input text into smaller chunks
+    compose of previous text, current text and next text,
+    all taken from the given text.
 
-        text = text[len(current_text):]
-        previous_text = "".join([previous_text, current_text])
+    Args:
+        text (str | TokenizedText): Text to be split, or an already tokenized text.
+        lang_model (str): OpenAI language model name for the token calculation.
+        current_token_len (int): The maximum number of tokens of each current text.
+        previous_token_len (int): The maximum number of tokens of each previous text.
+        next_token_len (int): The maximum number of tokens of each next text.
 
-    return result_split_list
+    Returns:
+    A list of dictionaries where each dictionary contains three keys:
+    'previous_text', 'current_text' and 'next_text'.
+    Each value is a dict containing the text and the number of tokens in it.
+    """
+    if current_token_len <= 0:
+        raise ValueError(f"current_token_len must be over 0.")
+    tokenized = text if isinstance(text, TokenizedText) else TokenizedText(text, lang_model)
+    return tokenized.split_with_context(current_token_len, max(0, previous_token_len), max(0, next_token_len))
 
 
 if __name__ == "__main__":
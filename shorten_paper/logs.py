@@ -1,23 +1,35 @@
+import atexit
+import json
 import logging
 import os
+import queue
 import random
 import re
 import time
+from datetime import datetime, timezone
 from logging import LogRecord
+from logging.handlers import QueueHandler, QueueListener
 
 from colorama import Fore, Style
 
+from shorten_paper.config import Config
 from shorten_paper.singletone import Singleton
 
+CFG = Config()
+
 
 class Logger(metaclass=Singleton):
     """
     Logger that handle titles in different colors.
     Outputs log in console, activity.log, and errors.log
     For console handler: simulates typing
+    In headless mode, loggers only enqueue records, and a background listener writes them without typing simulation.
+    With a JSON lines file, every record is also written to it as a JSON object.
     """
 
-    def __init__(self, log_to_file=False):
+    def __init__(self, log_to_file=False, headless=CFG.headless, json_log_file=CFG.log_json_file):
+        self.headless = headless
+        sink_handlers = []
         # create log directory if it doesn't exist
         if log_to_file:
             this_files_dir_path = os.path.dirname(__file__)
@@ -48,6 +60,17 @@ class Logger(metaclass=Singleton):
                 " %(message_no_color)s"
             )
             error_handler.setFormatter(error_formatter)
+            sink_handlers += [self.file_handler, error_handler]
+
+        # Structured handler in a JSON lines file
+        if json_log_file:
+            os.makedirs(os.path.dirname(json_log_file) or ".", exist_ok=True)
+            self.json_handler = logging.FileHandler(json_log_file, "a", "utf-8")
+            self.json_handler.setLevel(logging.DEBUG)
+            self.json_handler.setFormatter(JsonFormatter())
+            sink_handlers.append(self.json_handler)
+        for handler in sink_handlers:
+            handler.addFilter(skip_blank_lines)
 
         console_formatter = AutoFormatter("%(title_color)s %(message)s")
 
@@ -62,19 +85,29 @@ class Logger(metaclass=Singleton):
         self.console_handler.setFormatter(console_formatter)
 
         self.typing_logger = logging.getLogger("TYPER")
-        self.typing_logger.addHandler(self.typing_console_handler)
-        if log_to_file:
-            self.typing_logger.addHandler(self.file_handler)
-            self.typing_logger.addHandler(error_handler)
         self.typing_logger.setLevel(logging.DEBUG)
-
         self.logger = logging.getLogger("LOGGER")
-        self.logger.addHandler(self.console_handler)
-        if log_to_file:
-            self.logger.addHandler(self.file_handler)
-            self.logger.addHandler(error_handler)
         self.logger.setLevel(logging.DEBUG)
 
+        self.log_queue = None
+        self.queue_listener = None
+        if headless:
+            self.log_queue = queue.Queue()
+            self.queue_listener = QueueListener(
+                self.log_queue, self.console_handler, *sink_handlers, respect_handler_level=True
+            )
+            self.queue_listener.start()
+            atexit.register(self.stop)
+            queue_handler = QueueHandler(self.log_queue)
+            self.typing_logger.addHandler(queue_handler)
+            self.logger.addHandler(queue_handler)
+        else:
+            self.typing_logger.addHandler(self.typing_console_handler)
+            self.logger.addHandler(self.console_handler)
+            for handler in sink_handlers:
+                self.typing_logger.addHandler(handler)
+                self.logger.addHandler(handler)
+
     def typewriter_log(
         self, title="", title_color="", content="", level=logging.INFO
     ):
@@ -88,6 +121,15 @@ class Logger(metaclass=Singleton):
             level, content, extra={"title": title, "color": title_color}
         )
 
+    def info(
+        self,
+        message,
+        title="",
+        title_color="",
+    ):
+        """Logs without typing simulation, for long listings."""
+        self._log(title, title_color, message, logging.INFO)
+
     def debug(
         self,
         message,
@@ -113,6 +155,23 @@ class Logger(metaclass=Singleton):
                 message = " ".join(message)
         self.logger.log(level, message, extra={"title": title, "color": title_color})
 
+    def newline(self):
+        """Prints a blank line in order with the queued records."""
+        if self.headless:
+            self.logger.log(logging.INFO, "", extra={"title": "", "color": "", "blank": True})
+        else:
+            print()
+
+    def flush(self):
+        """Blocks until every queued record is written, e.g. before prompting for input."""
+        if self.log_queue is not None and self.queue_listener._thread is not None:
+            self.log_queue.join()
+
+    def stop(self):
+        """Writes the queued records and stops the background listener."""
+        if self.queue_listener is not None and self.queue_listener._thread is not None:
+            self.queue_listener.stop()
+
     def set_level(self, level):
         self.logger.setLevel(level)
         self.typing_logger.setLevel(level)
@@ -155,6 +214,9 @@ class TypingConsoleHandler(logging.StreamHandler):
 
 class ConsoleHandler(logging.StreamHandler):
     def emit(self, record) -> None:
+        if getattr(record, "blank", False):
+            print()
+            return
         msg = self.format(record)
         try:
             print(msg)
@@ -185,6 +247,26 @@ class AutoFormatter(logging.Formatter):
         return super().format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on a single line, without color codes.
+    """
+
+    def format(self, record: LogRecord) -> str:
+        return json.dumps({
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "title": remove_color_codes(str(getattr(record, "title", ""))).strip(),
+            "message": remove_color_codes(record.getMessage()),
+        }, ensure_ascii=False)
+
+
+def skip_blank_lines(record: LogRecord) -> bool:
+    return not getattr(record, "blank", False)
+
+
 def remove_color_codes(s: str) -> str:
     ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
     return ansi_escape.sub("", s)
@@ -0,0 +1,113 @@
+"""Batch manifests mapping input file globs to instructions and per-file settings, for unattended runs"""
+import json
+import os
+from fnmatch import fnmatch
+
+from shorten_paper.config import Config
+
+CFG = Config()
+
+# Settings a rule may override, with their types
+RULE_SETTINGS = {
+    "instruction": str,
+    "shorten_ratio": float,
+    "shorten_repeat": int,
+    "lang_model": str,
+}
+
+
+def default_file_settings(instruction: str = "") -> dict:
+    """Returns the settings of a file without a manifest: the given instruction and the configured settings."""
+    return {
+        "instruction": instruction,
+        "shorten_ratio": CFG.shorten_ratio,
+        "shorten_repeat": CFG.shorten_repeat,
+        "lang_model": CFG.lang_model_name,
+    }
+
+
+def parse_settings(values: dict) -> dict:
+    """Converts and validates the settings of a file, given as any of the keys of `RULE_SETTINGS`."""
+    settings = {}
+    for key, value in values.items():
+        try:
+            settings[key] = RULE_SETTINGS[key]("" if value is None and key == "instruction" else value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} ({RULE_SETTINGS[key].__name__}) is invalid.")
+    if "shorten_ratio" in settings and not 0 < settings["shorten_ratio"] <= 1:
+        raise ValueError("shorten_ratio (float) should be in (0, 1].")
+    if "shorten_repeat" in settings and settings["shorten_repeat"] <= 0:
+        raise ValueError("shorten_repeat (int) should be over 0.")
+    return settings
+
+
+class Manifest:
+    """
+    Rules mapping input file names to instructions and per-file settings.
+
+    Each rule has a "glob" (or a list of them) matched against the file names in the input directory,
+    and any of "instruction", "shorten_ratio", "shorten_repeat" and "lang_model".
+    Every rule matching a file applies in order, so later rules override what earlier ones set,
+    and settings no rule sets fall back to the configured ones. Files no rule matches are not shortened.
+
+    Written as YAML (a list of rules) or JSON lines (a rule per line), e.g.
+
+        - glob: "*"
+        - glob: ["*.pdf", "*.docx"]
+          instruction: "Keep the experiment results"
+          shorten_ratio: 0.3
+          shorten_repeat: 2
+          lang_model: gpt-3.5-turbo-16k
+
+    Args:
+        rules (list[dict]): The rules, in order.
+    """
+
+    def __init__(self, rules: list[dict]):
+        self.rules = []
+        for rule_num, rule in enumerate(rules, start=1):
+            self.rules.append(self._validate_rule(rule_num, rule))
+
+    @staticmethod
+    def _validate_rule(rule_num: int, rule: dict) -> dict:
+        if not isinstance(rule, dict):
+            raise ValueError(f"Manifest rule {rule_num} should be a mapping.")
+        rule = dict(rule)
+        globs = rule.pop("glob", None)
+        if isinstance(globs, str):
+            globs = [globs]
+        if not globs or not all(isinstance(pattern, str) for pattern in globs):
+            raise ValueError(f"Manifest rule {rule_num} should have a \"glob\" (str or list of str).")
+        unknown_keys = set(rule) - set(RULE_SETTINGS)
+        if unknown_keys:
+            raise ValueError(f"Manifest rule {rule_num} has unknown keys: {sorted(unknown_keys)}. "
+                             f"Supporting {['glob'] + list(RULE_SETTINGS.keys())}")
+        try:
+            return {"globs": globs, "settings": parse_settings(rule)}
+        except ValueError as e:
+            raise ValueError(f"Manifest rule {rule_num}: {e}")
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        """Loads a YAML (.yaml, .yml) or JSON lines (.jsonl) manifest."""
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, "r", encoding="utf-8") as f:
+            if extension in (".yaml", ".yml"):
+                import yaml
+                rules = yaml.safe_load(f) or []
+            elif extension == ".jsonl":
+                rules = [json.loads(line) for line in f if line.strip()]
+            else:
+                raise ValueError(f"Unsupported manifest format: {extension}. Supporting ['.yaml', '.yml', '.jsonl']")
+        if not isinstance(rules, list):
+            raise ValueError("Manifest should be a list of rules.")
+        return cls(rules)
+
+    def settings_for(self, document_name: str) -> dict | None:
+        """Returns the settings of a file, or None if no rule matches it."""
+        settings = None
+        for rule in self.rules:
+            if any(fnmatch(document_name, pattern) for pattern in rule["globs"]):
+                settings = settings or default_file_settings()
+                settings.update(rule["settings"])
+        return settings
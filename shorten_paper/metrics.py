@@ -0,0 +1,215 @@
+"""Per-stage timing and token usage of a run, exported as a JSON report and a Prometheus textfile"""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from shorten_paper.config import Config
+from shorten_paper.singletone import Singleton
+
+CFG = Config()
+
+PROMETHEUS_FILE_NAME = "shorten_paper.prom"
+
+
+class Metrics(metaclass=Singleton):
+    """
+    Process-wide collector of stage timings, counters and token usage, safe to use from any thread.
+
+    Stages are timed with `span` or `observe`, optionally for a file. Token usage is recorded per chunk request,
+    and aggregated per file and for the whole run.
+    The long-running modes hand each job's file state over to a job report with `write_job_report`,
+    so the state kept does not grow with the jobs done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Workers of the long-running modes write the reports after each job, possibly at the same time.
+        self._write_lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self._started_at = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.files = {}
+            self.chunks = []
+            self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_requests": 0}
+
+    def _file(self, file: str) -> dict:
+        if file not in self.files:
+            self.files[file] = {"stages": {},
+                                "usage": {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}}
+        return self.files[file]
+
+    @contextmanager
+    def span(self, stage: str, file: str = None):
+        """Times the enclosed block as the stage, for the file if given."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started_at, file)
+
+    def observe(self, stage: str, seconds: float, file: str = None) -> None:
+        with self._lock:
+            stage_stats = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage_stats["count"] += 1
+            stage_stats["seconds"] += seconds
+            stage_stats["max_seconds"] = max(stage_stats["max_seconds"], seconds)
+            if file is not None:
+                file_stages = self._file(file)["stages"]
+                file_stages[stage] = file_stages.get(stage, 0.0) + seconds
+
+    def increment(self, name: str, amount: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_usage(self, usage: dict, file: str = None, chunk_idx: int = None) -> None:
+        """
+        Records the token usage of a chat completion.
+
+        Args:
+            usage (dict): "prompt_tokens" and "completion_tokens", with "estimated" True if they were counted locally
+                and "cached" True if the response came from the response cache.
+        """
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        with self._lock:
+            self.chunks.append({"file": file, "chunk_idx": chunk_idx, "prompt_tokens": prompt_tokens,
+                                "completion_tokens": completion_tokens,
+                                "estimated": usage.get("estimated", False), "cached": usage.get("cached", False)})
+            if usage.get("cached", False):
+                return
+            totals = [self.usage] + ([self._file(file)["usage"]] if file is not None else [])
+            for total in totals:
+                total["requests"] += 1
+                total["prompt_tokens"] += prompt_tokens
+                total["completion_tokens"] += completion_tokens
+            if usage.get("estimated", False):
+                self.usage["estimated_requests"] += 1
+
+    def report(self, aggregate_only: bool = False) -> dict:
+        """Returns the report of the run, without the per-file and per-chunk details if `aggregate_only`."""
+        with self._lock:
+            report = {
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "wall_seconds": time.perf_counter() - self._started_at,
+                "stages": {stage: dict(stats) for stage, stats in self.stages.items()},
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+                "usage": dict(self.usage),
+            }
+            if not aggregate_only:
+                report["files"] = {file: {"stages": dict(stats["stages"]), "usage": dict(stats["usage"])}
+                                   for file, stats in self.files.items()}
+                report["chunks"] = [dict(chunk) for chunk in self.chunks]
+            return report
+
+    def pop_file(self, file: str) -> dict:
+        """Returns the stages, usage and chunk usage of a file, and forgets them."""
+        with self._lock:
+            stats = self.files.pop(file, None) or {"stages": {}, "usage": {"requests": 0, "prompt_tokens": 0,
+                                                                            "completion_tokens": 0}}
+            chunks = [chunk for chunk in self.chunks if chunk["file"] == file]
+            self.chunks = [chunk for chunk in self.chunks if chunk["file"] != file]
+        return {"file": file, "stages": stats["stages"], "usage": stats["usage"], "chunks": chunks}
+
+    @staticmethod
+    def to_prometheus(report: dict) -> str:
+        """
+        Formats a report in the Prometheus text exposition format.
+        Only aggregate series are exported, as series per file would grow without bound in the long-running modes.
+        """
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: list[tuple[dict, float]]) -> None:
+            lines.append(f"# HELP shorten_paper_{name} {help_text}")
+            lines.append(f"# TYPE shorten_paper_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+                lines.append(f"shorten_paper_{name}{{{label_text}}} {value}" if label_text
+                             else f"shorten_paper_{name} {value}")
+
+        stages = report["stages"]
+        metric("run_wall_seconds", "gauge", "Wall time of the last run.", [({}, report["wall_seconds"])])
+        metric("stage_seconds_total", "counter", "Time spent in each stage.",
+               [({"stage": stage}, stats["seconds"]) for stage, stats in stages.items()])
+        metric("stage_calls_total", "counter", "Times each stage ran.",
+               [({"stage": stage}, stats["count"]) for stage, stats in stages.items()])
+        metric("stage_max_seconds", "gauge", "Longest single run of each stage.",
+               [({"stage": stage}, stats["max_seconds"]) for stage, stats in stages.items()])
+        metric("requests_total", "counter", "Chat completion requests answered by the backend.",
+               [({}, report["usage"]["requests"])])
+        metric("tokens_total", "counter", "Tokens of the chat completion requests.",
+               [({"kind": "prompt"}, report["usage"]["prompt_tokens"]),
+                ({"kind": "completion"}, report["usage"]["completion_tokens"])])
+        counter_names = sorted({counter["name"] for counter in report["counters"]})
+        for counter_name in counter_names:
+            metric(f"{counter_name}_total", "counter", f"Count of {counter_name.replace('_', ' ')}.",
+                   [(counter["labels"], counter["value"])
+                    for counter in report["counters"] if counter["name"] == counter_name])
+        return "\n".join(lines) + "\n"
+
+    def write_reports(
+            self, metrics_dir: str = CFG.metrics_dir, extra: dict = None, aggregate_only: bool = False
+    ) -> tuple[str, str] | None:
+        """
+        Writes the JSON report of the run and overwrites the Prometheus textfile in `metrics_dir`.
+
+        Args:
+            aggregate_only (bool): If True, the JSON report leaves out the per-file and per-chunk details,
+                so rewriting it after every job of the long-running modes does not cost more with each job.
+
+        Returns:
+            tuple[str, str] | None: (JSON report path, Prometheus textfile path), or None without a directory.
+        """
+        if not metrics_dir:
+            return None
+        os.makedirs(metrics_dir, exist_ok=True)
+        report = self.report(aggregate_only)
+        report.update(extra or {})
+        timestamp = datetime.fromtimestamp(self.started_at, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        json_path = os.path.join(metrics_dir, f"run_{timestamp}.json")
+        prometheus_path = os.path.join(metrics_dir, PROMETHEUS_FILE_NAME)
+        with self._write_lock:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            # Textfile collectors may read at any time, so the file is replaced atomically,
+            # from a temporary file of its own in case another process writes the same directory.
+            with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=metrics_dir, suffix=".tmp", delete=False) as f:
+                f.write(self.to_prometheus(report))
+            os.replace(f.name, prometheus_path)
+        return json_path, prometheus_path
+
+    def write_job_report(
+            self, job_name: str, file: str, metrics_dir: str = CFG.metrics_dir, extra: dict = None
+    ) -> str | None:
+        """
+        Writes the stages, usage and chunk usage of a job's file to `metrics_dir`/jobs/`job_name`.json,
+        and forgets them. Without a directory, they are forgotten all the same.
+
+        Returns:
+            str | None: The job report path, or None without a directory.
+        """
+        job_report = self.pop_file(file)
+        if not metrics_dir:
+            return None
+        job_report.update(extra or {})
+        jobs_dir = os.path.join(metrics_dir, "jobs")
+        os.makedirs(jobs_dir, exist_ok=True)
+        job_path = os.path.join(jobs_dir, f"{job_name}.json")
+        with open(job_path, "w", encoding="utf-8") as f:
+            json.dump(job_report, f, indent=2, ensure_ascii=False)
+        return job_path
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,84 @@
+"""Page by page PDF text extraction, fanned out across a process pool for large documents"""
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import PyPDF2
+
+from shorten_paper.config import Config
+
+CFG = Config()
+
+_worker_readers = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _extract_pages(file_path: str, page_start: int, page_end: int) -> list[str]:
+    """Extracts the text of pages [page_start, page_end) in a worker, reusing the worker's reader of the file."""
+    reader = _worker_readers.get(file_path)
+    if reader is None:
+        # A worker keeps only the reader of the document it is working on.
+        _worker_readers.clear()
+        reader = _worker_readers[file_path] = PyPDF2.PdfReader(file_path)
+    return [reader.pages[page_idx].extract_text() for page_idx in range(page_start, page_end)]
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the locks of the logging and worker threads of this process.
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+
+def pdf_workers() -> int:
+    return CFG.pdf_workers or os.cpu_count() or 1
+
+
+def iter_pdf_pages(
+        file_path: str,
+        workers: int = None,
+        parallel_min_pages: int = CFG.pdf_parallel_min_pages,
+        pages_per_task: int = 8
+) -> Iterator[str]:
+    """
+    Yields the text of each page of a PDF, in order.
+
+    Documents of at least `parallel_min_pages` pages are extracted by a process pool shared by every caller,
+    with at most two tasks per worker in flight, so memory stays bounded however long the document is.
+
+    Args:
+        file_path (str): The PDF file path.
+        workers (int): The processes of the pool. Defaults to None, PDF_WORKERS or the CPU count.
+        parallel_min_pages (int): The page count from which pages are extracted in parallel.
+        pages_per_task (int): The pages extracted by a single task.
+    """
+    workers = workers or pdf_workers()
+    reader = PyPDF2.PdfReader(file_path)
+    page_cnt = len(reader.pages)
+    if workers <= 1 or page_cnt < parallel_min_pages:
+        for page in reader.pages:
+            yield page.extract_text()
+        return
+
+    pool = _get_pool(workers)
+    page_ranges = iter([(page_start, min(page_start + pages_per_task, page_cnt))
+                        for page_start in range(0, page_cnt, pages_per_task)])
+    in_flight = deque()
+    try:
+        for page_start, page_end in page_ranges:
+            in_flight.append(pool.submit(_extract_pages, file_path, page_start, page_end))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
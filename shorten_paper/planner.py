@@ -0,0 +1,242 @@
+"""
+A dry run estimating the requests, tokens, cost and time of shortening the input directory, without calling the API.
+
+Run it with `python -m shorten_paper --plan`. Every file is read and chunked as a run would, through the extraction
+cache, and the messages of every request are built and counted. Passes after the first shorten outputs not known yet,
+so they are planned over the beginning of their input, cut to the length the previous pass is asked for.
+"""
+import heapq
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from colorama import Fore
+from shorten_paper.config import Config
+from shorten_paper.file_operations_utils import chunk_requests, extension_to_parser, read_tokenized_file
+from shorten_paper.lang_model.api_call import estimate_prompt_tokens
+from shorten_paper.lang_model.text_processing import TokenizedText, match_model
+from shorten_paper.logs import Logger
+from shorten_paper.manifest import Manifest, default_file_settings
+
+logger = Logger()
+CFG = Config()
+
+# USD per 1K prompt and completion tokens, matched by the longest listed prefix like `model_context_windows`.
+model_prices = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-4-0125-preview": (0.01, 0.03),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+
+def model_price(lang_model: str) -> tuple[float, float] | None:
+    """Returns the prices of a model's prompt and completion tokens, with PLAN_*_PRICE first, or None if unknown."""
+    matched_model = match_model(lang_model, model_prices)
+    prompt_price, completion_price = model_prices[matched_model] if matched_model is not None else (None, None)
+    prompt_price = CFG.plan_prompt_price if CFG.plan_prompt_price is not None else prompt_price
+    completion_price = CFG.plan_completion_price if CFG.plan_completion_price is not None else completion_price
+    if prompt_price is None or completion_price is None:
+        return None
+    return prompt_price, completion_price
+
+
+def request_seconds(completion_token_cnt: int) -> float:
+    """Projects the time of a request from its completion tokens."""
+    return CFG.plan_request_seconds + completion_token_cnt / CFG.plan_completion_tokens_per_second
+
+
+def plan_text(text: TokenizedText, settings: dict) -> list[dict]:
+    """
+    Plans the passes (or levels, with SHORTEN_MODE=tree) of shortening a text, with the settings of its file.
+
+    Returns:
+        list[dict]: The input tokens, requests, prompt and completion tokens and projected seconds of each pass.
+    """
+    lang_model = settings["lang_model"]
+    shorten_ratio = settings["shorten_ratio"]
+    shorten_repeat = settings["shorten_repeat"]
+    target_ratio = CFG.shorten_target_ratio
+    if target_ratio is None:
+        target_ratio = shorten_ratio ** shorten_repeat
+    if CFG.shorten_mode == "tree":
+        # Levels are chunks without previous or next text, then groups of outputs planned like chunks of their length.
+        max_passes, chunk_concurrency = CFG.tree_max_levels, CFG.tree_concurrency
+        previous_text_token_ratio, next_text_token_ratio = 0, 0
+        target_token_cnt = CFG.tree_target_tokens or math.ceil(len(text) * target_ratio)
+    else:
+        max_passes, chunk_concurrency = shorten_repeat, CFG.chunk_concurrency
+        previous_text_token_ratio, next_text_token_ratio = CFG.previous_text_token_ratio, CFG.next_text_token_ratio
+        target_token_cnt = len(text) * target_ratio
+
+    passes = []
+    for _ in range(max_passes):
+        requests = chunk_requests(
+            text, settings["instruction"], lang_model, shorten_ratio,
+            previous_text_token_ratio, next_text_token_ratio, chunk_concurrency
+        )
+        completion_token_cnts = [request["completion_tokens"] for request in requests]
+        seconds = [request_seconds(token_cnt) for token_cnt in completion_token_cnts]
+        passes.append({
+            "input_tokens": len(text),
+            "requests": len(requests),
+            "prompt_tokens": sum(estimate_prompt_tokens(request["messages"], lang_model) for request in requests),
+            "completion_tokens": sum(completion_token_cnts),
+            "seconds": sum(seconds) if chunk_concurrency == 1
+            else max(max(seconds), sum(seconds) / min(chunk_concurrency, len(seconds))),
+        })
+        # The outputs of the chunks are joined by newlines.
+        output_token_cnt = sum(completion_token_cnts) + len(requests) - 1
+        if output_token_cnt <= target_token_cnt or output_token_cnt >= len(text):
+            break
+        # The output is not known yet, so the beginning of the text of the expected length stands in for it.
+        text = text.prefix(output_token_cnt)
+    return passes
+
+
+def plan_file(input_dir: str, document_name: str, settings: dict) -> dict:
+    """Plans shortening a single file. Failures to read it are reported in the plan instead of raised."""
+    file_plan = {"document_name": document_name, "lang_model": settings["lang_model"]}
+    try:
+        text = read_tokenized_file(os.path.join(input_dir, document_name), settings["lang_model"])
+        if len(text) == 0:
+            raise ValueError("No text to shorten.")
+        passes = plan_text(text, settings)
+    except Exception as e:
+        file_plan["error"] = f"{type(e).__name__}: {e}"
+        return file_plan
+
+    file_plan["document_tokens"] = len(text)
+    file_plan["passes"] = passes
+    for key in ("requests", "prompt_tokens", "completion_tokens", "seconds"):
+        file_plan[key] = sum(pass_plan[key] for pass_plan in passes)
+    price = model_price(settings["lang_model"])
+    file_plan["cost"] = (file_plan["prompt_tokens"] * price[0] + file_plan["completion_tokens"] * price[1]) / 1000 \
+        if price is not None else None
+    return file_plan
+
+
+def plan(input_dir: str = CFG.papers_input_dir, manifest_path: str = None) -> dict:
+    """
+    Plans shortening every file in the input directory, reading the files in parallel.
+
+    Args:
+        input_dir (str): The input directory.
+        manifest_path (str): A manifest of the files' instructions and settings. Defaults to None, MANIFEST_FILE.
+            Without one, files are planned with the configured settings and no instruction.
+
+    Returns:
+        dict: The plan of every file and the totals, with the projected time of the whole run.
+    """
+    manifest_path = manifest_path or CFG.manifest_file
+    manifest = Manifest.load(manifest_path) if manifest_path else None
+    files, file_settings, skipped = [], [], []
+    for document_name in os.listdir(input_dir):
+        settings = manifest.settings_for(document_name) if manifest is not None else default_file_settings()
+        if settings is None or os.path.splitext(document_name)[1].lower() not in extension_to_parser:
+            skipped.append(document_name)
+            continue
+        files.append(document_name)
+        file_settings.append(settings)
+
+    # The parsers log every file read, which would take longer than the plan.
+    logger.set_level(logging.WARNING)
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            file_plans = list(executor.map(plan_file, [input_dir] * len(files), files, file_settings))
+    finally:
+        logger.set_level(logging.DEBUG)
+
+    planned = [file_plan for file_plan in file_plans if "error" not in file_plan]
+    totals = {key: sum(file_plan[key] for file_plan in planned)
+              for key in ("document_tokens", "requests", "prompt_tokens", "completion_tokens")}
+    costs = [file_plan["cost"] for file_plan in planned]
+    totals["cost"] = sum(costs) if None not in costs else None
+
+    # Files are shortened FILE_CONCURRENCY at a time, each worker taking the next file as it gets free.
+    workers = [0.0] * min(CFG.file_concurrency, max(1, len(planned)))
+    for file_plan in planned:
+        heapq.heapreplace(workers, workers[0] + file_plan["seconds"])
+    totals["concurrency_seconds"] = max(workers)
+    totals["rate_limit_seconds"] = max(
+        totals["requests"] / CFG.rate_limit_rpm * 60 if CFG.rate_limit_rpm > 0 else 0,
+        (totals["prompt_tokens"] + totals["completion_tokens"]) / CFG.rate_limit_tpm * 60
+        if CFG.rate_limit_tpm > 0 else 0
+    )
+    totals["seconds"] = max(totals["concurrency_seconds"], totals["rate_limit_seconds"])
+    return {"input_dir": input_dir, "manifest": manifest_path or None, "shorten_mode": CFG.shorten_mode,
+            "files": file_plans, "skipped": skipped, "totals": totals}
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def _format_cost(cost: float | None) -> str:
+    return f"${cost:.4f}" if cost is not None else "unknown price"
+
+
+def log_plan(run_plan: dict) -> None:
+    logger.typewriter_log("Planned files", Fore.LIGHTCYAN_EX)
+    for num, file_plan in enumerate(run_plan["files"]):
+        if "error" in file_plan:
+            logger.info(file_plan["error"], f"| {num+1} - {file_plan['document_name']}:", Fore.RED)
+            continue
+        logger.info(
+            f"{file_plan['document_tokens']} tokens, {len(file_plan['passes'])} passes, "
+            f"{file_plan['requests']} requests, "
+            f"{file_plan['prompt_tokens']} prompt + {file_plan['completion_tokens']} completion tokens, "
+            f"{_format_cost(file_plan['cost'])}, {_format_seconds(file_plan['seconds'])}",
+            f"| {num+1} - {file_plan['document_name']}:"
+        )
+    if run_plan["skipped"]:
+        logger.typewriter_log(f"| {len(run_plan['skipped'])} files are skipped (unsupported or matching no rule)")
+    logger.newline()
+
+    totals = run_plan["totals"]
+    failed_cnt = sum("error" in file_plan for file_plan in run_plan["files"])
+    logger.typewriter_log(
+        "Plan:",
+        Fore.LIGHTGREEN_EX,
+        f"{len(run_plan['files']) - failed_cnt} files ({failed_cnt} unreadable), {totals['document_tokens']} tokens"
+    )
+    logger.typewriter_log(f"| Requests: {totals['requests']}")
+    logger.typewriter_log(
+        f"| Tokens: {totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens"
+    )
+    logger.typewriter_log(f"| Cost: {_format_cost(totals['cost'])}")
+    logger.typewriter_log(
+        f"| Time: {_format_seconds(totals['seconds'])} "
+        f"({_format_seconds(totals['concurrency_seconds'])} with FILE_CONCURRENCY={CFG.file_concurrency}, "
+        f"{_format_seconds(totals['rate_limit_seconds'])} under the rate limits)"
+    )
+
+
+def run_plan(manifest_path: str = None) -> dict:
+    """Plans shortening the input directory, logs the plan and writes it to METRICS_DIR."""
+    logger.typewriter_log("-* Planning Shorten Paper *-", Fore.LIGHTRED_EX, "(no API calls)")
+    logger.typewriter_log("File input path:", Fore.LIGHTYELLOW_EX, CFG.papers_input_dir)
+    run_plan_report = plan(CFG.papers_input_dir, manifest_path)
+    if run_plan_report["manifest"] is None:
+        logger.typewriter_log("| Without a manifest, files are planned with no instruction.")
+    logger.newline()
+    log_plan(run_plan_report)
+
+    if CFG.metrics_dir:
+        os.makedirs(CFG.metrics_dir, exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        plan_path = os.path.join(CFG.metrics_dir, f"plan_{timestamp}.json")
+        with open(plan_path, "w", encoding="utf-8") as f:
+            json.dump(run_plan_report, f, indent=2, ensure_ascii=False)
+        logger.typewriter_log(f"| Plan report: {plan_path}")
+    return run_plan_report
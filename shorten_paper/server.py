@@ -0,0 +1,363 @@
+"""
+A local HTTP API for submitting shortening jobs from other services.
+
+Run it with `python -m shorten_paper --serve`, then
+    POST /v1/jobs?filename=paper.pdf&instruction=...  with the document as the body -> 202 {"id": ...}
+    GET  /v1/jobs/<id>                                 -> the job's status
+    GET  /v1/jobs/<id>/result                          -> the shortened text, once the job is done
+    GET  /v1/jobs/<id>/stream                          -> the shortened text as server-sent events, as it arrives
+    GET  /v1/health                                    -> the number of jobs by status
+"""
+import json
+import os
+import signal
+import threading
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from colorama import Fore
+from shorten_paper.config import Config
+from shorten_paper.file_operations_utils import (extension_to_parser, read_tokenized_file,
+                                                 shorten_mode_to_function)
+from shorten_paper.job_queue import JobQueue
+from shorten_paper.logs import Logger
+from shorten_paper.manifest import RULE_SETTINGS, default_file_settings, parse_settings
+from shorten_paper.metrics import Metrics
+from shorten_paper.watcher import warm_up
+
+logger = Logger()
+CFG = Config()
+
+
+class _LiveOutput:
+    """The output of a running job's last pass, written by the worker and read by the streaming requests."""
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self._changed = threading.Condition()
+
+    def write(self, content: str) -> None:
+        with self._changed:
+            self.pieces.append(content)
+            self._changed.notify_all()
+
+    def close(self) -> None:
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def wait(self, piece_cnt: int, timeout: float) -> tuple[list[str], bool]:
+        """Returns the pieces after the first `piece_cnt`, waiting up to `timeout` seconds for one, and if it is done."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.pieces) > piece_cnt or self.done, timeout)
+            return self.pieces[piece_cnt:], self.done
+
+
+class ShortenService:
+    """
+    The job queue and worker pool behind the API, reusing the process's tokenizers, caches and connections.
+
+    Uploads are kept under CACHE_DIR until their job is done, and jobs live in a durable queue,
+    so jobs accepted before a restart are still shortened after it.
+    Finished jobs are kept for `job_ttl` seconds, up to the `max_finished_jobs` latest ones, for their results.
+
+    Args:
+        workers (int): The number of jobs shortened at the same time.
+        max_queued (int): Jobs waiting or running, over which new jobs are refused.
+        max_upload_bytes (int): The maximum size of an uploaded document.
+        job_ttl (float): Seconds a finished job is kept. 0 to keep them.
+        max_finished_jobs (int): The number of finished jobs kept. 0 for no limit.
+    """
+
+    def __init__(
+            self,
+            workers: int = CFG.server_workers,
+            max_queued: int = CFG.server_max_queued,
+            max_upload_bytes: int = CFG.server_max_upload_mb * 1024 * 1024,
+            job_ttl: float = CFG.server_job_ttl_hours * 60 * 60,
+            max_finished_jobs: int = CFG.server_max_finished_jobs
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_upload_bytes = max_upload_bytes
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.upload_dir = os.path.join(CFG.cache_dir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.job_queue = JobQueue(os.path.join(CFG.cache_dir, "server_jobs.sqlite3"))
+        self.stop = threading.Event()
+        self._live = {}
+        self._live_lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._worker_threads = []
+
+    def start(self) -> None:
+        self.prune()
+        warm_up({CFG.lang_model_name})
+        self._worker_threads = [threading.Thread(target=self._work, name=f"server-worker-{num}", daemon=True)
+                                for num in range(self.workers)]
+        for worker_thread in self._worker_threads:
+            worker_thread.start()
+
+    def shutdown(self) -> None:
+        """Stops claiming jobs, and waits for the running ones."""
+        self.stop.set()
+        for worker_thread in self._worker_threads:
+            worker_thread.join()
+
+    def submit(self, document_name: str, document: bytes, settings: dict) -> int | None:
+        """Queues a job for the document. Returns its id, or None if the queue is full."""
+        with self._submit_lock:
+            counts = self.job_queue.counts()
+            if counts["queued"] + counts["running"] >= self.max_queued:
+                return None
+            job_key = uuid.uuid4().hex
+            upload_path = os.path.join(self.upload_dir, job_key + os.path.splitext(document_name)[1].lower())
+            with open(upload_path, "wb") as f:
+                f.write(document)
+            return self.job_queue.enqueue(
+                job_key, {"document_name": document_name, "upload_path": upload_path, "settings": settings}
+            )
+
+    def prune(self) -> None:
+        """Deletes the finished jobs past their retention, and uploads left behind by a stopped process."""
+        self.job_queue.prune(self.job_ttl, self.max_finished_jobs)
+        with self._submit_lock:
+            pending_uploads = {os.path.basename(job["payload"]["upload_path"])
+                               for job in self.job_queue.pending()}
+            for upload_name in os.listdir(self.upload_dir):
+                if upload_name not in pending_uploads:
+                    try:
+                        os.remove(os.path.join(self.upload_dir, upload_name))
+                    except OSError:
+                        pass
+
+    def live_output(self, job_id: int) -> _LiveOutput | None:
+        with self._live_lock:
+            return self._live.get(job_id)
+
+    def _run_job(self, job: dict, live_output: _LiveOutput) -> dict:
+        payload = job["payload"]
+        settings = payload["settings"]
+        text = read_tokenized_file(payload["upload_path"], settings["lang_model"])
+        # Only the last pass is streamed, as only its output is the result.
+        shortened_text = shorten_mode_to_function[CFG.shorten_mode](
+            text, payload["document_name"], settings["instruction"], lang_model=settings["lang_model"],
+            shorten_ratio=settings["shorten_ratio"], shorten_repeat=settings["shorten_repeat"],
+            write_last=live_output.write
+        ).text
+        return {"document_len": len(text.text), "shortened_len": len(shortened_text), "text": shortened_text}
+
+    def _work(self) -> None:
+        while not self.stop.is_set():
+            job = self.job_queue.claim(timeout=1)
+            if job is None:
+                continue
+            live_output = _LiveOutput()
+            with self._live_lock:
+                self._live[job["id"]] = live_output
+            try:
+                self.job_queue.finish(job["id"], self._run_job(job, live_output))
+            except Exception as e:
+                logger.error(f"Job {job['id']} of {job['payload']['document_name']} failed:", f"{e}")
+                logger.debug(traceback.format_exc())
+                self.job_queue.fail(job["id"], f"{type(e).__name__}: {e}")
+            finally:
+                # Streaming requests fall back to the stored result once the job is settled.
+                live_output.close()
+                with self._live_lock:
+                    del self._live[job["id"]]
+                try:
+                    os.remove(job["payload"]["upload_path"])
+                except OSError:
+                    pass
+            try:
+                self.job_queue.prune(self.job_ttl, self.max_finished_jobs)
+                Metrics().write_job_report(f"server_job_{job['id']}", job["payload"]["document_name"],
+                                           extra={"job_id": job["id"]})
+                Metrics().write_reports(extra={"jobs": self.job_queue.counts()}, aggregate_only=True)
+            except Exception as e:
+                # A failed clean-up or report must not take the worker down.
+                logger.error("Failed to prune the finished jobs or write the metrics reports:", f"{e}")
+
+
+class ShortenAPIHandler(BaseHTTPRequestHandler):
+    service: ShortenService = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, headers: dict = None) -> None:
+        self._send_json(status, {"error": {"message": message}}, headers)
+
+    def _send_event(self, body: dict | str) -> None:
+        data = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    @staticmethod
+    def _job_status(job: dict) -> dict:
+        status = {"id": job["id"], "status": job["status"], "document_name": job["payload"]["document_name"],
+                  "attempts": job["attempts"], "created_at": job["created_at"], "updated_at": job["updated_at"]}
+        if job["status"] == "done":
+            status["document_len"] = job["result"]["document_len"]
+            status["shortened_len"] = job["result"]["shortened_len"]
+        if job["status"] == "failed":
+            status["error"] = job["error"]
+        return status
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/v1/jobs":
+            self._send_error(404, f"Unknown path: {url.path}")
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        document_name = os.path.basename(query.pop("filename", ""))
+        if os.path.splitext(document_name)[1].lower() not in extension_to_parser:
+            self._send_error(400, f"Unsupported file format: {document_name or 'no filename'}. "
+                                  f"Supporting {list(extension_to_parser.keys())}")
+            return
+        try:
+            # The settings are validated like the rules of a manifest.
+            settings = default_file_settings()
+            settings.update(parse_settings({key: value for key, value in query.items() if key in RULE_SETTINGS}))
+        except ValueError as e:
+            self._send_error(400, f"{e}")
+            return
+        try:
+            content_len = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            content_len = -1
+        if content_len < 0:
+            self._send_error(400, "Content-Length should be a non-negative integer.")
+            self.close_connection = True
+            return
+        if content_len > self.service.max_upload_bytes:
+            self._send_error(413, f"Documents should be under {self.service.max_upload_bytes} bytes.")
+            self.close_connection = True
+            return
+        document = self.rfile.read(content_len)
+        if not document:
+            self._send_error(400, "No document in the request body.")
+            return
+
+        job_id = self.service.submit(document_name, document, settings)
+        if job_id is None:
+            self._send_error(429, "Too many jobs queued. Retry later.", {"Retry-After": "5"})
+            return
+        self._send_json(202, self._job_status(self.service.job_queue.get(job_id)),
+                        {"Location": f"/v1/jobs/{job_id}"})
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip("/")
+        if path == "/v1/health":
+            self._send_json(200, {"jobs": self.service.job_queue.counts(), "workers": self.service.workers,
+                                  "max_queued": self.service.max_queued})
+            return
+        parts = path.split("/")
+        if len(parts) not in (4, 5) or parts[:3] != ["", "v1", "jobs"] or not parts[3].isdigit() \
+                or (len(parts) == 5 and parts[4] not in ("result", "stream")):
+            self._send_error(404, f"Unknown path: {path}")
+            return
+        job = self.service.job_queue.get(int(parts[3]))
+        if job is None:
+            self._send_error(404, f"No job {parts[3]}.")
+            return
+
+        if len(parts) == 4:
+            self._send_json(200, self._job_status(job))
+        elif parts[4] == "result":
+            if job["status"] != "done":
+                self._send_json(409, self._job_status(job))
+                return
+            payload = job["result"]["text"].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self._stream(job["id"])
+
+    def _stream(self, job_id: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        sent_chars = 0
+        while True:
+            live_output = self.service.live_output(job_id)
+            if live_output is not None:
+                piece_cnt = 0
+                done = False
+                while not done:
+                    pieces, done = live_output.wait(piece_cnt, timeout=15)
+                    piece_cnt += len(pieces)
+                    for piece in pieces:
+                        self._send_event({"content": piece})
+                        sent_chars += len(piece)
+                    if not pieces and not done:
+                        # Keep idle connections from being closed by proxies.
+                        self.wfile.write(b": keep-alive\n\n")
+                        self.wfile.flush()
+            job = self.service.job_queue.get(job_id)
+            if job["status"] in ("done", "failed"):
+                break
+            if live_output is None:
+                self.service.stop.wait(0.5)
+        if job["status"] == "done" and len(job["result"]["text"]) > sent_chars:
+            # What the job wrote before this request subscribed, or all of it if it was already done.
+            self._send_event({"content": job["result"]["text"][sent_chars:]})
+        self._send_event(self._job_status(job))
+        self._send_event("[DONE]")
+
+
+def serve(host: str = CFG.server_host, port: int = CFG.server_port, service: ShortenService = None) -> ThreadingHTTPServer:
+    """Returns an API server bound to host:port. Start the service's workers, then call serve_forever() on it."""
+    handler = type("BoundShortenAPIHandler", (ShortenAPIHandler,), {"service": service or ShortenService()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_server(host: str = CFG.server_host, port: int = CFG.server_port, workers: int = None) -> None:
+    """Serves the API until interrupted, then waits for the running jobs."""
+    service = ShortenService(workers=workers or CFG.server_workers)
+    api_server = serve(host, port, service)
+    # Containers are stopped with SIGTERM: finish the jobs being shortened, as on Ctrl+C.
+    signal.signal(signal.SIGTERM, _interrupt)
+    Metrics().reset()
+    service.start()
+    logger.typewriter_log("-* Serving the Shorten Paper API *-", Fore.LIGHTRED_EX)
+    logger.typewriter_log("Address:", Fore.LIGHTYELLOW_EX, f"http://{host}:{port}/v1")
+    logger.typewriter_log("Workers:", Fore.LIGHTYELLOW_EX,
+                          f"{service.workers} ({service.job_queue.counts()['queued']} jobs queued)")
+    try:
+        api_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.typewriter_log("Stopping the API after the jobs being shortened...", Fore.LIGHTBLUE_EX)
+        api_server.server_close()
+        service.shutdown()
@@ -8,13 +8,15 @@ import time
 class Spinner:
     """A simple spinner class"""
 
-    def __init__(self, message: str = "Loading...", delay: float = 0.1) -> None:
+    def __init__(self, message: str = "Loading...", delay: float = 0.1, enabled: bool = True) -> None:
         """Initialize the spinner class
 
         Args:
             message (str): The message to display.
             delay (float): The delay between each spinner update.
+            enabled (bool): If False, the spinner displays nothing.
         """
+        self.enabled = enabled
         self.spinner = itertools.cycle(["-", "/", "|", "\\"])
         self.delay = delay
         self.message = message
@@ -31,6 +33,8 @@ class Spinner:
 
     def __enter__(self):
         """Start the spinner"""
+        if not self.enabled:
+            return self
         self.running = True
         self.spinner_thread = threading.Thread(target=self.spin)
         self.spinner_thread.start()
@@ -45,6 +49,8 @@ class Spinner:
             exc_value (Exception): The exception value.
             exc_traceback (Exception): The exception traceback.
         """
+        if not self.enabled:
+            return
         self.running = False
         if self.spinner_thread is not None:
             self.spinner_thread.join()
@@ -0,0 +1,196 @@
+"""Decoding of text files with a single read: BOM, declared charset, UTF-8, then statistical detection"""
+import codecs
+import re
+from typing import Iterator
+
+ENCODINGS = ['utf_8',
+             'ascii',
+             'big5',
+             'big5hkscs',
+             'cp037',
+             'cp273',
+             'cp424',
+             'cp437',
+             'cp500',
+             'cp720',
+             'cp737',
+             'cp775',
+             'cp850',
+             'cp852',
+             'cp855',
+             'cp856',
+             'cp857',
+             'cp858',
+             'cp860',
+             'cp861',
+             'cp862',
+             'cp863',
+             'cp864',
+             'cp865',
+             'cp866',
+             'cp869',
+             'cp874',
+             'cp875',
+             'cp932',
+             'cp949',
+             'cp950',
+             'cp1006',
+             'cp1026',
+             'cp1125',
+             'cp1140',
+             'cp1250',
+             'cp1251',
+             'cp1252',
+             'cp1253',
+             'cp1254',
+             'cp1255',
+             'cp1256',
+             'cp1257',
+             'cp1258',
+             'euc_jp',
+             'euc_jis_2004',
+             'euc_jisx0213',
+             'euc_kr',
+             'gb2312',
+             'gbk',
+             'gb18030',
+             'hz',
+             'iso2022_jp',
+             'iso2022_jp_1',
+             'iso2022_jp_2',
+             'iso2022_jp_2004',
+             'iso2022_jp_3',
+             'iso2022_jp_ext',
+             'iso2022_kr',
+             'latin_1',
+             'iso8859_2',
+             'iso8859_3',
+             'iso8859_4',
+             'iso8859_5',
+             'iso8859_6',
+             'iso8859_7',
+             'iso8859_8',
+             'iso8859_9',
+             'iso8859_10',
+             'iso8859_11',
+             'iso8859_13',
+             'iso8859_14',
+             'iso8859_15',
+             'iso8859_16',
+             'johab',
+             'koi8_r',
+             'koi8_t',
+             'koi8_u',
+             'kz1048',
+             'mac_cyrillic',
+             'mac_greek',
+             'mac_iceland',
+             'mac_latin2',
+             'mac_roman',
+             'mac_turkish',
+             'ptcp154',
+             'shift_jis',
+             'shift_jis_2004',
+             'shift_jisx0213',
+             'utf_32',
+             'utf_32_be',
+             'utf_32_le',
+             'utf_16',
+             'utf_16_be',
+             'utf_16_le',
+             'utf_7',
+             'utf_8_sig']
+
+# Longest BOMs first, since the UTF-32 LE BOM starts with the UTF-16 LE one.
+BOMS = [(codecs.BOM_UTF32_BE, "utf_32"),
+        (codecs.BOM_UTF32_LE, "utf_32"),
+        (codecs.BOM_UTF8, "utf_8_sig"),
+        (codecs.BOM_UTF16_BE, "utf_16"),
+        (codecs.BOM_UTF16_LE, "utf_16")]
+
+DECLARED_CHARSET_PATTERNS = [
+    # XML declaration
+    re.compile(rb"^\s*<\?xml[^>]*?encoding\s*=\s*[\"']([A-Za-z0-9._-]+)"),
+    # HTML <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">
+    re.compile(rb"<meta[^>]+?charset\s*=\s*[\"']?([A-Za-z0-9._-]+)", re.IGNORECASE),
+    # LaTeX \usepackage[...]{inputenc}
+    re.compile(rb"\\usepackage\s*\[([A-Za-z0-9._-]+)\]\s*\{inputenc\}"),
+]
+DECLARED_CHARSET_SCAN_BYTES = 4096
+DETECTION_SAMPLE_BYTES = 64 * 1024
+
+
+def _lookup(encoding: str) -> str | None:
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def declared_charset(data: bytes) -> str | None:
+    """Returns the charset declared in the head of an XML, HTML or LaTeX document, if it is a known codec."""
+    head = data[:DECLARED_CHARSET_SCAN_BYTES]
+    for pattern in DECLARED_CHARSET_PATTERNS:
+        match = pattern.search(head)
+        if match:
+            return _lookup(match.group(1).decode("ascii"))
+    return None
+
+
+def detect_charset(data: bytes, sample_bytes: int = DETECTION_SAMPLE_BYTES) -> str | None:
+    """Returns the most probable charset of a sample of the data, detected statistically."""
+    from charset_normalizer import from_bytes
+
+    best_match = from_bytes(data[:sample_bytes]).best()
+    return best_match.encoding if best_match is not None else None
+
+
+def _candidate_encodings(data: bytes) -> Iterator[str | None]:
+    """Yields the encodings worth trying, most probable first. Detection only runs if it is reached."""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            yield encoding
+            break
+    yield declared_charset(data)
+    if b"\x00" in data[:DETECTION_SAMPLE_BYTES]:
+        # NUL bytes are valid UTF-8 but point to UTF-16/32 without a BOM, which the detector recognizes.
+        yield detect_charset(data)
+        yield "utf_8"
+    else:
+        yield "utf_8"
+        yield detect_charset(data)
+    yield from ENCODINGS
+
+
+def decode_text(data: bytes) -> tuple[str, str]:
+    """
+    Decodes the bytes of a text file, trying the most probable encoding first.
+
+    The BOM wins, then the charset the document declares, then UTF-8, then the charset detected
+    on a sample. The known encodings are only tried one by one if none of those decodes the data.
+
+    Returns:
+        str: The decoded text.
+        str: The encoding used.
+
+    Raises:
+        UnicodeDecodeError: If no known encoding decodes the data.
+    """
+    tried = set()
+    for encoding in _candidate_encodings(data):
+        codec_name = _lookup(encoding) if encoding is not None else None
+        if codec_name is None or codec_name in tried:
+            continue
+        tried.add(codec_name)
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    raise UnicodeDecodeError("unknown", data[:1], 0, 1, "No known encoding decodes the data.")
+
+
+def read_text_file(file_path: str) -> tuple[str, str]:
+    """Reads a text file once and decodes it. Returns the text and the encoding, as `decode_text`."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    return decode_text(data)
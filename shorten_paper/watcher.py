@@ -0,0 +1,174 @@
+"""
+A long-running daemon shortening the files dropped into the input directory.
+
+Run it with `python -m shorten_paper --watch`. New and changed files are enqueued into a durable local queue and
+shortened by a pool of worker threads, while the tokenizer, caches and HTTP connections of the process stay warm.
+"""
+import os
+import signal
+import threading
+import traceback
+
+from colorama import Fore
+from shorten_paper.client import shorten_file
+from shorten_paper.config import Config
+from shorten_paper.extraction_cache import ExtractionCache
+from shorten_paper.file_operations_utils import extension_to_parser
+from shorten_paper.job_queue import JobQueue
+from shorten_paper.lang_model.api_call import ResponseCache
+from shorten_paper.lang_model.backends import get_backend
+from shorten_paper.lang_model.text_processing import get_encoding
+from shorten_paper.logs import Logger
+from shorten_paper.manifest import Manifest, default_file_settings
+from shorten_paper.metrics import Metrics
+
+logger = Logger()
+CFG = Config()
+
+
+def scan_input_dir(input_dir: str) -> dict[str, tuple[int, int]]:
+    """Returns the (size, modification time) of every supported file in the input directory, by file name."""
+    files = {}
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            if os.path.splitext(entry.name)[1].lower() not in extension_to_parser:
+                continue
+            stat = entry.stat()
+            files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def warm_up(lang_models: set[str]) -> None:
+    """Loads the tokenizers, caches and backend before the first job, instead of during it."""
+    for lang_model in lang_models:
+        get_encoding(lang_model)
+    if CFG.response_cache:
+        ResponseCache()
+    if CFG.extraction_cache:
+        ExtractionCache()
+    get_backend()
+
+
+def run_job(job: dict) -> dict:
+    """
+    Shortens a queued file through all of its repeat passes.
+
+    Returns:
+        dict: The document length, the shortened length and the output file name.
+    """
+    payload = job["payload"]
+    settings = payload["settings"]
+    result_info = shorten_file(
+        payload["input_dir"], payload["document_name"], settings["instruction"], 0, 1,
+        shorten_ratio=settings["shorten_ratio"], shorten_repeat=settings["shorten_repeat"],
+        lang_model=settings["lang_model"]
+    )
+    if not isinstance(result_info[1], int):
+        raise ValueError(f"{payload['document_name']} was not shortened.")
+    return {"document_len": result_info[0], "shortened_len": result_info[1], "output_file": result_info[2]}
+
+
+def _write_reports(job_queue: JobQueue, job: dict = None) -> None:
+    """
+    Writes the report of a finished job, then the aggregate metrics reports with the job counts.
+    Failures are logged, so they never stop a worker.
+    """
+    try:
+        if job is not None:
+            Metrics().write_job_report(f"watch_job_{job['id']}", job["payload"]["document_name"],
+                                       extra={"job_id": job["id"]})
+        Metrics().write_reports(extra={"jobs": job_queue.counts()}, aggregate_only=True)
+    except Exception as e:
+        logger.error("Failed to write the metrics reports:", f"{e}")
+
+
+def _work(job_queue: JobQueue, stop: threading.Event) -> None:
+    while not stop.is_set():
+        job = job_queue.claim(timeout=1)
+        if job is None:
+            continue
+        try:
+            job_queue.finish(job["id"], run_job(job))
+        except Exception as e:
+            logger.error(f"Job {job['id']} of {job['payload']['document_name']} failed:", f"{e}")
+            logger.debug(traceback.format_exc())
+            job_queue.fail(job["id"], f"{type(e).__name__}: {e}")
+        # Keep the Prometheus textfile current while the daemon runs.
+        _write_reports(job_queue, job)
+
+
+def watch(
+        input_dir: str = CFG.papers_input_dir,
+        workers: int = None,
+        interval: float = CFG.watch_interval,
+        manifest_path: str = None,
+        stop: threading.Event = None
+) -> None:
+    """
+    Watches the input directory and shortens every new or changed file, until interrupted or `stop` is set.
+
+    A file is enqueued once its size and modification time held still for a whole interval, so files still being
+    copied in are not picked up. Jobs are kept in a queue under CACHE_DIR, so files enqueued or being shortened when
+    the daemon stopped are shortened after it restarts, and files already shortened are not shortened again.
+
+    Args:
+        input_dir (str): The directory to watch.
+        workers (int): The number of files shortened at the same time. Defaults to None, WATCH_WORKERS.
+        interval (float): Seconds between scans of the directory.
+        manifest_path (str): A manifest of the files' instructions and settings. Defaults to None, MANIFEST_FILE.
+            Without one, files are just shortened with the configured settings.
+        stop (threading.Event): Set to stop watching. Defaults to None, to watch until interrupted.
+    """
+    workers = workers or CFG.watch_workers
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        # Containers are stopped with SIGTERM: finish the files being shortened, as on Ctrl+C.
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    manifest_path = manifest_path or CFG.manifest_file
+    manifest = Manifest.load(manifest_path) if manifest_path else None
+    job_queue = JobQueue(os.path.join(CFG.cache_dir, "watch_jobs.sqlite3"))
+    Metrics().reset()
+
+    logger.typewriter_log("-* Watching for papers to shorten *-", Fore.LIGHTRED_EX)
+    logger.typewriter_log("File input path:", Fore.LIGHTYELLOW_EX, input_dir)
+    logger.typewriter_log("File output path:", Fore.LIGHTYELLOW_EX, CFG.papers_output_dir)
+    if manifest is not None:
+        logger.typewriter_log("Manifest:", Fore.LIGHTYELLOW_EX, manifest_path)
+    warm_up({CFG.lang_model_name} | {rule["settings"]["lang_model"] for rule in (manifest.rules if manifest else [])
+                                     if "lang_model" in rule["settings"]})
+    logger.typewriter_log("Workers:", Fore.LIGHTYELLOW_EX, f"{workers} ({job_queue.counts()['queued']} jobs queued)")
+    logger.newline()
+
+    worker_threads = [threading.Thread(target=_work, args=(job_queue, stop), name=f"watch-worker-{num}", daemon=True)
+                      for num in range(workers)]
+    for worker_thread in worker_threads:
+        worker_thread.start()
+
+    previous_scan = {}
+    try:
+        while not stop.is_set():
+            current_scan = scan_input_dir(input_dir)
+            for document_name, file_stat in current_scan.items():
+                if previous_scan.get(document_name) != file_stat:
+                    continue
+                settings = manifest.settings_for(document_name) if manifest is not None else default_file_settings()
+                if settings is None:
+                    continue
+                job_key = f"{os.path.abspath(os.path.join(input_dir, document_name))}:{file_stat[0]}:{file_stat[1]}"
+                job_id = job_queue.enqueue(
+                    job_key, {"input_dir": input_dir, "document_name": document_name, "settings": settings}
+                )
+                if job_id is not None:
+                    logger.typewriter_log("Enqueued:", Fore.LIGHTCYAN_EX, f"{document_name} (job {job_id})")
+            previous_scan = current_scan
+            stop.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        logger.typewriter_log("Stopping the watch after the files being shortened...", Fore.LIGHTBLUE_EX)
+        for worker_thread in worker_threads:
+            worker_thread.join()
+        _write_reports(job_queue)
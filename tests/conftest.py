@@ -0,0 +1,46 @@
+import os
+
+# Log without typing simulation or spinners. Set before shorten_paper reads its configuration.
+os.environ.setdefault("HEADLESS", "True")
+# Never serve or store the responses of the test backends in the local response cache.
+os.environ.setdefault("RESPONSE_CACHE", "False")
+
+import pytest
+import tiktoken
+
+from shorten_paper.lang_model import backends, text_processing
+
+TEST_LANG_MODEL = "test-bytes"
+
+
+def _byte_encoding() -> tiktoken.Encoding:
+    """A byte-level encoding with a few merges, some of them crossing or splitting multi-byte codepoints."""
+    mergeable_ranks = {bytes([i]): i for i in range(256)}
+    merges = [b"th", b"he", b"the", b" t", b" the", b"in", b"an",
+              "한".encode()[:2], "한".encode()[2:] + "국".encode()[:1], b"\xf0\x9f", b"\x98\x80"]
+    for merge in merges:
+        mergeable_ranks[merge] = len(mergeable_ranks)
+    return tiktoken.Encoding(
+        TEST_LANG_MODEL,
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=mergeable_ranks,
+        special_tokens={"<|endoftext|>": 100000}
+    )
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_encoding() -> tiktoken.Encoding:
+    """Registers the encoding of TEST_LANG_MODEL, so tests tokenize offline."""
+    encoding = _byte_encoding()
+    text_processing._encodings[TEST_LANG_MODEL] = encoding
+    return encoding
+
+
+@pytest.fixture
+def mock_backend(monkeypatch) -> backends.MockBackend:
+    """Answers chat completions offline and at once with the mock backend, half the length of each text."""
+    mock_backend = backends.MockBackend(
+        latency=0, tokens_per_second=0, error_rate=0, output_ratio=0.5, length_compliance=0, seed=0
+    )
+    monkeypatch.setattr(backends, "_backend", mock_backend)
+    return mock_backend
@@ -0,0 +1,55 @@
+import re
+
+import pytest
+
+from shorten_paper import file_operations_utils
+from shorten_paper.file_operations_utils import _CompressionController, _shorten_text_into
+
+from conftest import TEST_LANG_MODEL
+
+_CURRENT_TEXT_PATTERN = re.compile(r'"Current Text": """(.*?)"""', re.DOTALL)
+
+
+def _run_chunks(controller: _CompressionController, reply, chunk_cnt: int = 60, current_token_cnt: int = 170):
+    for _ in range(chunk_cnt):
+        request_ratio = controller.request_ratio(current_token_cnt)
+        requested_token_cnt = int(current_token_cnt * request_ratio)
+        controller.observe(current_token_cnt, requested_token_cnt, reply(current_token_cnt, requested_token_cnt))
+
+
+def test_compliance_stays_bounded_when_the_model_ignores_the_requested_length():
+    controller = _CompressionController(0.4)
+    _run_chunks(controller, lambda current_token_cnt, requested_token_cnt: round(current_token_cnt * 0.43))
+
+    assert 1 / controller.max_compliance <= controller.compliance <= controller.max_compliance
+    # The room left for the output follows the predicted output instead of saturating at the whole chunk.
+    assert controller.output_ratio(170) < 1.0
+    assert controller.output_ratio(170) >= controller.target_ratio
+
+
+def test_converges_on_a_model_overshooting_the_requested_length():
+    controller = _CompressionController(0.4)
+    _run_chunks(controller, lambda current_token_cnt, requested_token_cnt: round(requested_token_cnt * 1.5))
+
+    assert controller.output_token_cnt / controller.input_token_cnt == pytest.approx(0.4, abs=0.01)
+    assert controller.compliance == pytest.approx(1.5, abs=0.05)
+
+
+def test_adaptive_chunking_keeps_chunk_count_with_a_model_ignoring_the_requested_length(monkeypatch):
+    def ignore_requested_length(messages, lang_model, token_cost=None, on_delta=None, on_usage=None):
+        current_text = _CURRENT_TEXT_PATTERN.search(messages[1]["content"]).group(1)
+        return current_text[:round(len(current_text) * 0.43)]
+
+    monkeypatch.setattr(file_operations_utils, "_request_shortening", ignore_requested_length)
+    text = "The stars counting the night and the sea.\n" * 400
+
+    chunk_cnts = {}
+    for adaptive_chunking in (False, True):
+        chunk_ids = []
+        _shorten_text_into(
+            lambda piece: None, text, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.4, chunk_concurrency=1,
+            on_chunk_done=lambda chunk_idx, output: chunk_ids.append(chunk_idx), adaptive_chunking=adaptive_chunking
+        )
+        chunk_cnts[adaptive_chunking] = len(chunk_ids)
+
+    assert chunk_cnts[True] <= chunk_cnts[False] * 1.1
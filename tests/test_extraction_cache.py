@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from shorten_paper import extraction_cache as extraction_cache_module, file_operations_utils
+from shorten_paper.extraction_cache import ExtractionCache
+from shorten_paper.file_operations_utils import read_tokenized_file
+from shorten_paper.lang_model.text_processing import TokenizedText
+from shorten_paper.singletone import Singleton
+
+from conftest import TEST_LANG_MODEL
+
+TEXT = "The stars counting the night and the sea. 한국 😀\n" * 20
+
+
+@pytest.fixture
+def extraction_cache(tmp_path) -> ExtractionCache:
+    """An extraction cache of its own in a temporary directory, not the process-wide one."""
+    Singleton._instances.pop(ExtractionCache, None)
+    extraction_cache = ExtractionCache(str(tmp_path / "cache" / "extracted.sqlite3"), max_bytes=1024 * 1024)
+    yield extraction_cache
+    extraction_cache._connection.close()
+    Singleton._instances.pop(ExtractionCache, None)
+
+
+@pytest.fixture
+def hashed_paths(monkeypatch) -> list[str]:
+    hashed_paths = []
+    hash_file = extraction_cache_module.hash_file
+
+    def record_hash(file_path: str) -> str:
+        hashed_paths.append(file_path)
+        return hash_file(file_path)
+
+    monkeypatch.setattr(extraction_cache_module, "hash_file", record_hash)
+    return hashed_paths
+
+
+def _write(path, text: str, mtime_ns: int) -> str:
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, extraction_cache: ExtractionCache, hashed_paths: list):
+    file_path = _write(tmp_path / "paper.txt", TEXT, 10 ** 18)
+    content_hash = extraction_cache.fingerprint(file_path)
+    assert extraction_cache.fingerprint(file_path) == content_hash
+    assert len(hashed_paths) == 1
+
+    # A touched file is hashed again, and still has the same content hash.
+    _write(tmp_path / "paper.txt", TEXT, 2 * 10 ** 18)
+    assert extraction_cache.fingerprint(file_path) == content_hash
+    assert len(hashed_paths) == 2
+
+
+def test_changed_contents_miss_the_cache(tmp_path, extraction_cache: ExtractionCache):
+    file_path = _write(tmp_path / "paper.txt", TEXT, 10 ** 18)
+    content_hash = extraction_cache.fingerprint(file_path)
+    extraction_cache.put(file_path, content_hash, TokenizedText(TEXT, TEST_LANG_MODEL))
+    cached_text = extraction_cache.get(file_path, content_hash, TEST_LANG_MODEL)
+    assert cached_text.text == TEXT
+    assert cached_text.tokens == TokenizedText(TEXT, TEST_LANG_MODEL).tokens
+
+    # The entry of the old content is not served for the new one.
+    _write(tmp_path / "paper.txt", TEXT.upper(), 2 * 10 ** 18)
+    changed_hash = extraction_cache.fingerprint(file_path)
+    assert changed_hash != content_hash
+    assert extraction_cache.get(file_path, changed_hash, TEST_LANG_MODEL) is None
+    # Another extension selects another parser, so it does not share the entry.
+    assert extraction_cache.get(str(tmp_path / "paper.md"), content_hash, TEST_LANG_MODEL) is None
+
+
+def test_files_are_read_once(tmp_path, extraction_cache: ExtractionCache, monkeypatch):
+    monkeypatch.setattr(file_operations_utils.CFG, "extraction_cache", True)
+    read_paths = []
+    read_textual_file = file_operations_utils.read_textual_file
+
+    def record_read(file_path: str) -> str:
+        read_paths.append(file_path)
+        return read_textual_file(file_path)
+
+    monkeypatch.setattr(file_operations_utils, "read_textual_file", record_read)
+    file_path = _write(tmp_path / "paper.txt", TEXT, 10 ** 18)
+    assert read_tokenized_file(file_path, TEST_LANG_MODEL).text == TEXT
+    assert read_tokenized_file(file_path, TEST_LANG_MODEL).text == TEXT
+    assert len(read_paths) == 1
+
+    _write(tmp_path / "paper.txt", TEXT + "The end.", 2 * 10 ** 18)
+    assert read_tokenized_file(file_path, TEST_LANG_MODEL).text == TEXT + "The end."
+    assert len(read_paths) == 2
+
+
+def test_invalidating_a_directory_drops_its_files(tmp_path, extraction_cache: ExtractionCache):
+    (tmp_path / "papers").mkdir()
+    (tmp_path / "papers_old").mkdir()
+    for file_path in (tmp_path / "papers" / "a.txt", tmp_path / "papers_old" / "b.txt"):
+        text = f"{TEXT}{file_path.name}"
+        file_path = _write(file_path, text, 10 ** 18)
+        extraction_cache.put(file_path, extraction_cache.fingerprint(file_path), TokenizedText(text, TEST_LANG_MODEL))
+
+    assert extraction_cache.invalidate(str(tmp_path / "papers")) == 1
+    assert extraction_cache.stats()["files"] == 1
+    assert extraction_cache.stats()["entries"] == 1
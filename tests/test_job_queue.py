@@ -0,0 +1,54 @@
+import threading
+
+from shorten_paper.job_queue import JobQueue
+
+
+def test_jobs_are_claimed_first_in_first_out(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    first_id = job_queue.enqueue("a", {"document_name": "a.txt"})
+    second_id = job_queue.enqueue("b", {"document_name": "b.txt"})
+    # The same work is enqueued once.
+    assert job_queue.enqueue("a", {"document_name": "a.txt"}) is None
+
+    job = job_queue.claim(timeout=0)
+    assert (job["id"], job["status"], job["attempts"]) == (first_id, "running", 1)
+    assert job["payload"] == {"document_name": "a.txt"}
+    job_queue.finish(first_id, {"output_file": "a_40.00%.txt"})
+    assert job_queue.get(first_id)["result"] == {"output_file": "a_40.00%.txt"}
+    assert job_queue.claim(timeout=0)["id"] == second_id
+    job_queue.fail(second_id, "ValueError: No text to shorten.")
+    assert job_queue.claim(timeout=0) is None
+    assert job_queue.counts() == {"queued": 0, "running": 0, "done": 1, "failed": 1}
+
+
+def test_running_jobs_are_queued_again_after_a_crash(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    job_queue = JobQueue(path)
+    crashed_id = job_queue.enqueue("a", {"document_name": "a.txt"})
+    queued_id = job_queue.enqueue("b", {"document_name": "b.txt"})
+    done_id = job_queue.enqueue("c", {"document_name": "c.txt"})
+    assert job_queue.claim(timeout=0)["id"] == crashed_id
+    assert job_queue.claim(timeout=0)["id"] == queued_id
+    assert job_queue.claim(timeout=0)["id"] == done_id
+    job_queue.finish(done_id)
+    # The process stops without settling its running jobs.
+    job_queue._connection.close()
+
+    job_queue = JobQueue(path)
+    assert job_queue.counts() == {"queued": 2, "running": 0, "done": 1, "failed": 0}
+    job = job_queue.claim(timeout=0)
+    assert (job["id"], job["attempts"]) == (crashed_id, 2)
+    assert job_queue.claim(timeout=0)["id"] == queued_id
+    assert job_queue.claim(timeout=0) is None
+    assert job_queue.get(done_id)["status"] == "done"
+    job_queue._connection.close()
+
+
+def test_claim_waits_for_a_job(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    claimed_jobs = []
+    worker_thread = threading.Thread(target=lambda: claimed_jobs.append(job_queue.claim(timeout=10)))
+    worker_thread.start()
+    job_id = job_queue.enqueue("a", {"document_name": "a.txt"})
+    worker_thread.join(10)
+    assert [job["id"] for job in claimed_jobs] == [job_id]
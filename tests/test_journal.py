@@ -0,0 +1,75 @@
+import os
+
+from shorten_paper import journal as journal_module
+from shorten_paper.journal import RunJournal
+
+
+def test_progress_is_resumed(tmp_path):
+    path = str(tmp_path / "journals" / "run.jsonl")
+    journal = RunJournal(path)
+    assert not journal.resumable
+    journal.start(["a.txt", "b.txt"], ["", "Keep the numbers."])
+    journal.record_chunk(0, "a.txt", 0, "First chunk.")
+    journal.record_chunk(0, "a.txt", 1, "Second chunk.")
+    journal.record_chunk(1, "a.txt", 0, "First pass two chunk.")
+    journal.record_file("b.txt", (100, 40, "b_40.00%.txt"))
+    journal.close()
+
+    journal = RunJournal(path)
+    assert journal.resumable
+    assert journal.instructions == ["", "Keep the numbers."]
+    assert journal.completed_chunks_by_pass("a.txt") == {
+        0: {0: "First chunk.", 1: "Second chunk."},
+        1: {0: "First pass two chunk."},
+    }
+    assert journal.completed_chunks_by_pass("b.txt") == {}
+    assert journal.file_result("b.txt") == (100, 40, "b_40.00%.txt")
+    assert journal.file_result("a.txt") is None
+    journal.finish()
+    assert not os.path.exists(path)
+
+
+def test_a_record_cut_off_is_skipped(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path)
+    journal.start(["a.txt"], [""])
+    journal.record_chunk(0, "a.txt", 0, "First chunk.")
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "chunk", "repeat_num": 0, "document_name": "a.txt", "chunk_')
+
+    journal = RunJournal(path)
+    assert journal.completed_chunks_by_pass("a.txt") == {0: {0: "First chunk."}}
+    journal.close()
+
+
+def test_start_discards_previous_progress(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path)
+    journal.start(["a.txt"], [""])
+    journal.record_chunk(0, "a.txt", 0, "First chunk.")
+    journal.start(["a.txt"], ["Again."])
+    journal.close()
+
+    journal = RunJournal(path)
+    assert journal.instructions == ["Again."]
+    assert journal.completed_chunks_by_pass("a.txt") == {}
+    journal.close()
+
+
+def _run_journal_path(input_dir: str) -> str:
+    journal = RunJournal.for_run(input_dir, [])
+    journal.close()
+    return journal.path
+
+
+def test_run_key_ignores_worker_counts(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module.CFG, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(journal_module.CFG, "shorten_mode", "tree")
+    monkeypatch.setattr(journal_module.CFG, "tree_concurrency", 1)
+    path = _run_journal_path(str(tmp_path))
+    monkeypatch.setattr(journal_module.CFG, "tree_concurrency", 8)
+    assert _run_journal_path(str(tmp_path)) == path
+
+    monkeypatch.setattr(journal_module.CFG, "tree_target_tokens", journal_module.CFG.tree_target_tokens + 1)
+    assert _run_journal_path(str(tmp_path)) != path
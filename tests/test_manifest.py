@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from shorten_paper.manifest import Manifest, default_file_settings
+
+RULES = [
+    {"glob": "*"},
+    {"glob": ["*.pdf", "*.docx"], "instruction": "Keep the experiment results", "shorten_ratio": 0.3},
+    {"glob": "survey_*.pdf", "shorten_ratio": "0.6", "shorten_repeat": 2},
+]
+
+
+def test_later_rules_override_earlier_ones():
+    manifest = Manifest(RULES)
+    assert manifest.settings_for("survey_2023.pdf") == default_file_settings("Keep the experiment results") | {
+        "shorten_ratio": 0.6, "shorten_repeat": 2
+    }
+    assert manifest.settings_for("paper.docx") == default_file_settings("Keep the experiment results") | {
+        "shorten_ratio": 0.3
+    }
+    # Settings no rule sets fall back to the configured ones.
+    assert manifest.settings_for("notes.txt") == default_file_settings()
+
+
+def test_files_no_rule_matches_are_not_shortened():
+    manifest = Manifest(RULES[1:])
+    assert manifest.settings_for("notes.txt") is None
+    assert manifest.settings_for("paper.pdf.txt") is None
+    assert manifest.settings_for("paper.pdf")["shorten_ratio"] == 0.3
+    assert manifest.settings_for("survey_.pdf")["shorten_ratio"] == 0.6
+
+
+def test_yaml_and_json_lines_load_the_same_rules(tmp_path):
+    yaml_path = tmp_path / "manifest.yaml"
+    yaml_path.write_text(
+        '- glob: "*"\n'
+        '- glob: ["*.pdf", "*.docx"]\n'
+        '  instruction: "Keep the experiment results"\n'
+        '  shorten_ratio: 0.3\n'
+        '- glob: "survey_*.pdf"\n'
+        '  shorten_ratio: "0.6"\n'
+        '  shorten_repeat: 2\n',
+        encoding="utf-8"
+    )
+    jsonl_path = tmp_path / "manifest.jsonl"
+    jsonl_path.write_text("".join(json.dumps(rule) + "\n\n" for rule in RULES), encoding="utf-8")
+    assert Manifest.load(str(yaml_path)).rules == Manifest.load(str(jsonl_path)).rules == Manifest(RULES).rules
+
+
+@pytest.mark.parametrize("rule", [
+    "*.pdf",
+    {"instruction": "No glob."},
+    {"glob": ["*.pdf", 3]},
+    {"glob": "*.pdf", "temperature": 0},
+    {"glob": "*.pdf", "shorten_ratio": 0},
+    {"glob": "*.pdf", "shorten_ratio": "half"},
+    {"glob": "*.pdf", "shorten_repeat": 0},
+])
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError, match="Manifest rule 2"):
+        Manifest([{"glob": "*"}, rule])
+
+
+def test_unsupported_manifest_formats_are_rejected(tmp_path):
+    (tmp_path / "manifest.json").write_text(json.dumps(RULES), encoding="utf-8")
+    with pytest.raises(ValueError, match="Unsupported manifest format"):
+        Manifest.load(str(tmp_path / "manifest.json"))
+    (tmp_path / "manifest.yaml").write_text("glob: '*'\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="list of rules"):
+        Manifest.load(str(tmp_path / "manifest.yaml"))
@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+
+from shorten_paper.metrics import PROMETHEUS_FILE_NAME, Metrics
+
+
+def test_concurrent_report_writes_do_not_race(tmp_path):
+    metrics = Metrics()
+    errors = []
+
+    def write_reports():
+        try:
+            for _ in range(20):
+                metrics.write_reports(str(tmp_path), extra={"jobs": {"done": 1}})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write_reports) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.path.exists(tmp_path / PROMETHEUS_FILE_NAME)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_job_reports_keep_no_state_per_file(tmp_path):
+    metrics = Metrics()
+    metrics.reset()
+    for job_num in range(3):
+        document_name = f"paper{job_num}.txt"
+        metrics.observe("read_file", 0.5, document_name)
+        metrics.record_usage({"prompt_tokens": 100, "completion_tokens": 40}, document_name, 0)
+        job_path = metrics.write_job_report(f"job_{job_num}", document_name, str(tmp_path))
+        metrics.write_reports(str(tmp_path), aggregate_only=True)
+
+        with open(job_path, encoding="utf-8") as f:
+            job_report = json.load(f)
+        assert job_report["usage"] == {"requests": 1, "prompt_tokens": 100, "completion_tokens": 40}
+        assert job_report["stages"] == {"read_file": 0.5}
+        assert len(job_report["chunks"]) == 1
+        assert metrics.files == {}
+        assert metrics.chunks == []
+
+    report = metrics.report(aggregate_only=True)
+    assert "files" not in report and "chunks" not in report
+    assert report["usage"]["requests"] == 3
+    with open(tmp_path / PROMETHEUS_FILE_NAME, encoding="utf-8") as f:
+        prometheus_text = f.read()
+    assert "paper0.txt" not in prometheus_text
+    assert 'shorten_paper_tokens_total{kind="prompt"} 300' in prometheus_text
@@ -0,0 +1,52 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+openai = pytest.importorskip("openai")
+if not hasattr(openai, "error"):
+    pytest.skip("openai 0.x is required", allow_module_level=True)
+
+from shorten_paper.lang_model.backends import MockBackend  # noqa: E402
+from shorten_paper.lang_model.mock_server import serve  # noqa: E402
+
+from conftest import TEST_LANG_MODEL  # noqa: E402
+
+
+@pytest.fixture
+def mock_address():
+    mock_server = serve("127.0.0.1", 0, MockBackend(latency=0, tokens_per_second=0, error_rate=0), 4096)
+    server_thread = threading.Thread(target=mock_server.serve_forever, daemon=True)
+    server_thread.start()
+    yield mock_server.server_address
+    mock_server.shutdown()
+    mock_server.server_close()
+
+
+def _post(address: tuple, body: bytes, content_len: str = None) -> tuple[int, dict]:
+    connection = http.client.HTTPConnection(*address, timeout=5)
+    connection.putrequest("POST", "/v1/chat/completions")
+    connection.putheader("Content-Length", str(len(body)) if content_len is None else content_len)
+    connection.endheaders()
+    connection.send(body)
+    response = connection.getresponse()
+    status, body = response.status, json.loads(response.read())
+    connection.close()
+    return status, body
+
+
+@pytest.mark.parametrize("content_len, status", [("abc", 400), ("-1", 400), ("4097", 413)])
+def test_invalid_content_length_is_refused(mock_address, content_len: str, status: int):
+    assert _post(mock_address, b"", content_len)[0] == status
+
+
+def test_body_not_json_is_refused(mock_address):
+    assert _post(mock_address, b"{")[0] == 400
+
+
+def test_completion_is_answered(mock_address):
+    request = {"model": TEST_LANG_MODEL, "messages": [{"role": "user", "content": "The stars counting the night."}]}
+    status, body = _post(mock_address, json.dumps(request).encode("utf-8"))
+    assert status == 200
+    assert body["choices"][0]["message"]["content"]
@@ -0,0 +1,127 @@
+import io
+import os
+import re
+import threading
+
+import pytest
+
+from shorten_paper import client, file_operations_utils
+from shorten_paper.file_operations_utils import _OrderedChunkWriter, shorten_text, shorten_text_to_stream
+from shorten_paper.lang_model import backends
+from shorten_paper.lang_model.retry_policy import ChatCompletionError
+from shorten_paper.lang_model.text_processing import TokenizedText
+
+from conftest import TEST_LANG_MODEL
+
+TEXT = "The stars counting the night and the sea.\n" * 200
+_CHUNK_NUM_PATTERN = re.compile(r"number (\d+) of total (\d+) chunks")
+
+
+class _LastFirstBackend(backends.MockBackend):
+    """Answers the chunks last to first: each chunk streams only once the chunk after it is done."""
+
+    def __init__(self):
+        super().__init__(latency=0, tokens_per_second=0, error_rate=0, output_ratio=0.5, length_compliance=0)
+        self.done = {}
+        self.done_order = []
+        self._lock = threading.Lock()
+
+    def _done_event(self, chunk_num: int) -> threading.Event:
+        with self._lock:
+            return self.done.setdefault(chunk_num, threading.Event())
+
+    def _generate(self, model: str, messages: list, request_timeout: float):
+        chunk_num, chunk_total = map(int, _CHUNK_NUM_PATTERN.search(messages[0]["content"]).groups())
+        if chunk_num < chunk_total:
+            assert self._done_event(chunk_num + 1).wait(10)
+        yield from super()._generate(model, messages, request_timeout)
+        with self._lock:
+            self.done_order.append(chunk_num)
+        self._done_event(chunk_num).set()
+
+
+def test_chunks_running_ahead_are_buffered():
+    pieces = []
+    writer = _OrderedChunkWriter(pieces.append, streaming=True)
+    writer.on_delta(2)("C1")
+    writer.on_delta(1)("B1")
+    writer.finish(2, "C1")
+    writer.on_delta(1)("B2")
+    assert pieces == []
+
+    writer.on_delta(0)("A1")
+    assert pieces == ["A1"]
+    writer.finish(1, "B1B2")
+    writer.on_delta(0)("A2")
+    writer.finish(0, "A1A2")
+    assert "".join(pieces) == "A1A2\nB1B2\nC1"
+    assert writer.char_cnt == len("A1A2\nB1B2\nC1")
+
+
+def test_finished_chunks_are_written_in_order_without_streaming():
+    pieces = []
+    writer = _OrderedChunkWriter(pieces.append)
+    assert writer.on_delta(0) is None
+    writer.finish(1, "B")
+    writer.finish(0, "A")
+    writer.finish(3, "D")
+    assert "".join(pieces) == "A\nB"
+    writer.finish(2, "C")
+    assert "".join(pieces) == "A\nB\nC\nD"
+
+
+def test_stream_is_in_chunk_order_when_chunks_finish_last_to_first(mock_backend, monkeypatch):
+    expected_text = shorten_text(TEXT, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.5, chunk_concurrency=1)
+
+    last_first_backend = _LastFirstBackend()
+    monkeypatch.setattr(backends, "_backend", last_first_backend)
+    output_stream = io.StringIO()
+    chunk_outputs = {}
+    char_cnt = shorten_text_to_stream(
+        output_stream, TEXT, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.5, chunk_concurrency=64,
+        on_chunk_done=chunk_outputs.__setitem__
+    )
+
+    chunk_cnt = len(chunk_outputs)
+    assert chunk_cnt > 2
+    assert last_first_backend.done_order == list(range(chunk_cnt, 0, -1))
+    assert output_stream.getvalue() == "\n".join(chunk_outputs[i] for i in range(chunk_cnt))
+    assert char_cnt == len(output_stream.getvalue())
+    # Without previous outputs to reference, the chunks are the same whether they are shortened one by one or not.
+    assert output_stream.getvalue() == expected_text
+
+
+def test_a_failed_run_leaves_no_partial_file(tmp_path, monkeypatch):
+    def fail_mid_stream(messages, lang_model, token_cost=None, on_delta=None, on_usage=None):
+        on_delta("The stars")
+        raise ChatCompletionError("Simulated failure.")
+
+    monkeypatch.setattr(file_operations_utils, "_request_shortening", fail_mid_stream)
+    monkeypatch.setattr(client.CFG, "papers_output_dir", str(tmp_path / "output"))
+    monkeypatch.setattr(client.CFG, "stream_output", True)
+    monkeypatch.setattr(client.CFG, "shorten_mode", "linear")
+    monkeypatch.setattr(client.CFG, "extraction_cache", False)
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "paper.txt").write_text(TEXT, encoding="utf-8")
+
+    result_info = client.shorten_file(str(input_dir), "paper.txt", "", 0, 1, lang_model=TEST_LANG_MODEL)
+
+    assert result_info[1:] == ("ERROR!", "Error: Didn't saved.")
+    assert os.listdir(tmp_path / "output") == []
+
+
+def test_a_failed_stream_removes_its_partial_file(tmp_path, monkeypatch):
+    def fail_mid_stream(messages, lang_model, token_cost=None, on_delta=None, on_usage=None):
+        on_delta("The stars")
+        raise OSError("Connection reset.")
+
+    monkeypatch.setattr(file_operations_utils, "_request_shortening", fail_mid_stream)
+    monkeypatch.setattr(client.CFG, "papers_output_dir", str(tmp_path))
+    monkeypatch.setattr(client.CFG, "shorten_mode", "linear")
+    with pytest.raises(OSError):
+        client._stream_to_partial_file(
+            TokenizedText(TEXT, TEST_LANG_MODEL), "paper.txt", "",
+            {"lang_model": TEST_LANG_MODEL, "shorten_ratio": 0.5, "shorten_repeat": 1}
+        )
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,73 @@
+import pytest
+
+from shorten_paper import file_operations_utils, planner
+from shorten_paper.file_operations_utils import shorten_text
+from shorten_paper.lang_model.api_call import estimate_prompt_tokens
+from shorten_paper.lang_model.text_processing import TokenizedText
+from shorten_paper.manifest import default_file_settings
+
+from conftest import TEST_LANG_MODEL
+
+TEXT = "The stars counting the night and the sea.\n" * 200
+
+
+@pytest.fixture
+def settings(monkeypatch) -> dict:
+    monkeypatch.setattr(planner.CFG, "text_token_len", 1500)
+    monkeypatch.setattr(planner.CFG, "chunk_concurrency", 4)
+    monkeypatch.setattr(planner.CFG, "shorten_mode", "linear")
+    monkeypatch.setattr(planner.CFG, "shorten_target_ratio", None)
+    return default_file_settings() | {"lang_model": TEST_LANG_MODEL, "shorten_ratio": 0.5, "shorten_repeat": 3}
+
+
+def test_first_pass_plans_the_requests_of_a_run(settings: dict, mock_backend, monkeypatch):
+    requests = []
+    request_shortening = file_operations_utils._request_shortening
+
+    def record_request(messages, lang_model, token_cost=None, on_delta=None, on_usage=None):
+        requests.append(messages)
+        return request_shortening(messages, lang_model, token_cost, on_delta, on_usage)
+
+    monkeypatch.setattr(file_operations_utils, "_request_shortening", record_request)
+    shorten_text(TEXT, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.5, chunk_concurrency=4)
+
+    first_pass = planner.plan_text(TokenizedText(TEXT, TEST_LANG_MODEL), settings)[0]
+    assert first_pass["input_tokens"] == len(TokenizedText(TEXT, TEST_LANG_MODEL))
+    assert first_pass["requests"] == len(requests) > 1
+    assert first_pass["prompt_tokens"] == sum(estimate_prompt_tokens(messages, TEST_LANG_MODEL)
+                                              for messages in requests)
+
+
+def test_passes_shrink_by_the_shorten_ratio(settings: dict):
+    passes = planner.plan_text(TokenizedText(TEXT, TEST_LANG_MODEL), settings)
+    assert len(passes) == 3
+    for pass_plan, next_pass_plan in zip(passes, passes[1:]):
+        # The outputs of the chunks are joined by newlines.
+        assert next_pass_plan["input_tokens"] == pass_plan["completion_tokens"] + pass_plan["requests"] - 1
+        assert pass_plan["completion_tokens"] <= pass_plan["input_tokens"] * 0.5
+    assert passes[-1]["requests"] < passes[0]["requests"]
+
+
+@pytest.mark.parametrize("shorten_mode", ["linear", "tree"])
+@pytest.mark.parametrize("target_ratio, pass_cnt", [(None, 3), (0.3, 2), (0, 3)])
+def test_passes_stop_at_the_target_ratio(settings: dict, monkeypatch, shorten_mode: str, target_ratio, pass_cnt: int):
+    monkeypatch.setattr(planner.CFG, "shorten_mode", shorten_mode)
+    monkeypatch.setattr(planner.CFG, "shorten_target_ratio", target_ratio)
+    monkeypatch.setattr(planner.CFG, "tree_max_levels", 3)
+    monkeypatch.setattr(planner.CFG, "tree_target_tokens", 0)
+    assert len(planner.plan_text(TokenizedText(TEXT, TEST_LANG_MODEL), settings)) == pass_cnt
+
+
+def test_files_are_planned_with_their_cost(settings: dict, tmp_path, monkeypatch):
+    monkeypatch.setattr(planner.CFG, "extraction_cache", False)
+    monkeypatch.setattr(planner.CFG, "plan_prompt_price", 0.001)
+    monkeypatch.setattr(planner.CFG, "plan_completion_price", 0.002)
+    (tmp_path / "paper.txt").write_text(TEXT, encoding="utf-8")
+    (tmp_path / "empty.txt").write_text("", encoding="utf-8")
+
+    file_plan = planner.plan_file(str(tmp_path), "paper.txt", settings)
+    assert file_plan["requests"] == sum(pass_plan["requests"] for pass_plan in file_plan["passes"])
+    assert file_plan["cost"] == pytest.approx(
+        (file_plan["prompt_tokens"] * 0.001 + file_plan["completion_tokens"] * 0.002) / 1000
+    )
+    assert planner.plan_file(str(tmp_path), "empty.txt", settings)["error"] == "ValueError: No text to shorten."
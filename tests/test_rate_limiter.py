@@ -0,0 +1,102 @@
+import types
+
+import pytest
+
+from shorten_paper.lang_model import rate_limiter
+from shorten_paper.lang_model.rate_limiter import RateLimiter, TokenBucket
+from shorten_paper.singletone import Singleton
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class _Condition:
+    """Waits by advancing the clock instead of sleeping."""
+
+    def __init__(self, clock: _Clock):
+        self.clock = clock
+        self.waits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def wait(self, timeout: float) -> None:
+        self.waits.append(timeout)
+        self.clock.now += timeout
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def make_rate_limiter(clock: _Clock):
+    """Makes rate limiters of their own, not the process-wide one, waiting on the clock."""
+    def make_rate_limiter(requests_per_minute: int, tokens_per_minute: int) -> RateLimiter:
+        Singleton._instances.pop(RateLimiter, None)
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        limiter._condition = _Condition(clock)
+        return limiter
+
+    yield make_rate_limiter
+    Singleton._instances.pop(RateLimiter, None)
+
+
+def test_bucket_refills_up_to_its_capacity(clock: _Clock):
+    bucket = TokenBucket(120)
+    bucket.take(120)
+    assert bucket.wait_time(10) == 5
+
+    clock.now += 2
+    bucket.refill(clock.now)
+    assert bucket.level == pytest.approx(4)
+    assert bucket.wait_time(10) == pytest.approx(3)
+    assert bucket.wait_time(4) == 0
+
+    clock.now += 3600
+    bucket.refill(clock.now)
+    assert bucket.level == 120
+
+
+def test_unlimited_bucket_never_waits(clock: _Clock):
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 9)
+    bucket.refill(clock.now + 1)
+    assert bucket.wait_time(10 ** 9) == 0
+
+
+def test_requests_wait_for_the_request_bucket(make_rate_limiter, clock: _Clock):
+    limiter = make_rate_limiter(requests_per_minute=2, tokens_per_minute=0)
+    assert limiter.acquire(100) == 0
+    assert limiter.acquire(100) == 0
+    # The third request of the minute waits for a request to be refilled, 30 seconds at 2 per minute.
+    assert limiter.acquire(100) == pytest.approx(30)
+    assert limiter._condition.waits == [pytest.approx(30)]
+    assert limiter.waited_seconds == pytest.approx(30)
+
+
+def test_requests_wait_for_the_token_bucket(make_rate_limiter, clock: _Clock):
+    limiter = make_rate_limiter(requests_per_minute=0, tokens_per_minute=600)
+    assert limiter.acquire(500) == 0
+    assert limiter.acquire(200) == pytest.approx(10)
+
+    # A request bigger than the whole bucket is admitted once the bucket is full.
+    assert limiter.acquire(6000) == pytest.approx(60)
+    assert limiter.token_bucket.level == pytest.approx(0)
+
+
+def test_penalize_empties_the_buckets(make_rate_limiter, clock: _Clock):
+    limiter = make_rate_limiter(requests_per_minute=60, tokens_per_minute=0)
+    limiter.penalize()
+    assert limiter.acquire(100) == pytest.approx(1)
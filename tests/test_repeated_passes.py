@@ -0,0 +1,48 @@
+from shorten_paper.file_operations_utils import shorten_text_repeatedly
+
+from conftest import TEST_LANG_MODEL
+
+TEXT = "The stars counting the night and the sea.\n" * 200
+
+
+def _shorten(target_ratio: float | None, shorten_repeat: int = 4) -> tuple:
+    pass_nums, passes_done, last_pieces = set(), [], []
+    shortened_text = shorten_text_repeatedly(
+        TEXT, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.8, shorten_repeat=shorten_repeat,
+        target_ratio=target_ratio, chunk_concurrency=4,
+        on_chunk_done=lambda repeat_num, chunk_idx, output: pass_nums.add(repeat_num),
+        on_pass_done=lambda repeat_num, pass_text: passes_done.append(repeat_num),
+        write_last=last_pieces.append
+    )
+    return shortened_text, sorted(pass_nums), passes_done, last_pieces
+
+
+def test_passes_stop_at_the_target_ratio(mock_backend):
+    # Each pass halves the text, so 0.8 ** 4 of the original is reached after 2 of the 4 passes.
+    shortened_text, pass_nums, passes_done, last_pieces = _shorten(None)
+    assert pass_nums == [0, 1]
+    assert passes_done == [0]
+    # The passes stopped early, so the last output is written at once.
+    assert last_pieces == [shortened_text.text]
+
+
+def test_a_lower_target_ratio_runs_more_passes(mock_backend):
+    shortened_text, pass_nums, passes_done, last_pieces = _shorten(0.2)
+    assert pass_nums == [0, 1, 2]
+    assert last_pieces == [shortened_text.text]
+
+
+def test_a_zero_target_ratio_runs_every_pass(mock_backend):
+    shortened_text, pass_nums, passes_done, last_pieces = _shorten(0)
+    assert pass_nums == [0, 1, 2, 3]
+    assert passes_done == [0, 1, 2]
+    # The last pass is written piece by piece as it arrives.
+    assert len(last_pieces) > 1
+    assert "".join(last_pieces) == shortened_text.text
+
+
+def test_the_last_pass_is_written_even_without_early_stop(mock_backend):
+    shortened_text, pass_nums, passes_done, last_pieces = _shorten(None, shorten_repeat=1)
+    assert pass_nums == [0]
+    assert passes_done == []
+    assert "".join(last_pieces) == shortened_text.text
@@ -0,0 +1,97 @@
+import types
+
+import pytest
+
+from shorten_paper.lang_model import api_call
+from shorten_paper.lang_model.api_call import ResponseCache, create_chat_completion
+from shorten_paper.singletone import Singleton
+
+from conftest import TEST_LANG_MODEL
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(api_call, "time", types.SimpleNamespace(time=clock.time, perf_counter=clock.time))
+    return clock
+
+
+@pytest.fixture
+def response_cache(tmp_path) -> ResponseCache:
+    """A response cache of its own in a temporary directory, not the process-wide one."""
+    Singleton._instances.pop(ResponseCache, None)
+    response_cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_bytes=100, ttl=60)
+    yield response_cache
+    response_cache._connection.close()
+    Singleton._instances.pop(ResponseCache, None)
+
+
+def test_keys_cover_the_model_and_sampling_parameters():
+    messages = [{"role": "user", "content": "The stars counting the night."}]
+    key = ResponseCache.make_key(messages, "gpt-4", temperature=0)
+    assert ResponseCache.make_key(list(messages), "gpt-4", temperature=0) == key
+    assert ResponseCache.make_key(messages, "gpt-4o", temperature=0) != key
+    assert ResponseCache.make_key(messages, "gpt-4", temperature=1) != key
+    assert ResponseCache.make_key([{"role": "user", "content": "The sea."}], "gpt-4", temperature=0) != key
+
+
+def test_entries_expire_after_the_ttl(response_cache: ResponseCache, clock: _Clock):
+    response_cache.put("a", "The stars.")
+    clock.now += 60
+    assert response_cache.get("a") == "The stars."
+    clock.now += 1
+    assert response_cache.get("a") is None
+
+    response_cache.ttl = 0
+    response_cache.put("b", "The sea.")
+    clock.now += 10 ** 9
+    assert response_cache.get("b") == "The sea."
+
+
+def test_least_recently_used_entries_are_evicted_by_bytes(response_cache: ResponseCache, clock: _Clock):
+    for key in "abc":
+        response_cache.put(key, key * 30)
+        clock.now += 1
+    assert response_cache.get("a") == "a" * 30
+    clock.now += 1
+
+    # "b" was used the longest ago, and evicting it alone brings the 120 bytes under 100.
+    response_cache.put("d", "d" * 30)
+    assert response_cache.get("b") is None
+    assert [response_cache.get(key) for key in "acd"] == ["a" * 30, "c" * 30, "d" * 30]
+
+    # Multi-byte responses are sized in bytes: 25 characters of 4 bytes fill the whole cache.
+    clock.now += 1
+    response_cache.put("e", "😀" * 25)
+    assert [response_cache.get(key) for key in "acd"] == [None, None, None]
+    assert response_cache.get("e") == "😀" * 25
+
+
+def test_cached_responses_skip_the_backend(response_cache: ResponseCache, mock_backend, monkeypatch):
+    requests = []
+    create = mock_backend.create
+
+    def record_request(*args, **kwargs):
+        requests.append(kwargs)
+        return create(*args, **kwargs)
+
+    monkeypatch.setattr(mock_backend, "create", record_request)
+    response_cache.max_bytes = 1024 * 1024
+    messages = [{"role": "user", "content": "The stars counting the night and the sea."}]
+
+    usages = []
+    response = create_chat_completion(messages, TEST_LANG_MODEL, use_cache=True)
+    assert create_chat_completion(messages, TEST_LANG_MODEL, use_cache=True, on_usage=usages.append) == response
+    assert len(requests) == 1
+    assert usages == [{"prompt_tokens": 0, "completion_tokens": 0, "cached": True}]
+
+    create_chat_completion(messages, TEST_LANG_MODEL, temperature=0.5, use_cache=True)
+    assert len(requests) == 2
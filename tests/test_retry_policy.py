@@ -0,0 +1,201 @@
+import types
+
+import pytest
+
+from shorten_paper.lang_model import api_call, backends, retry_policy
+from shorten_paper.lang_model.api_call import create_chat_completion
+from shorten_paper.lang_model.retry_policy import ChatCompletionError, CircuitBreaker, CircuitOpenError, RetryPolicy
+from shorten_paper.singletone import Singleton
+
+from conftest import TEST_LANG_MODEL
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(retry_policy, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def circuit_breaker() -> CircuitBreaker:
+    """A circuit breaker of its own, not the process-wide one."""
+    Singleton._instances.pop(CircuitBreaker, None)
+    yield CircuitBreaker(failure_threshold=3, cooldown=10)
+    Singleton._instances.pop(CircuitBreaker, None)
+
+
+@pytest.fixture
+def openai():
+    """The openai 0.x SDK, whose error classes the retry policy and backends handle."""
+    openai = pytest.importorskip("openai")
+    if not hasattr(openai, "error"):
+        pytest.skip("openai 0.x is required")
+    return openai
+
+
+def _error(headers: dict = None) -> Exception:
+    error = Exception("Simulated API error.")
+    error.headers = headers
+    return error
+
+
+@pytest.mark.parametrize("try_num", range(8))
+def test_backoff_is_capped(try_num: int):
+    policy = RetryPolicy(max_retries=8, base_delay=0.5, max_delay=4, request_timeout=10)
+    for _ in range(200):
+        assert 0 <= policy.delay(try_num) <= min(4, 0.5 * 2 ** try_num)
+
+
+def test_retry_after_header():
+    assert RetryPolicy.retry_after(_error({"retry-after": "7"})) == 7
+    assert RetryPolicy.retry_after(_error({"Retry-After": "1.5"})) == 1.5
+    assert RetryPolicy.retry_after(_error({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+    assert RetryPolicy.retry_after(_error()) is None
+    assert RetryPolicy.retry_after(Exception()) is None
+
+
+def test_retry_after_overrides_a_shorter_backoff():
+    policy = RetryPolicy(max_retries=8, base_delay=0.5, max_delay=4, request_timeout=10)
+    for _ in range(200):
+        assert policy.delay(0, _error({"retry-after": "30"})) == 30
+        assert 0 <= policy.delay(5, _error({"retry-after": "0"})) <= 4
+
+
+def test_retryable_errors(openai):
+    policy = RetryPolicy()
+    assert policy.is_retryable(openai.error.RateLimitError("Rate limited."))
+    assert policy.is_retryable(openai.error.Timeout("Timed out."))
+    assert policy.is_retryable(openai.error.APIError("Bad gateway.", http_status=502))
+    assert not policy.is_retryable(openai.error.APIError("Bad request.", http_status=400))
+    assert not policy.is_retryable(openai.error.InvalidRequestError("Too long.", param=None))
+    assert not policy.is_retryable(ValueError())
+
+
+def test_only_outages_count_against_the_circuit_breaker(openai):
+    policy = RetryPolicy()
+    assert policy.is_outage(openai.error.Timeout("Timed out."))
+    assert policy.is_outage(openai.error.APIConnectionError("Connection reset."))
+    assert policy.is_outage(openai.error.ServiceUnavailableError("Overloaded.", http_status=503))
+    assert policy.is_outage(openai.error.APIError("Bad gateway.", http_status=502))
+    assert not policy.is_outage(openai.error.RateLimitError("Rate limited.", http_status=429))
+    assert not policy.is_outage(openai.error.APIError("Conflict.", http_status=409))
+
+
+def test_rate_limits_do_not_open_the_circuit(openai, circuit_breaker: CircuitBreaker, clock: _Clock, monkeypatch):
+    class RateLimitedBackend(backends.ChatBackend):
+        def create(self, *args, **kwargs):
+            raise openai.error.RateLimitError("Rate limited.", http_status=429)
+
+    monkeypatch.setattr(backends, "_backend", RateLimitedBackend())
+    monkeypatch.setattr(api_call.time, "sleep", lambda seconds: None)
+    with pytest.raises(ChatCompletionError):
+        create_chat_completion(
+            [{"role": "user", "content": "The stars counting the night."}], TEST_LANG_MODEL, use_cache=False,
+            retry_policy=RetryPolicy(max_retries=10, base_delay=0, max_delay=0, request_timeout=10)
+        )
+    assert circuit_breaker.opened_at is None
+    circuit_breaker.before_attempt()
+
+
+def test_a_throttled_trial_closes_the_circuit(circuit_breaker: CircuitBreaker, clock: _Clock):
+    for _ in range(3):
+        circuit_breaker.record_failure()
+    circuit_breaker.record_throttle()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_attempt()
+
+    clock.now += 10
+    circuit_breaker.before_attempt()
+    circuit_breaker.record_throttle()
+    circuit_breaker.before_attempt()
+
+
+def test_circuit_opens_after_the_threshold(circuit_breaker: CircuitBreaker, clock: _Clock):
+    for _ in range(2):
+        circuit_breaker.before_attempt()
+        circuit_breaker.record_failure()
+    circuit_breaker.before_attempt()
+    circuit_breaker.record_failure()
+
+    clock.now += 9
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_attempt()
+
+
+def test_a_success_resets_the_failure_count(circuit_breaker: CircuitBreaker, clock: _Clock):
+    for _ in range(2):
+        circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    for _ in range(2):
+        circuit_breaker.record_failure()
+    circuit_breaker.before_attempt()
+
+
+def test_a_successful_trial_closes_the_circuit(circuit_breaker: CircuitBreaker, clock: _Clock):
+    for _ in range(3):
+        circuit_breaker.record_failure()
+
+    clock.now += 10
+    circuit_breaker.before_attempt()
+    # Only the single trial is let through while it runs.
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_attempt()
+    circuit_breaker.record_success()
+
+    circuit_breaker.before_attempt()
+    circuit_breaker.before_attempt()
+
+
+def test_a_failed_trial_reopens_the_circuit(circuit_breaker: CircuitBreaker, clock: _Clock):
+    for _ in range(3):
+        circuit_breaker.record_failure()
+
+    clock.now += 10
+    circuit_breaker.before_attempt()
+    circuit_breaker.record_failure()
+
+    clock.now += 9
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_attempt()
+    clock.now += 1
+    circuit_breaker.before_attempt()
+
+
+def test_zero_threshold_never_opens(circuit_breaker: CircuitBreaker, clock: _Clock):
+    circuit_breaker.failure_threshold = 0
+    for _ in range(100):
+        circuit_breaker.record_failure()
+    circuit_breaker.before_attempt()
+
+
+def test_a_trial_ending_in_another_error_reopens_the_circuit(
+        openai, circuit_breaker: CircuitBreaker, clock: _Clock, monkeypatch
+):
+    monkeypatch.setattr(backends, "_backend", backends.MockBackend(latency=0, tokens_per_second=0, error_rate=0))
+    for _ in range(3):
+        circuit_breaker.record_failure()
+    clock.now += 10
+
+    def failing_writer(content: str) -> None:
+        raise OSError("No space left on device.")
+
+    with pytest.raises(OSError):
+        create_chat_completion(
+            [{"role": "user", "content": "The stars counting the night."}], TEST_LANG_MODEL,
+            use_cache=False, on_delta=failing_writer
+        )
+
+    # The failed trial opened the circuit for another cooldown, instead of leaving the trial running for good.
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_attempt()
+    clock.now += 10
+    circuit_breaker.before_attempt()
@@ -0,0 +1,72 @@
+import http.client
+import os
+import json
+import threading
+
+import pytest
+
+from shorten_paper import server as server_module
+from shorten_paper.server import ShortenService, serve
+
+
+@pytest.fixture
+def api_address(tmp_path, monkeypatch):
+    """The address of an API server without workers, so jobs stay queued."""
+    monkeypatch.setattr(server_module.CFG, "cache_dir", str(tmp_path))
+    api_server = serve("127.0.0.1", 0, ShortenService(workers=1, max_queued=4, max_upload_bytes=1024))
+    server_thread = threading.Thread(target=api_server.serve_forever, daemon=True)
+    server_thread.start()
+    yield api_server.server_address
+    api_server.shutdown()
+    api_server.server_close()
+
+
+def _post(address: tuple, body: bytes, content_len: str = None) -> tuple[int, dict]:
+    connection = http.client.HTTPConnection(*address, timeout=5)
+    connection.putrequest("POST", "/v1/jobs?filename=paper.txt")
+    connection.putheader("Content-Length", str(len(body)) if content_len is None else content_len)
+    connection.endheaders()
+    connection.send(body)
+    response = connection.getresponse()
+    status, body = response.status, json.loads(response.read())
+    connection.close()
+    return status, body
+
+
+@pytest.mark.parametrize("content_len", ["abc", "-1", "1.5"])
+def test_invalid_content_length_is_refused(api_address, content_len: str):
+    status, body = _post(api_address, b"", content_len)
+    assert status == 400
+    assert "Content-Length" in body["error"]["message"]
+
+
+def test_oversized_upload_is_refused(api_address):
+    assert _post(api_address, b"", "1025")[0] == 413
+
+
+def test_document_is_queued(api_address):
+    status, body = _post(api_address, b"The stars counting the night.")
+    assert status == 202
+    assert body["status"] == "queued"
+
+
+def test_finished_jobs_and_stray_uploads_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(server_module.CFG, "cache_dir", str(tmp_path))
+    service = ShortenService(workers=1, max_queued=10, max_upload_bytes=1024, job_ttl=3600, max_finished_jobs=2)
+    job_ids = [service.submit("paper.txt", b"The stars counting the night.", {}) for _ in range(5)]
+    for job_id in job_ids[:4]:
+        job = service.job_queue.claim(timeout=0)
+        os.remove(job["payload"]["upload_path"])
+        service.job_queue.finish(job["id"], {"document_len": 29, "shortened_len": 10, "text": "The stars."})
+    with open(os.path.join(service.upload_dir, "stray.txt"), "wb") as f:
+        f.write(b"Left behind by a stopped process.")
+
+    service.prune()
+
+    assert [service.job_queue.get(job_id) is not None for job_id in job_ids] == [False, False, True, True, True]
+    queued_upload_path = service.job_queue.get(job_ids[4])["payload"]["upload_path"]
+    assert os.listdir(service.upload_dir) == [os.path.basename(queued_upload_path)]
+
+    service.job_queue._connection.execute("UPDATE jobs SET updated_at = updated_at - 7200 WHERE status = 'done'")
+    service.prune()
+    assert service.job_queue.counts() == {"queued": 1, "running": 0, "done": 0, "failed": 0}
@@ -0,0 +1,92 @@
+import pytest
+
+from shorten_paper.lang_model.text_processing import (TokenizedText, split_with_context, split_with_next_text,
+                                                      split_with_previous_text, tokens_to_string)
+
+from conftest import TEST_LANG_MODEL
+
+TEXTS = [
+    "The stars counting the night and the sea.\n" * 20,
+    "한국 한국어 the 한국\n별 헤는 밤 " * 15,
+    "😀 the 😀😀 smile 😀\n" * 15,
+    "a",
+    "한",
+    "😀",
+]
+
+
+def _split_chunks(text: str, chunk_token_len: int) -> list[list[dict]]:
+    return [
+        [chunk["current_text"] for chunk in split_with_context(text, TEST_LANG_MODEL, chunk_token_len, 5, 5)],
+        [chunk["current_text"] for chunk in split_with_next_text(text, TEST_LANG_MODEL, chunk_token_len, 0.25)],
+        [chunk["current_text"] for chunk in split_with_previous_text(text, TEST_LANG_MODEL, chunk_token_len, 0.25)],
+    ]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("chunk_token_len", [1, 2, 3, 7, 50, 10000])
+def test_chunks_cover_the_text(text: str, chunk_token_len: int):
+    token_cnt = len(TokenizedText(text, TEST_LANG_MODEL))
+    for current_texts in _split_chunks(text, chunk_token_len):
+        assert "".join(current_text["text"] for current_text in current_texts) == text
+        assert sum(current_text["token_cnt"] for current_text in current_texts) == token_cnt
+        assert all(current_text["text"] for current_text in current_texts)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_chunk_context_is_adjacent_text(text: str):
+    tokenized_text = TokenizedText(text, TEST_LANG_MODEL)
+    token_start_idx = 0
+    while token_start_idx < len(tokenized_text):
+        chunk = tokenized_text.chunk_at(token_start_idx, 3, 4, 4)
+        current_start = len(tokenized_text.window(0, token_start_idx)["text"])
+        current_end = current_start + len(chunk["current_text"]["text"])
+        assert text[:current_start].endswith(chunk["previous_text"]["text"])
+        assert text[current_end:].startswith(chunk["next_text"]["text"])
+        assert chunk["previous_text"]["token_cnt"] <= 4
+        assert chunk["next_text"]["token_cnt"] <= 4
+        token_start_idx += chunk["current_text"]["token_cnt"]
+
+
+def test_multi_byte_codepoints_are_never_cut():
+    # "😀" is two tokens, so a one-token window has to grow to the end of the codepoint.
+    tokenized_text = TokenizedText("😀a", TEST_LANG_MODEL)
+    assert len(tokenized_text) == 3
+    assert tokenized_text.chunk_at(0, 1, 0, 0)["current_text"] == {"text": "😀", "token_cnt": 2}
+    assert tokenized_text.snap_back(1) == 0
+    assert tokenized_text.snap_forward(1) == 2
+    assert tokenized_text.snap_back(0) == 0
+    assert tokenized_text.snap_forward(len(tokenized_text)) == len(tokenized_text)
+
+
+def test_tokens_crossing_codepoints_are_kept_together():
+    # The second token of "한국" holds the end of "한" and the start of "국", so no cut fits between them.
+    tokenized_text = TokenizedText("한국", TEST_LANG_MODEL)
+    assert tokenized_text.snap_back(len(tokenized_text) - 1) == 0
+    assert tokenized_text.snap_forward(1) == len(tokenized_text)
+    assert tokenized_text.chunk_at(0, 1, 0, 0)["current_text"]["text"] == "한국"
+    assert tokenized_text.prefix(len(tokenized_text) - 1).text == ""
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_prefix_matches_a_fresh_tokenization(text: str):
+    tokenized_text = TokenizedText(text, TEST_LANG_MODEL)
+    for token_cnt in range(len(tokenized_text) + 2):
+        prefix = tokenized_text.prefix(token_cnt)
+        fresh = TokenizedText(prefix.text, TEST_LANG_MODEL, prefix.tokens)
+        assert text.startswith(prefix.text)
+        assert len(prefix) <= token_cnt
+        assert prefix._boundaries == fresh._boundaries
+        assert prefix._char_offsets == fresh._char_offsets
+
+
+def test_tokens_to_string_keeps_whole_codepoints():
+    tokens = TokenizedText("😀한국", TEST_LANG_MODEL).tokens
+    assert tokens_to_string(tokens, TEST_LANG_MODEL, None, 3) == ("😀", 2)
+    assert tokens_to_string(tokens, TEST_LANG_MODEL, 1, None, from_back=False) == ("한국", 4)
+    assert tokens_to_string(tokens, TEST_LANG_MODEL, None, 0) == ("", 0)
+    assert tokens_to_string(tokens, TEST_LANG_MODEL, len(tokens), None) == ("", 0)
+    for token_end_idx in range(1, len(tokens) + 1):
+        string, token_cnt = tokens_to_string(tokens, TEST_LANG_MODEL, None, token_end_idx)
+        # Without a whole codepoint in the window, the window is decoded lossily instead.
+        assert "😀한국".startswith(string) or ("\ufffd" in string and token_cnt == token_end_idx)
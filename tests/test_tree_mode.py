@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from shorten_paper import file_operations_utils
+from shorten_paper.file_operations_utils import _group_parts, shorten_text_hierarchically
+from shorten_paper.lang_model.text_processing import TokenizedText, request_token_budget
+
+from conftest import TEST_LANG_MODEL
+
+TEXT = "The stars counting the night and the sea.\n" * 200
+
+
+def _shorten(**kwargs) -> tuple:
+    levels, levels_done = set(), []
+    shortened_text = shorten_text_hierarchically(
+        TEXT, "test.txt", "", TEST_LANG_MODEL, shorten_ratio=0.5, shorten_repeat=1,
+        on_chunk_done=lambda level, chunk_idx, output: levels.add(level),
+        on_pass_done=lambda level, level_text: levels_done.append(level), **kwargs
+    )
+    return shortened_text, sorted(levels), levels_done
+
+
+def test_groups_fit_the_budget():
+    assert _group_parts([3, 3, 3, 3], 7, 1) == [range(0, 2), range(2, 4)]
+    assert _group_parts([3, 3, 3, 3], 6, 1) == [range(0, 1), range(1, 2), range(2, 3), range(3, 4)]
+    # A part over the budget is a group of its own.
+    assert _group_parts([2, 10, 2], 5, 1) == [range(0, 1), range(1, 2), range(2, 3)]
+    assert _group_parts([4], 1, 1) == [range(0, 1)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_groups_cover_the_parts_in_order(seed: int):
+    random_ = random.Random(seed)
+    part_token_cnts = [random_.randint(1, 50) for _ in range(random_.randint(1, 40))]
+    groups = _group_parts(part_token_cnts, 60, 2)
+    assert [i for group in groups for i in group] == list(range(len(part_token_cnts)))
+    for group in groups:
+        group_token_cnt = sum(part_token_cnts[i] for i in group) + 2 * (len(group) - 1)
+        assert group_token_cnt <= 60 or len(group) == 1
+
+
+def test_requests_fit_the_budget(mock_backend, monkeypatch):
+    monkeypatch.setattr(file_operations_utils.CFG, "text_token_len", 1500)
+    token_costs = []
+    request_shortening = file_operations_utils._request_shortening
+
+    def record_token_cost(messages, lang_model, token_cost=None, on_delta=None, on_usage=None):
+        token_costs.append(token_cost)
+        return request_shortening(messages, lang_model, token_cost, on_delta, on_usage)
+
+    monkeypatch.setattr(file_operations_utils, "_request_shortening", record_token_cost)
+    shortened_text, levels, levels_done = _shorten(target_ratio=0.1, max_levels=10)
+
+    assert len(levels) > 2
+    assert len(shortened_text) <= len(TEXT) * 0.1
+    assert token_costs and max(token_costs) <= request_token_budget(TEST_LANG_MODEL)
+
+
+def test_levels_stop_at_the_target(mock_backend):
+    # Each level halves the text, so 0.3 of the original is reached at the second level.
+    shortened_text, levels, levels_done = _shorten(target_ratio=0.3, max_levels=10)
+    assert levels == [0, 1]
+    assert levels_done == [0]
+
+
+def test_levels_stop_at_the_maximum(mock_backend):
+    last_pieces = []
+    shortened_text, levels, levels_done = _shorten(target_ratio=0, max_levels=3, write_last=last_pieces.append)
+    assert levels == [0, 1, 2]
+    # The last level is not handed over as a pass followed by another.
+    assert levels_done == [0, 1]
+    assert last_pieces == [shortened_text.text]
+
+
+def test_a_level_not_shortening_the_text_stops_the_reduction(mock_backend):
+    # Every chunk is answered whole, and the newlines joining the outputs make the level longer than its input.
+    mock_backend.output_ratio = 1.0
+    shortened_text, levels, levels_done = _shorten(target_ratio=0.1, max_levels=10)
+    assert levels == [0]
+    assert levels_done == []
+    assert len(shortened_text) >= len(TokenizedText(TEXT, TEST_LANG_MODEL))